@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -45,6 +46,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'notebooks.metrics.MetricsMiddleware',
+    'notebooks.routing.ReplicaRoutingMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -76,7 +79,11 @@ TEMPLATES = [
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'notebooks.metrics.TimedTokenAuthentication',
+    ],
+    'DEFAULT_RENDERER_CLASSES': [
+        'notebooks.metrics.TimedJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
@@ -100,6 +107,30 @@ DATABASES = {
     }
 }
 
+# HIVEMIND_DB=sqlite runs against a local SQLite file instead, e.g. for
+# `generate_dataset` / `run_benchmark` on a machine without Postgres.
+if os.environ.get('HIVEMIND_DB') == 'sqlite':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': BASE_DIR / 'db.sqlite3',
+        }
+    }
+
+# HIVEMIND_DB_REPLICAS=host1,host2 adds read replicas of the database as
+# aliases replica1, replica2... (see notebooks/routing.py). With
+# HIVEMIND_DB=sqlite any value adds one 'replica' alias that reads the same
+# file over its own connection, to try the routing locally. Tests run
+# replicas as mirrors of 'default'.
+if os.environ.get('HIVEMIND_DB_REPLICAS'):
+    if DATABASES['default']['ENGINE'].endswith('sqlite3'):
+        DATABASES['replica'] = {**DATABASES['default'], 'TEST': {'MIRROR': 'default'}}
+    else:
+        for index, host in enumerate(os.environ['HIVEMIND_DB_REPLICAS'].split(','), start=1):
+            DATABASES[f'replica{index}'] = {**DATABASES['default'], 'HOST': host.strip(), 'TEST': {'MIRROR': 'default'}}
+
+DATABASE_ROUTERS = ['notebooks.routing.ReplicaRouter']
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -148,3 +179,100 @@ CORS_ALLOWED_ORIGINS = [
     "http://127.0.0.1:5173",
 ]
 CORS_ALLOW_CREDENTIALS = True
+
+# Version storage: 'full' keeps the whole page text on every Version, 'delta'
+# stores a line diff against previous_version with a full snapshot every
+# HIVEMIND_VERSION_SNAPSHOT_INTERVAL versions.
+HIVEMIND_VERSION_STORAGE = 'delta'
+HIVEMIND_VERSION_SNAPSHOT_INTERVAL = 20
+# Total characters of rebuilt version texts kept in memory per process
+HIVEMIND_VERSION_CACHE_CHARS = 16000000
+
+# Broker that fans out vote/post/merge events to the SSE streams. The default
+# passes them through the database, so events from the merge worker and
+# other server processes reach every stream. 'notebooks.events.InProcessBroker'
+# only reaches listeners in the publishing process, and run_merge_worker
+# refuses to run with it.
+HIVEMIND_EVENT_BROKER = 'notebooks.events.DatabaseBroker'
+# Browsers open the streams with a ticket from POST .../events/ticket/ rather
+# than their API token; it must be used within this many seconds.
+HIVEMIND_STREAM_TICKET_SECONDS = 60
+
+# Merges queued by votes are applied by `manage.py run_merge_worker`. A failed
+# job is retried after HIVEMIND_MERGE_RETRY_SECONDS, doubling each time, and is
+# marked failed after HIVEMIND_MERGE_MAX_ATTEMPTS attempts.
+HIVEMIND_MERGE_MAX_ATTEMPTS = 5
+HIVEMIND_MERGE_RETRY_SECONDS = 5
+
+# Text search configuration for the notebook search index on PostgreSQL
+# (stemming and stop words); other databases match whole words.
+HIVEMIND_SEARCH_CONFIG = 'english'
+
+# Seconds each user's notebook memberships stay cached. Changes invalidate the
+# entry right away; with several processes use a shared cache backend so they
+# all see the invalidation.
+HIVEMIND_MEMBERSHIP_CACHE_TIMEOUT = 300
+
+# Per-request timings (auth, db, app, serialize and render, with the view name
+# on total): a Server-Timing header on every response and Prometheus
+# histograms at /api/metrics/. Staff users can read them; scrapers send
+# 'Authorization: Bearer <HIVEMIND_METRICS_TOKEN>' (None disables token access).
+# HIVEMIND_METRICS_ALLOW_INTERNAL_IPS also lets anonymous INTERNAL_IPS in, which
+# is only safe when REMOTE_ADDR cannot be spoofed by a proxy in front.
+# Requests slower than HIVEMIND_SLOW_REQUEST_MS milliseconds are logged to
+# 'notebooks.slow_requests' with their slowest queries; None disables the log.
+HIVEMIND_METRICS = True
+HIVEMIND_SLOW_REQUEST_MS = None
+HIVEMIND_METRICS_TOKEN = None
+HIVEMIND_METRICS_ALLOW_INTERNAL_IPS = False
+INTERNAL_IPS = ['127.0.0.1']
+
+# Version, draft and post bodies of at least this many bytes are stored
+# compressed with this codec ('zlib', 'lzma', or 'zstd' with the zstandard
+# package installed). Stored bodies stay readable after changing either.
+HIVEMIND_COMPRESSION_CODEC = 'zlib'
+HIVEMIND_COMPRESSION_MIN_BYTES = 1024
+
+# Draft, post and version text lives in shared blobs keyed by its hash.
+# `manage.py collect_blobs` deletes blobs nothing refers to once they have
+# been unused for this long; writes must commit well within it.
+HIVEMIND_BLOB_GC_GRACE_SECONDS = 3600
+
+# Most operations one POST /api/batch/ request may run (see notebooks/batch.py).
+HIVEMIND_BATCH_MAX_OPERATIONS = 20
+
+# Seconds a notebook workspace snapshot (GET /api/notebooks/<id>/workspace/)
+# stays cached per user. Writes invalidate it right away; see workspace.py.
+HIVEMIND_WORKSPACE_CACHE_TIMEOUT = 300
+
+# Token -> user lookups are cached for HIVEMIND_TOKEN_CACHE_TTL seconds:
+# 'shared' uses the default cache so logouts, token rotation and deactivations
+# reach every process at once; 'local' keeps up to HIVEMIND_TOKEN_CACHE_SIZE
+# entries per process, and other processes go on accepting a revoked token
+# for up to the TTL; None looks every token up. 'auto' is 'shared' unless the
+# default cache is LocMemCache or DummyCache, which are per process anyway, so
+# configure a shared CACHES backend when running several processes. See
+# notebooks/authentication.py.
+HIVEMIND_TOKEN_CACHE = 'auto'
+HIVEMIND_TOKEN_CACHE_TTL = 60
+HIVEMIND_TOKEN_CACHE_SIZE = 10000
+
+# Database aliases that reads of GET/HEAD/OPTIONS requests go to; None means
+# every DATABASES alias besides 'default'. A client's reads stay on 'default'
+# for HIVEMIND_REPLICA_STICKY_SECONDS after each of its unsafe requests, so
+# it reads its own writes despite replication lag; a signed cookie carries
+# this between requests, whichever process serves them.
+HIVEMIND_READ_REPLICAS = None
+HIVEMIND_REPLICA_STICKY_SECONDS = 5
+
+# Serve GET on the page, version and post lists, single versions and version
+# compare from async views (notebooks.views.AsyncReadView) under ASGI. Off
+# until `manage.py benchmark_async` shows they beat the sync DRF views on
+# your deployment; they mostly help when many requests wait on the database.
+HIVEMIND_ASYNC_READ_VIEWS = False
+
+# Edit scripts from the version compare endpoint (?diff=) are cached for this
+# many seconds, unless they hold more than HIVEMIND_DIFF_CACHE_MAX_CHARS
+# characters of text.
+HIVEMIND_DIFF_CACHE_TIMEOUT = 3600
+HIVEMIND_DIFF_CACHE_MAX_CHARS = 1000000
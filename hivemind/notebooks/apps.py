@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class NotebooksConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'notebooks'
+
+    def ready(self):
+        # Connects the token, membership and workspace cache invalidation
+        # signals, and the query timing of every new database connection
+        from . import authentication, membership, metrics, workspace  # noqa: F401
@@ -0,0 +1,208 @@
+"""Token authentication with the token -> user lookup cached.
+
+TokenAuthentication joins Token to User on every request. Here resolved
+tokens are kept for HIVEMIND_TOKEN_CACHE_TTL seconds, either in a bounded
+in-process LRU ('local') or in the default Django cache ('shared'), as
+HIVEMIND_TOKEN_CACHE says; None turns caching off. 'auto', the default,
+picks 'shared' unless the default cache is itself per process.
+
+Entries are dropped when a token is deleted (djoser logout, password
+change with LOGOUT_ON_PASSWORD_CHANGE, user deletion) and when its user is
+saved (deactivation, username or permission changes). A 'local' cache only
+sees the changes its own process makes; other processes keep accepting a
+revoked token for up to the TTL.
+"""
+import copy
+import hashlib
+import threading
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import DEFAULT_CACHE_ALIAS, cache
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils.translation import gettext_lazy as _
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication, get_authorization_header
+from rest_framework.authtoken.models import Token
+
+from .caching import cache_timeout, invalidate_on_commit
+from .models import User
+from .versioning import LRUCache
+
+AUTO = 'auto'
+LOCAL = 'local'
+SHARED = 'shared'
+
+# Cache backends no other process can see
+PROCESS_LOCAL_BACKENDS = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+def cache_mode():
+    mode = getattr(settings, 'HIVEMIND_TOKEN_CACHE', AUTO)
+    if mode == AUTO:
+        backend = settings.CACHES.get(DEFAULT_CACHE_ALIAS, {}).get('BACKEND')
+        return LOCAL if backend in PROCESS_LOCAL_BACKENDS else SHARED
+    return mode
+
+
+def cache_key(key):
+    # Raw tokens stay out of cache keys
+    return 'hivemind:token:' + hashlib.sha256(key.encode()).hexdigest()
+
+
+class TTLCache(LRUCache):
+    """LRUCache whose entries also expire `ttl` seconds after being set."""
+
+    def get(self, key, default=None):
+        entry = super().get(key)
+        if entry is None or entry[0] < time.monotonic():
+            return default
+        return entry[1]
+
+    def set(self, key, value, ttl):
+        super().set(key, (time.monotonic() + ttl, value))
+
+
+token_cache = TTLCache(getattr(settings, 'HIVEMIND_TOKEN_CACHE_SIZE', 10000))
+# Bumped by every invalidation, so a lookup that raced one is not stored
+_generation = 0
+_generation_lock = threading.Lock()
+
+
+def _cached(key):
+    mode = cache_mode()
+    if mode == LOCAL:
+        user = token_cache.get(cache_key(key))
+    elif mode == SHARED:
+        user = cache.get(cache_key(key))
+    else:
+        return None
+    # Each request gets its own instance
+    return copy.copy(user) if user is not None else None
+
+
+def _store(key, user, generation):
+    mode = cache_mode()
+    if generation != _generation:
+        return
+    if mode == LOCAL:
+        token_cache.set(cache_key(key), user, cache_timeout('HIVEMIND_TOKEN_CACHE_TTL', 60))
+    elif mode == SHARED:
+        cache.set(cache_key(key), user, cache_timeout('HIVEMIND_TOKEN_CACHE_TTL', 60))
+
+
+def resolve_token(key):
+    """The user that token `key` belongs to, or None.
+
+    Read from the primary: a token created at login is used right away,
+    before it would reach a read replica.
+    """
+    user = _cached(key)
+    if user is not None:
+        return user
+    generation = _generation
+    token = Token.objects.using(DEFAULT_DB_ALIAS).select_related('user').filter(key=key).first()
+    if token is None:
+        return None
+    _store(key, token.user, generation)
+    return token.user
+
+
+async def aresolve_token(key):
+    """resolve_token for async views."""
+    if cache_mode() == SHARED:
+        # Django cache clients are synchronous
+        return await sync_to_async(resolve_token)(key)
+    user = _cached(key)
+    if user is not None:
+        return user
+    generation = _generation
+    token = await Token.objects.using(DEFAULT_DB_ALIAS).select_related('user').filter(key=key).afirst()
+    if token is None:
+        return None
+    _store(key, token.user, generation)
+    return token.user
+
+
+def invalidate(keys):
+    keys = [cache_key(key) for key in keys]
+    if not keys:
+        return
+
+    def drop():
+        global _generation
+        with _generation_lock:
+            _generation += 1
+        for key in keys:
+            token_cache.delete(key)
+        if cache_mode() == SHARED:
+            cache.delete_many(keys)
+    invalidate_on_commit(drop)
+
+
+@receiver(post_delete, sender=Token)
+def token_deleted(sender, instance, **kwargs):
+    invalidate([instance.key])
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, created, update_fields=None, **kwargs):
+    # Logins only touch last_login, which authentication does not depend on
+    if created or (update_fields is not None and set(update_fields) <= {'last_login'}):
+        return
+    invalidate(Token.objects.filter(user_id=instance.pk).values_list('key', flat=True))
+
+
+async def authenticate_request(request):
+    """Authenticate a DRF request from an async view.
+
+    Like Request._authenticate, but authenticators with an aauthenticate()
+    are awaited, so resolving a token does not block the event loop.
+    """
+    for authenticator in request.authenticators:
+        try:
+            if hasattr(authenticator, 'aauthenticate'):
+                user_auth = await authenticator.aauthenticate(request)
+            else:
+                user_auth = authenticator.authenticate(request)
+        except exceptions.APIException:
+            request._not_authenticated()
+            raise
+        if user_auth is not None:
+            request._authenticator = authenticator
+            request.user, request.auth = user_auth
+            return
+    request._not_authenticated()
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """TokenAuthentication that resolves tokens through the cache above."""
+
+    def authenticate_credentials(self, key):
+        return self.check_user(key, resolve_token(key))
+
+    async def aauthenticate(self, request):
+        """authenticate() for async views."""
+        auth = get_authorization_header(request).split()
+        if len(auth) == 2 and auth[0].lower() == self.keyword.lower().encode():
+            try:
+                key = auth[1].decode()
+            except UnicodeError:
+                pass
+            else:
+                return self.check_user(key, await aresolve_token(key))
+        # No token, or a malformed header that authenticate() rejects without a query
+        return self.authenticate(request)
+
+    def check_user(self, key, user):
+        if user is None:
+            raise exceptions.AuthenticationFailed(_('Invalid token.'))
+        if not user.is_active:
+            raise exceptions.AuthenticationFailed(_('User inactive or deleted.'))
+        return (user, Token(key=key, user=user))
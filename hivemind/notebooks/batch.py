@@ -0,0 +1,179 @@
+"""Running several API operations in one request (POST /api/batch/).
+
+A batch is an ordered list of operations, each ``{"method", "path", "body"}``.
+They run one after the other through the project's middleware and the
+normal notebooks API views, with the batch request's credentials and
+inside one transaction: the first operation that fails rolls back the
+whole batch and the rest are not run.
+
+A later operation can use an earlier result with a reference
+``{$N.field}``, where N is the operation's index and the dotted path
+walks its response body (list items by number), e.g.
+``/api/notebooks/{$0.notebook_id}/``. References are filled in anywhere
+in the path. In the body only a string that is exactly one reference is
+replaced, by the referenced value itself, so text fields such as draft
+content are never rewritten.
+"""
+import json
+import re
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.core.handlers.base import BaseHandler
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.http import HttpRequest, QueryDict
+from django.urls import Resolver404, resolve
+from rest_framework.views import APIView
+
+METHODS = ('GET', 'POST', 'PUT', 'PATCH', 'DELETE')
+REFERENCE = re.compile(r'\{\$(\d+)((?:\.[\w-]+)*)\}')
+# Headers that belong to the batch request itself, not to its operations
+_REQUEST_ONLY = ('CONTENT_TYPE', 'CONTENT_LENGTH', 'QUERY_STRING', 'HTTP_IF_')
+# Only the notebooks API can be batched, not auth (djoser) or admin views
+ALLOWED_ROUTES = ('api/',)
+EXCLUDED_VIEWS = ('batch', 'metrics')
+
+
+def max_operations():
+    return getattr(settings, 'HIVEMIND_BATCH_MAX_OPERATIONS', 20)
+
+
+class BatchError(ValueError):
+    def __init__(self, index, detail):
+        super().__init__(detail)
+        self.index = index
+        self.detail = detail
+
+
+def parse_operations(data):
+    """Validate a batch request body and return its operations."""
+    operations = data.get('operations') if isinstance(data, dict) else None
+    if not isinstance(operations, list) or not operations:
+        raise BatchError(None, "'operations' must be a non-empty list.")
+    if len(operations) > max_operations():
+        raise BatchError(None, f"A batch may have at most {max_operations()} operations.")
+    for index, operation in enumerate(operations):
+        if not isinstance(operation, dict) or not set(operation) <= {'method', 'path', 'body'}:
+            raise BatchError(index, "Each operation must be an object with 'method', 'path' and optionally 'body'.")
+        if operation.get('method') not in METHODS:
+            raise BatchError(index, f"'method' must be one of {', '.join(METHODS)}.")
+        if not isinstance(operation.get('path'), str):
+            raise BatchError(index, "'path' must be a string.")
+    return operations
+
+
+def _lookup(results, index, match):
+    position = int(match.group(1))
+    if position >= index:
+        raise BatchError(index, f"{match.group(0)} refers to an operation that has not run yet.")
+    value = results[position]['body']
+    for key in match.group(2).split('.')[1:]:
+        try:
+            value = value[int(key)] if isinstance(value, list) else value[key]
+        except (KeyError, IndexError, TypeError, ValueError):
+            raise BatchError(index, f"{match.group(0)} does not exist in the result of operation {position}.")
+    return value
+
+
+def fill_references(value, results, index):
+    """`value` with the references to earlier `results` replaced."""
+    if isinstance(value, dict):
+        return {key: fill_references(item, results, index) for key, item in value.items()}
+    if isinstance(value, list):
+        return [fill_references(item, results, index) for item in value]
+    if isinstance(value, str):
+        match = REFERENCE.fullmatch(value)
+        if match:
+            return _lookup(results, index, match)
+    return value
+
+
+def fill_path(path, results, index):
+    return REFERENCE.sub(lambda match: str(_lookup(results, index, match)), path)
+
+
+def _subrequest(request, method, path, body):
+    """A Django request for one operation, with `request`'s headers and cookies.
+
+    It carries the batch's Authorization header, so each operation is
+    authenticated like any other request.
+    """
+    url = urlsplit(path)
+    sub = HttpRequest()
+    sub.method = method
+    sub.path = sub.path_info = url.path
+    sub.META = {
+        key: value for key, value in request.META.items()
+        if not key.startswith(_REQUEST_ONLY)
+    }
+    sub.META.update(REQUEST_METHOD=method, PATH_INFO=url.path, QUERY_STRING=url.query)
+    sub.GET = QueryDict(url.query)
+    sub.COOKIES = request.COOKIES
+    if body is not None:
+        sub._body = json.dumps(body).encode('utf-8')
+        sub._read_started = True
+        sub.META.update(CONTENT_TYPE='application/json', CONTENT_LENGTH=str(len(sub._body)))
+    return sub
+
+
+class OperationHandler(BaseHandler):
+    """Runs operations through MIDDLEWARE, to the view run_operation picked."""
+
+    def __init__(self):
+        super().__init__()
+        self.load_middleware()
+
+    def resolve_request(self, request):
+        match = request.resolver_match
+        return request.batch_view, match.args, match.kwargs
+
+
+_handler = None
+
+
+def get_handler():
+    global _handler
+    if _handler is None:
+        _handler = OperationHandler()
+    return _handler
+
+
+@receiver(setting_changed)
+def reset_handler(setting, **kwargs):
+    global _handler
+    if setting == 'MIDDLEWARE':
+        _handler = None
+
+
+def run_operation(request, index, operation, results):
+    """Run one operation through its view. Returns {'status', 'body'}."""
+    path = fill_path(operation['path'], results, index)
+    body = fill_references(operation.get('body'), results, index)
+    try:
+        match = resolve(urlsplit(path).path)
+    except Resolver404:
+        raise BatchError(index, f"No API endpoint at {path}.")
+    # Async read views hand everything but GET to a sync view; batches use it for GET too
+    func = getattr(match.func, 'sync_view', match.func)
+    view_class = getattr(func, 'cls', None)
+    if (
+        not match.route.startswith(ALLOWED_ROUTES) or match.url_name in EXCLUDED_VIEWS
+        or view_class is None or not issubclass(view_class, APIView)
+        or getattr(view_class, 'view_is_async', False)
+    ):
+        raise BatchError(index, f"{path} cannot be used in a batch.")
+
+    sub = _subrequest(request, operation['method'], path, body)
+    sub.resolver_match = match
+    sub.batch_view = func
+    response = get_handler().get_response(sub)
+    if response.streaming:
+        raise BatchError(index, f"{path} streams its response and cannot be used in a batch.")
+    if hasattr(response, 'data'):
+        data = response.data
+    elif response.get('Content-Type', '').startswith('application/json'):
+        data = json.loads(response.content)
+    else:
+        data = None
+    return {'status': response.status_code, 'body': data}
@@ -0,0 +1,456 @@
+"""Synthetic datasets and an endpoint benchmark, used by the
+`generate_dataset` and `run_benchmark` management commands."""
+import asyncio
+import math
+import platform
+import random
+import subprocess
+import threading
+import time
+from datetime import datetime, timezone
+
+import django
+from asgiref.sync import ThreadSensitiveContext, sync_to_async
+from django.conf import settings
+from django.db import connection, connections, transaction
+from django.test import AsyncRequestFactory, Client, RequestFactory
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import resolve, reverse
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+from .authentication import CachedTokenAuthentication, LOCAL, SHARED, invalidate
+from .counters import repair_counters
+from .fields import CODECS, decode_text, encode_text
+from .models import User, Notebook, Page, Version, Draft, Post, Vote, Blob
+from .versioning import create_version
+from .views import (
+    AsyncPageListCreateView, AsyncPostListCreateView, AsyncVersionCompareView, AsyncVersionListView, AsyncVersionSingleView,
+)
+
+USER_PREFIX = 'bench_'
+WORDS = (
+    'alpha beta gamma delta notes summary draft review merge page version idea plan '
+    'result method data model theory proof lemma example figure table section'
+).split()
+
+
+def _line(rng):
+    return ' '.join(rng.choice(WORDS) for _ in range(rng.randint(4, 12))) + '\n'
+
+
+def _edit(rng, text):
+    """A plausible small edit: change, insert or delete a few lines."""
+    lines = text.splitlines(keepends=True) or [_line(rng)]
+    for _ in range(rng.randint(1, 3)):
+        i = rng.randrange(len(lines))
+        action = rng.random()
+        if action < 0.5:
+            lines[i] = _line(rng)
+        elif action < 0.85 or len(lines) < 3:
+            lines.insert(i, _line(rng))
+        else:
+            del lines[i]
+    return ''.join(lines)
+
+
+def flush_dataset():
+    """Delete everything a previous generate_dataset created."""
+    users = User.objects.filter(username__startswith=USER_PREFIX)
+    Notebook.objects.filter(admin_id__in=users).delete()
+    users.delete()
+
+
+@transaction.atomic
+def generate_dataset(users=50, notebooks=5, members=10, pages=10, versions=50,
+                     posts=100, votes=20, seed=0):
+    """Create a reproducible dataset; the same arguments give the same shape.
+
+    Each notebook gets `members` random members, `pages` pages with a chain
+    of `versions` versions each, and `posts` posts per page with up to
+    `votes` votes each. Versions go through create_version, so delta
+    storage and the search index look like production.
+    """
+    rng = random.Random(seed)
+    people = User.objects.bulk_create([User(username=f'{USER_PREFIX}{seed}_{i}') for i in range(users)])
+    Token.objects.bulk_create([Token(user=user, key=Token.generate_key()) for user in people])
+
+    Membership = Notebook.user_ids.through
+    counts = {'users': users, 'notebooks': notebooks, 'pages': 0, 'versions': 0, 'posts': 0, 'votes': 0}
+    created = []
+    for n in range(notebooks):
+        notebook = Notebook.objects.create(title=f'Benchmark {n}', admin_id=people[n % users], merge_threshold=None)
+        created.append(notebook.pk)
+        Membership.objects.bulk_create([
+            Membership(notebook_id=notebook.pk, user_id=user.pk)
+            for user in rng.sample(people, min(members, users))
+        ], ignore_conflicts=True)
+
+        for p in range(pages):
+            page = Page.objects.create(title=f'Page {n}.{p}', notebook_id=notebook)
+            text = ''.join(_line(rng) for _ in range(rng.randint(20, 60)))
+            version = None
+            for _ in range(versions):
+                version = create_version(page, rng.choice(people), version, text)
+                text = _edit(rng, text)
+            page.latest_version = version
+            page.save()
+
+            drafts = Draft.objects.bulk_create([
+                Draft(user_id=rng.choice(people), page_id=page, content=_edit(rng, text)) for _ in range(posts)
+            ])
+            page_posts = Post.objects.bulk_create([
+                Post(user_id=draft.user_id, page_id=page, draft_id=draft, blob_id=draft.blob_id)
+                for draft in drafts
+            ])
+            page_votes = []
+            for post in page_posts:
+                voters = rng.sample(people, min(rng.randint(0, votes), users))
+                post.votes = len(voters)
+                page_votes += [Vote(post_id=post, user_id=voter) for voter in voters]
+            Post.objects.bulk_update(page_posts, ['votes'])
+            Vote.objects.bulk_create(page_votes)
+
+            counts['pages'] += 1
+            counts['versions'] += versions
+            counts['posts'] += len(page_posts)
+            counts['votes'] += len(page_votes)
+    # Drafts, posts and members were bulk inserted around the counters
+    repair_counters(Notebook.objects.filter(pk__in=created))
+    return counts
+
+
+def percentile(samples, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not samples:
+        return None
+    return samples[max(0, math.ceil(pct / 100 * len(samples)) - 1)]
+
+
+def _endpoints(notebook, page, post, version):
+    nb, pg = notebook.notebook_id, page.page_id
+    word = WORDS[0]
+    return [
+        ('notebook-list', 'get', reverse('notebook-list-create'), {}),
+        ('notebook-detail', 'get', reverse('notebook-detail', args=[nb]), {'expand': 'admin_id,user_ids'}),
+        ('workspace', 'get', reverse('notebook-workspace', args=[nb]), {}),
+        ('page-list', 'get', reverse('page-list-create', args=[nb]), {'expand': 'latest_version.content'}),
+        ('page-detail', 'get', reverse('page-detail', args=[nb, pg]), {}),
+        ('version-list', 'get', reverse('version-list', args=[nb, pg]), {'expand': 'user_id'}),
+        ('version-single', 'get', reverse('version-single', args=[nb, pg, version.version_id]), {'expand': 'content'}),
+        ('version-compare', 'get', reverse('version-compare', args=[nb, pg]), {'version1': version.version_id, 'diff': 'line'}),
+        ('draft-list', 'get', reverse('draft-list-create', args=[nb]), {}),
+        ('post-list', 'get', reverse('post-list-create', args=[nb, pg]), {'expand': 'user_id'}),
+        ('search', 'get', reverse('notebook-search', args=[nb]), {'q': word}),
+        ('vote', 'patch', reverse('vote-post', args=[nb, pg, post.post_id]), {}),
+    ]
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR,
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _targets():
+    """The generated notebook, page, post and version the benchmarks request."""
+    page = (
+        Page.objects.filter(notebook_id__admin_id__username__startswith=USER_PREFIX, page_to_update__isnull=False)
+        .select_related('notebook_id__admin_id').order_by('created_at').first()
+    )
+    if page is None:
+        raise ValueError("No benchmark data; run generate_dataset first.")
+    post = Post.objects.filter(page_id=page).first()
+    # The deepest delta is the most expensive version to rebuild
+    version = Version.objects.filter(page_id=page).order_by('-chain_depth', 'created_at').first()
+    return page.notebook_id, page, post, version
+
+
+def _succeeded(name, response):
+    if not 200 <= response.status_code < 300:
+        raise ValueError(f"{name} answered {response.status_code}; benchmark results would time an error response.")
+
+
+def run_benchmark(requests=200, warmup=10, only=None):
+    """Drive the API routes as a generated member and return the results dict.
+
+    Requests go through the full middleware and TokenAuthentication stack
+    in-process, so numbers exclude network and server overhead. Raises
+    ValueError if any request does not succeed, so error responses are
+    never measured as if they were the endpoint.
+    """
+    notebook, page, post, version = _targets()
+    token, _ = Token.objects.get_or_create(user=notebook.admin_id)
+    client = Client(HTTP_AUTHORIZATION=f'Token {token.key}')
+
+    results = {}
+    # The test client's host, which ALLOWED_HOSTS would reject with DEBUG off
+    with override_settings(ALLOWED_HOSTS=['testserver']):
+        for name, method, url, params in _endpoints(notebook, page, post, version):
+            if only and name not in only:
+                continue
+            call = getattr(client, method)
+            for _ in range(warmup):
+                _succeeded(name, call(url, params))
+
+            timings, queries = [], []
+            started = time.perf_counter()
+            for _ in range(requests):
+                with CaptureQueriesContext(connection) as ctx:
+                    t0 = time.perf_counter()
+                    response = call(url, params)
+                    timings.append((time.perf_counter() - t0) * 1000)
+                queries.append(len(ctx.captured_queries))
+                _succeeded(name, response)
+            elapsed = time.perf_counter() - started
+
+            timings.sort()
+            results[name] = {
+                'method': method.upper(),
+                'url': url,
+                'requests': requests,
+                'p50_ms': round(percentile(timings, 50), 3),
+                'p95_ms': round(percentile(timings, 95), 3),
+                'p99_ms': round(percentile(timings, 99), 3),
+                'mean_ms': round(sum(timings) / len(timings), 3),
+                'throughput_rps': round(requests / elapsed, 1),
+                'queries_mean': round(sum(queries) / len(queries), 2),
+                'queries_max': max(queries),
+            }
+
+    return {
+        'meta': {
+            'commit': _git_commit(),
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+            'database': connection.vendor,
+            'django': django.get_version(),
+            'python': platform.python_version(),
+            'requests_per_endpoint': requests,
+            'dataset': {
+                'users': User.objects.filter(username__startswith=USER_PREFIX).count(),
+                'notebooks': Notebook.objects.filter(admin_id__username__startswith=USER_PREFIX).count(),
+                'posts_on_page': Post.objects.filter(page_id=page).count(),
+                'versions_on_page': page.page.count(),
+            },
+        },
+        'endpoints': results,
+    }
+
+
+def _table_bytes():
+    if connection.vendor != 'postgresql':
+        return None
+    sizes = {}
+    with connection.cursor() as cursor:
+        for model in (Blob, Version, Draft, Post):
+            # Includes TOAST and indexes
+            cursor.execute('SELECT pg_total_relation_size(%s)', [model._meta.db_table])
+            sizes[model._meta.db_table] = cursor.fetchone()[0]
+    return sizes
+
+
+def run_compression_benchmark(limit=1000, min_bytes=1024, repeat=20):
+    """Compare text body codecs on blobs sampled from the database.
+
+    For each codec, reports the stored size of up to `limit` blobs, in-process
+    encode and decode throughput, and the latency of writing and reading
+    back the largest body through the ORM.
+    """
+    bodies = [str(body) for body in Blob.objects.order_by().values_list('content', flat=True)[:limit]]
+    if not bodies:
+        raise ValueError("No text bodies; run generate_dataset first.")
+    raw_bytes = sum(len(body.encode('utf-8')) for body in bodies)
+    largest = max(bodies, key=len)
+    # A scratch row outside the hash key space, removed again below
+    scratch = Blob.objects.create(hash='benchmark', content='')
+
+    results = {}
+    for codec in ['none', *CODECS]:
+        t0 = time.perf_counter()
+        stored = [encode_text(body, codec=codec, min_bytes=min_bytes) for body in bodies]
+        encode_s = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        for data in stored:
+            decode_text(data)
+        decode_s = time.perf_counter() - t0
+
+        writes, reads = [], []
+        with override_settings(HIVEMIND_COMPRESSION_CODEC=codec, HIVEMIND_COMPRESSION_MIN_BYTES=min_bytes):
+            for _ in range(repeat):
+                t0 = time.perf_counter()
+                Blob.objects.filter(pk=scratch.pk).update(content=largest)
+                writes.append((time.perf_counter() - t0) * 1000)
+                t0 = time.perf_counter()
+                Blob.objects.get(pk=scratch.pk).content
+                reads.append((time.perf_counter() - t0) * 1000)
+        writes.sort()
+        reads.sort()
+
+        stored_bytes = sum(len(data) for data in stored)
+        megabytes = raw_bytes / 1e6
+        results[codec] = {
+            'stored_bytes': stored_bytes,
+            'ratio': round(stored_bytes / raw_bytes, 3),
+            'encode_ms_per_mb': round(encode_s * 1000 / megabytes, 2),
+            'decode_ms_per_mb': round(decode_s * 1000 / megabytes, 2),
+            'orm_write_p50_ms': round(percentile(writes, 50), 3) if writes else None,
+            'orm_read_p50_ms': round(percentile(reads, 50), 3) if reads else None,
+        }
+    scratch.delete()
+
+    return {
+        'meta': {
+            'commit': _git_commit(),
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+            'database': connection.vendor,
+            'bodies': len(bodies),
+            'raw_bytes': raw_bytes,
+            'largest_body_bytes': len(largest.encode('utf-8')),
+            'min_bytes': min_bytes,
+            'table_bytes': _table_bytes(),
+        },
+        'codecs': results,
+    }
+
+
+def run_auth_benchmark(requests=2000):
+    """Per-request cost of resolving a token, with and without the token cache.
+
+    Times `requests` authentications of the same benchmark user's token with
+    DRF's TokenAuthentication and with CachedTokenAuthentication in each
+    cache mode (after one warm-up request), counting the queries they run.
+    """
+    token = Token.objects.filter(user__username__startswith=USER_PREFIX).first()
+    if token is None:
+        raise ValueError("No benchmark users; run generate_dataset first.")
+    request = RequestFactory().get('/', HTTP_AUTHORIZATION=f'Token {token.key}')
+    modes = [
+        ('uncached', TokenAuthentication(), None),
+        ('local', CachedTokenAuthentication(), LOCAL),
+        ('shared', CachedTokenAuthentication(), SHARED),
+    ]
+
+    results = {}
+    for name, authenticator, mode in modes:
+        with override_settings(HIVEMIND_TOKEN_CACHE=mode):
+            invalidate([token.key])
+            authenticator.authenticate(request)
+            samples = []
+            with CaptureQueriesContext(connection) as ctx:
+                for _ in range(requests):
+                    t0 = time.perf_counter()
+                    authenticator.authenticate(request)
+                    samples.append((time.perf_counter() - t0) * 1e6)
+        samples.sort()
+        results[name] = {
+            'p50_us': round(percentile(samples, 50), 1),
+            'p99_us': round(percentile(samples, 99), 1),
+            'queries_per_request': round(len(ctx.captured_queries) / requests, 3),
+        }
+
+    return {
+        'meta': {
+            'commit': _git_commit(),
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+            'database': connection.vendor,
+            'cache_backend': settings.CACHES['default']['BACKEND'],
+            'requests': requests,
+        },
+        'modes': results,
+    }
+
+
+# The async read views, by _endpoints name
+ASYNC_ENDPOINTS = {
+    'page-list': AsyncPageListCreateView,
+    'version-list': AsyncVersionListView,
+    'version-single': AsyncVersionSingleView,
+    'post-list': AsyncPostListCreateView,
+    'version-compare': AsyncVersionCompareView,
+}
+
+
+def _rendered(response):
+    # Django renders a sync view's response in the view's thread as well
+    if hasattr(response, 'render'):
+        response.render()
+    return response
+
+
+async def _serve(call, make_request, requests, concurrency):
+    """Run `requests` calls, at most `concurrency` at a time, each in its own
+    thread context as Django's ASGI handler does."""
+    limit = asyncio.Semaphore(concurrency)
+    timings, errors, peak_threads = [], 0, threading.active_count()
+
+    async def one():
+        nonlocal errors, peak_threads
+        async with limit, ThreadSensitiveContext():
+            t0 = time.perf_counter()
+            response = await call(make_request())
+            timings.append((time.perf_counter() - t0) * 1000)
+            if response.status_code >= 400:
+                errors += 1
+            peak_threads = max(peak_threads, threading.active_count())
+            # What request_finished does with CONN_MAX_AGE = 0
+            await sync_to_async(connections.close_all)()
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(requests)))
+    elapsed = time.perf_counter() - started
+    timings.sort()
+    return {
+        'throughput_rps': round(requests / elapsed, 1),
+        'p50_ms': round(percentile(timings, 50), 3),
+        'p95_ms': round(percentile(timings, 95), 3),
+        'peak_threads': peak_threads,
+        'errors': errors,
+    }
+
+
+def run_async_benchmark(requests=200, concurrency=(1, 10, 50), only=None):
+    """Compare the async read views with their sync views under concurrent load.
+
+    Every endpoint of ASYNC_ENDPOINTS gets `requests` GETs at each
+    concurrency level, served in-process from one event loop the way an ASGI
+    server serves them: the sync view runs in a thread for the whole
+    request, the async view runs on the loop and uses a thread only for its
+    queries. Middleware and the network are left out. peak_threads is the
+    most threads alive at once, a stand-in for the workers a level needs.
+    """
+    notebook, page, post, version = _targets()
+    token, _ = Token.objects.get_or_create(user=notebook.admin_id)
+    factory = AsyncRequestFactory()
+    headers = {'Authorization': f'Token {token.key}'}
+
+    results = {}
+    for name, method, url, params in _endpoints(notebook, page, post, version):
+        if name not in ASYNC_ENDPOINTS or (only and name not in only):
+            continue
+        view, kwargs = ASYNC_ENDPOINTS[name].as_view(), resolve(url).kwargs
+        modes = {
+            'sync': sync_to_async(lambda request: _rendered(view.sync_view(request, **kwargs))),
+            'async': lambda request: view(request, **kwargs),
+        }
+        levels = {}
+        for level in concurrency:
+            levels[str(level)] = {
+                mode: asyncio.run(_serve(call, lambda: factory.get(url, params, headers=headers), requests, level))
+                for mode, call in modes.items()
+            }
+        results[name] = {'url': url, 'concurrency': levels}
+
+    return {
+        'meta': {
+            'commit': _git_commit(),
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+            'database': connection.vendor,
+            'django': django.get_version(),
+            'requests': requests,
+        },
+        'endpoints': results,
+    }
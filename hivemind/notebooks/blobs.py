@@ -0,0 +1,35 @@
+from django.db import connection, transaction
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+
+from .models import Blob, Draft, Post, Version, blob_gc_grace
+
+
+def unreferenced_blobs(cutoff):
+    """Blobs no row refers to that have not been used since `cutoff`."""
+    blobs = Blob.objects.filter(last_used_at__lt=cutoff)
+    for model in (Version, Draft, Post):
+        blobs = blobs.filter(~Exists(model.objects.filter(blob=OuterRef('pk'))))
+    return blobs
+
+
+def collect_blobs(chunk_size=1000):
+    """Delete unreferenced blobs older than the grace period. Returns the count.
+
+    Each chunk is locked while it is checked and deleted, and interning a
+    stale blob updates it first (see BlobManager.intern), so a blob that is
+    being reused waits for the chunk to commit and is then created again.
+    """
+    cutoff = timezone.now() - blob_gc_grace()
+    deleted = 0
+    last = ''
+    while True:
+        with transaction.atomic():
+            rows = unreferenced_blobs(cutoff).filter(hash__gt=last).order_by('hash')
+            if connection.features.has_select_for_update_skip_locked:
+                rows = rows.select_for_update(skip_locked=True)
+            keys = list(rows.values_list('hash', flat=True)[:chunk_size])
+            if not keys:
+                return deleted
+            deleted += Blob.objects.filter(hash__in=keys).delete()[0]
+            last = keys[-1]
@@ -0,0 +1,20 @@
+"""Helpers shared by the per-user caches (memberships, workspace snapshots,
+resolved tokens)."""
+from django.conf import settings
+from django.db import transaction
+
+
+def cache_timeout(setting, default=300):
+    """Seconds entries stay cached, from the `setting` HIVEMIND_* setting."""
+    return getattr(settings, setting, default)
+
+
+def invalidate_on_commit(drop):
+    """Call `drop` to discard cached entries now, and again after commit.
+
+    Until the current transaction commits, a concurrent request still reads
+    the old rows and can cache them again; the second call removes those.
+    Outside a transaction both calls happen right away.
+    """
+    drop()
+    transaction.on_commit(drop)
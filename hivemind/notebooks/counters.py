@@ -0,0 +1,79 @@
+"""Denormalized counts on pages and notebooks.
+
+Page.post_count (open posts) and Page.version_count, and Notebook.page_count,
+move by F() updates in the transaction of the write that changes them, so
+list views read them without aggregating. Notebook.member_count is recounted
+from the membership table after member changes instead, since adding an
+existing member or removing a non-member changes nothing.
+`manage.py repair_counters` recomputes every counter in bulk.
+"""
+from django.db.models import Count, F, IntegerField, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Coalesce
+
+from .models import Notebook, Page, Version, Post
+
+
+def adjust_page(page_id, posts=0, versions=0):
+    changes = {}
+    if posts:
+        changes['post_count'] = F('post_count') + posts
+    if versions:
+        changes['version_count'] = F('version_count') + versions
+    if changes:
+        Page.objects.filter(pk=page_id).update(**changes)
+
+
+def adjust_notebook(notebook_id, pages=0):
+    if pages:
+        Notebook.objects.filter(pk=notebook_id).update(page_count=F('page_count') + pages)
+
+
+def recount_members(notebook):
+    Notebook.objects.filter(pk=notebook.pk).update(member_count=_members())
+    notebook.refresh_from_db(fields=['member_count'])
+
+
+def deleted_count(result, model):
+    """How many `model` rows a Model.delete() or QuerySet.delete() result removed, cascades included."""
+    return result[1].get(model._meta.label, 0)
+
+
+def _count(model, field):
+    rows = model.objects.filter(**{field: OuterRef('pk')}).order_by().values(field).annotate(n=Count('*')).values('n')
+    return Coalesce(Subquery(rows, output_field=IntegerField()), Value(0))
+
+
+def _members():
+    return _count(Notebook.user_ids.through, 'notebook_id')
+
+
+def _repair(queryset, counters, chunk_size):
+    """Fix the rows of `queryset` whose counters differ from `counters`. Returns how many."""
+    fixed = 0
+    last = None
+    while True:
+        rows = queryset.order_by('pk')
+        if last is not None:
+            rows = rows.filter(pk__gt=last)
+        ids = list(rows.values_list('pk', flat=True)[:chunk_size])
+        if not ids:
+            return fixed
+        stale = (
+            queryset.model.objects.filter(pk__in=ids)
+            .annotate(**{f'actual_{name}': value for name, value in counters.items()})
+            .filter(Q(*[~Q(**{name: F(f'actual_{name}')}) for name in counters], _connector=Q.OR))
+            .values_list('pk', flat=True)
+        )
+        fixed += queryset.model.objects.filter(pk__in=list(stale)).update(**counters)
+        last = ids[-1]
+
+
+def repair_counters(notebooks=None, chunk_size=500):
+    """Recompute the counters of `notebooks` (a queryset; all by default) and
+    their pages. Returns (notebooks fixed, pages fixed)."""
+    notebooks = Notebook.objects.all() if notebooks is None else notebooks
+    pages = Page.objects.filter(notebook_id__in=notebooks.values('pk'))
+    return (
+        _repair(notebooks, {'member_count': _members(), 'page_count': _count(Page, 'notebook_id')}, chunk_size),
+        _repair(pages, {'post_count': _count(Post, 'page_id'), 'version_count': _count(Version, 'page_id')}, chunk_size),
+    )
@@ -0,0 +1,322 @@
+import bisect
+import re
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import cache
+
+EQUAL = '='
+INSERT = '+'
+DELETE = '-'
+
+GRANULARITIES = ('line', 'word')
+
+# Myers takes O((N + M) * D) time and O(D^2) memory for N + M tokens and D
+# edits, so D is capped at MAX_DIFF_COST / (N + M). Past the cap (large
+# rewrites) lines are matched by _anchored_opcodes instead, in O(N log N),
+# and word refinement is skipped.
+MAX_DIFF_COST = 2_000_000
+
+_word_re = re.compile(r'\s+|\w+|[^\w\s]')
+
+
+def tokenize(text, granularity):
+    if granularity == 'word':
+        return _word_re.findall(text)
+    return text.splitlines(keepends=True)
+
+
+def _myers(a, b):
+    """Return (tag, i1, i2, j1, j2) opcodes turning `a` into `b`.
+
+    Classic O(ND) Myers diff over sequences of hashable tokens. Common
+    prefix and suffix are stripped first since edits are usually local.
+    Returns None when the diff would cost more than MAX_DIFF_COST.
+    """
+    prefix = 0
+    while prefix < len(a) and prefix < len(b) and a[prefix] == b[prefix]:
+        prefix += 1
+    suffix = 0
+    while (
+        suffix < len(a) - prefix and suffix < len(b) - prefix
+        and a[-1 - suffix] == b[-1 - suffix]
+    ):
+        suffix += 1
+
+    middle = _myers_middle(a, b, prefix, len(a) - suffix, prefix, len(b) - suffix)
+    if middle is None:
+        return None
+    opcodes = []
+    if prefix:
+        opcodes.append((EQUAL, 0, prefix, 0, prefix))
+    opcodes.extend(middle)
+    if suffix:
+        opcodes.append((EQUAL, len(a) - suffix, len(a), len(b) - suffix, len(b)))
+    return opcodes
+
+
+def _myers_middle(a, b, a_lo, a_hi, b_lo, b_hi):
+    n = a_hi - a_lo
+    m = b_hi - b_lo
+    if n == 0 and m == 0:
+        return []
+    if n == 0:
+        return [(INSERT, a_lo, a_lo, b_lo, b_hi)]
+    if m == 0:
+        return [(DELETE, a_lo, a_hi, b_lo, b_lo)]
+
+    # Map tokens to ints so comparisons in the hot loop are cheap.
+    ids = {}
+    xs = [ids.setdefault(t, len(ids)) for t in a[a_lo:a_hi]]
+    ys = [ids.setdefault(t, len(ids)) for t in b[b_lo:b_hi]]
+
+    max_d = min(n + m, MAX_DIFF_COST // (n + m))
+    offset = max_d + 1
+    v = [0] * (2 * max_d + 3)
+    trace = []
+    found = False
+    for d in range(max_d + 1):
+        trace.append(v[offset - d - 1:offset + d + 2])
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and v[offset + k - 1] < v[offset + k + 1]):
+                x = v[offset + k + 1]
+            else:
+                x = v[offset + k - 1] + 1
+            y = x - k
+            while x < n and y < m and xs[x] == ys[y]:
+                x += 1
+                y += 1
+            v[offset + k] = x
+            if x >= n and y >= m:
+                found = True
+                break
+        if found:
+            break
+
+    if not found:
+        return None
+
+    # Backtrack through the saved frontiers to recover the edit path.
+    moves = []
+    x, y = n, m
+    for d in range(len(trace) - 1, 0, -1):
+        frontier = trace[d]
+        base = -d - 1
+
+        def at(k):
+            return frontier[k - base]
+
+        k = x - y
+        if k == -d or (k != d and at(k - 1) < at(k + 1)):
+            prev_k = k + 1
+        else:
+            prev_k = k - 1
+        prev_x = at(prev_k)
+        prev_y = prev_x - prev_k
+        while x > prev_x and y > prev_y:
+            moves.append((EQUAL, x - 1, y - 1))
+            x -= 1
+            y -= 1
+        if x == prev_x:
+            moves.append((INSERT, x, y - 1))
+        else:
+            moves.append((DELETE, x - 1, y))
+        x, y = prev_x, prev_y
+    while x > 0 and y > 0:
+        moves.append((EQUAL, x - 1, y - 1))
+        x -= 1
+        y -= 1
+    moves.reverse()
+
+    # Collapse each run of interleaved edits into one delete then one insert.
+    opcodes = []
+    run = None
+    for tag, i, j in moves:
+        i1, j1 = a_lo + i, b_lo + j
+        if tag == EQUAL:
+            if run is not None:
+                opcodes.extend(_split_run(*run))
+                run = None
+            if opcodes and opcodes[-1][0] == EQUAL:
+                prev = opcodes[-1]
+                opcodes[-1] = (EQUAL, prev[1], i1 + 1, prev[3], j1 + 1)
+            else:
+                opcodes.append((EQUAL, i1, i1 + 1, j1, j1 + 1))
+            continue
+        i2 = i1 + (tag == DELETE)
+        j2 = j1 + (tag == INSERT)
+        if run is None:
+            run = [i1, i2, j1, j2]
+        else:
+            run[1], run[3] = i2, j2
+    if run is not None:
+        opcodes.extend(_split_run(*run))
+    return opcodes
+
+
+def _line_opcodes(a, b):
+    """Myers opcodes for two line lists, or anchored ones when Myers would cost too much."""
+    opcodes = _myers(a, b)
+    if opcodes is None:
+        opcodes = _anchored_opcodes(a, b)
+    return opcodes
+
+
+def _anchored_opcodes(a, b):
+    """Opcodes that only match lines occurring once in each of `a` and `b`
+    (as patience diff does), plus equal lines around each gap between them.
+
+    Anchors are the longest run of such lines in the same order in both,
+    found by patience sorting in O(N log N); everything else is replaced.
+    """
+    count_a, count_b = Counter(a), Counter(b)
+    position_b = {line: j for j, line in enumerate(b) if count_b[line] == 1}
+    pairs = [(i, position_b[line]) for i, line in enumerate(a) if count_a[line] == 1 and line in position_b]
+
+    # Longest subsequence of pairs increasing in b
+    tails, tail_pairs, previous = [], [], []
+    for n, (i, j) in enumerate(pairs):
+        pile = bisect.bisect_left(tails, j)
+        previous.append(tail_pairs[pile - 1] if pile else None)
+        if pile == len(tails):
+            tails.append(j)
+            tail_pairs.append(n)
+        else:
+            tails[pile] = j
+            tail_pairs[pile] = n
+    anchors = []
+    n = tail_pairs[-1] if tail_pairs else None
+    while n is not None:
+        anchors.append(pairs[n])
+        n = previous[n]
+    anchors.reverse()
+
+    opcodes = []
+
+    def equal(i1, i2, j1, j2):
+        if i2 > i1:
+            if opcodes and opcodes[-1][0] == EQUAL:
+                opcodes[-1] = (EQUAL, opcodes[-1][1], i2, opcodes[-1][3], j2)
+            else:
+                opcodes.append((EQUAL, i1, i2, j1, j2))
+
+    i = j = 0
+    for anchor_i, anchor_j in anchors + [(len(a), len(b))]:
+        lead = 0
+        while i + lead < anchor_i and j + lead < anchor_j and a[i + lead] == b[j + lead]:
+            lead += 1
+        trail = 0
+        while anchor_i - trail > i + lead and anchor_j - trail > j + lead and a[anchor_i - trail - 1] == b[anchor_j - trail - 1]:
+            trail += 1
+        equal(i, i + lead, j, j + lead)
+        opcodes.extend(_split_run(i + lead, anchor_i - trail, j + lead, anchor_j - trail))
+        equal(anchor_i - trail, anchor_i, anchor_j - trail, anchor_j)
+        equal(anchor_i, min(anchor_i + 1, len(a)), anchor_j, min(anchor_j + 1, len(b)))
+        i, j = anchor_i + 1, anchor_j + 1
+    return opcodes
+
+
+def _split_run(i1, i2, j1, j2):
+    opcodes = []
+    if i2 > i1:
+        opcodes.append((DELETE, i1, i2, j1, j1))
+    if j2 > j1:
+        opcodes.append((INSERT, i2, i2, j1, j2))
+    return opcodes
+
+
+def _ops_for(a, b, opcodes):
+    ops = []
+    for tag, i1, i2, j1, j2 in opcodes:
+        text = ''.join(b[j1:j2]) if tag == INSERT else ''.join(a[i1:i2])
+        if ops and ops[-1][0] == tag:
+            ops[-1][1] += text
+        else:
+            ops.append([tag, text])
+    return ops
+
+
+def diff_texts(old, new, granularity='line'):
+    """Return an edit script turning `old` into `new`.
+
+    The script is a list of ``[tag, text]`` pairs where tag is ``=`` (kept),
+    ``-`` (deleted from `old`) or ``+`` (inserted from `new`). Concatenating
+    the ``=`` and ``+`` texts gives `new`. Word granularity diffs lines
+    first and then refines only the changed blocks word by word, leaving
+    blocks too large to refine within MAX_DIFF_COST as whole lines.
+    """
+    old_lines = tokenize(old, 'line')
+    new_lines = tokenize(new, 'line')
+    line_ops = _line_opcodes(old_lines, new_lines)
+    if granularity != 'word':
+        return _ops_for(old_lines, new_lines, line_ops)
+
+    ops = []
+
+    def extend(chunk):
+        for tag, text in chunk:
+            if ops and ops[-1][0] == tag:
+                ops[-1][1] += text
+            else:
+                ops.append([tag, text])
+
+    idx = 0
+    while idx < len(line_ops):
+        tag, i1, i2, j1, j2 = line_ops[idx]
+        nxt = line_ops[idx + 1] if idx + 1 < len(line_ops) else None
+        if tag == DELETE and nxt is not None and nxt[0] == INSERT:
+            old_words = tokenize(''.join(old_lines[i1:i2]), 'word')
+            new_words = tokenize(''.join(new_lines[nxt[3]:nxt[4]]), 'word')
+            word_ops = _myers(old_words, new_words)
+            if word_ops is not None:
+                extend(_ops_for(old_words, new_words, word_ops))
+                idx += 2
+                continue
+        extend(_ops_for(old_lines, new_lines, [line_ops[idx]]))
+        idx += 1
+    return ops
+
+
+def diff_stats(ops):
+    return {
+        'inserted': sum(len(text) for tag, text in ops if tag == INSERT),
+        'deleted': sum(len(text) for tag, text in ops if tag == DELETE),
+    }
+
+
+def iter_hunks(ops, max_chars=16384):
+    """Split an edit script into consecutive hunks of roughly `max_chars`."""
+    hunk = []
+    size = 0
+    for op in ops:
+        hunk.append(op)
+        size += len(op[1])
+        if size >= max_chars:
+            yield hunk
+            hunk = []
+            size = 0
+    if hunk:
+        yield hunk
+
+
+def cache_timeout():
+    return getattr(settings, 'HIVEMIND_DIFF_CACHE_TIMEOUT', 3600)
+
+
+def cache_max_chars():
+    return getattr(settings, 'HIVEMIND_DIFF_CACHE_MAX_CHARS', 1_000_000)
+
+
+def cached_version_diff(version1, version2, granularity='line'):
+    """Diff two versions, caching the result since versions never change.
+
+    Scripts holding more than HIVEMIND_DIFF_CACHE_MAX_CHARS characters are
+    recomputed each time rather than filling the cache.
+    """
+    key = f'hivemind:diff:{version1.version_id}:{version2.version_id}:{granularity}'
+    ops = cache.get(key)
+    if ops is None:
+        ops = diff_texts(version1.get_content(), version2.get_content(), granularity)
+        if sum(len(text) for _, text in ops) <= cache_max_chars():
+            cache.set(key, ops, cache_timeout())
+    return ops
@@ -0,0 +1,235 @@
+import asyncio
+import logging
+import threading
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.core import signing
+from django.core.signals import setting_changed
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, close_old_connections, connections, transaction
+from django.dispatch import receiver
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import StreamEvent
+
+logger = logging.getLogger(__name__)
+
+
+class Subscription:
+    """A bounded queue of events for one listener, bound to its event loop.
+
+    When a slow listener falls behind, the oldest undelivered events are
+    dropped so publishers never block.
+    """
+
+    def __init__(self, broker, channels, maxsize):
+        self.broker = broker
+        self.channels = channels
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize=maxsize)
+
+    def deliver(self, event):
+        try:
+            self.loop.call_soon_threadsafe(self._put, event)
+        except RuntimeError:
+            # Listener's loop is gone
+            self.close()
+
+    def _put(self, event):
+        if self.queue.full():
+            self.queue.get_nowait()
+        self.queue.put_nowait(event)
+
+    async def get(self, timeout=None):
+        """Return the next event, or None if nothing arrives within `timeout`."""
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class InProcessBroker:
+    """Fans events out to listeners in the current process.
+
+    A shared broker (for several server processes) only needs the same
+    `subscribe`/`unsubscribe`/`publish` methods and can be swapped in with
+    the HIVEMIND_EVENT_BROKER setting.
+    """
+    # Events published in another process (e.g. the merge worker) never arrive
+    cross_process = False
+
+    def __init__(self, queue_size=100):
+        self.queue_size = queue_size
+        self._subscribers = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def subscribe(self, *channels):
+        subscription = Subscription(self, channels, self.queue_size)
+        with self._lock:
+            for channel in channels:
+                self._subscribers[channel].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            for channel in subscription.channels:
+                listeners = self._subscribers.get(channel)
+                if listeners is not None:
+                    listeners.discard(subscription)
+                    if not listeners:
+                        del self._subscribers[channel]
+
+    def publish(self, channels, event):
+        """Deliver `event` once to every listener of any of `channels`."""
+        with self._lock:
+            listeners = set().union(*(self._subscribers.get(channel, ()) for channel in channels))
+        for subscription in listeners:
+            subscription.deliver(event)
+
+
+class DatabaseBroker(InProcessBroker):
+    """Shares events between processes through the StreamEvent table.
+
+    `publish` only writes a row. A daemon thread in each process with
+    listeners polls for new rows every `poll_seconds` and fans them out
+    locally, so events published by the merge worker or another web process
+    reach every stream. Rows older than `retention_seconds` are deleted as
+    the thread goes.
+
+    Ids and timestamps are taken before commit, so a row can become visible
+    after newer ones. Each poll re-reads the last `overlap_seconds` and skips
+    the ids it already delivered, so such rows still arrive unless their
+    transaction stayed open longer than that.
+    """
+    cross_process = True
+    poll_seconds = 0.5
+    overlap_seconds = 10
+    retention_seconds = 300
+
+    def __init__(self, queue_size=100):
+        super().__init__(queue_size)
+        self._poller = None
+        self._stopped = threading.Event()
+
+    def subscribe(self, *channels):
+        subscription = super().subscribe(*channels)
+        with self._lock:
+            if self._poller is None:
+                self._poller = threading.Thread(target=self._poll, args=(timezone.now(),), daemon=True)
+                self._poller.start()
+        return subscription
+
+    def publish(self, channels, event):
+        StreamEvent.objects.using(DEFAULT_DB_ALIAS).create(channels=list(channels), payload=event)
+
+    def close(self):
+        self._stopped.set()
+
+    def _poll(self, since):
+        # `since` is when the first listener subscribed, `newest` the latest
+        # timestamp delivered; `seen` holds the ids delivered within the
+        # overlap window before it
+        newest = since
+        seen = {}
+        overlap = timedelta(seconds=self.overlap_seconds)
+        pruned_at = since
+        try:
+            while not self._stopped.wait(self.poll_seconds):
+                close_old_connections()
+                with self._lock:
+                    idle = not self._subscribers
+                if idle:
+                    # Don't replay what nobody was listening for to later listeners
+                    since = newest = timezone.now()
+                    seen.clear()
+                    continue
+                try:
+                    events = StreamEvent.objects.using(DEFAULT_DB_ALIAS).filter(
+                        created_at__gte=max(since, newest - overlap)
+                    ).order_by('created_at', 'event_id')
+                    for event in events.iterator(chunk_size=500):
+                        if event.event_id in seen:
+                            continue
+                        seen[event.event_id] = event.created_at
+                        newest = max(newest, event.created_at)
+                        super().publish(event.channels, event.payload)
+                    seen = {event_id: at for event_id, at in seen.items() if at >= newest - overlap}
+                    now = timezone.now()
+                    if now - pruned_at > timedelta(seconds=self.retention_seconds):
+                        StreamEvent.objects.using(DEFAULT_DB_ALIAS).filter(
+                            created_at__lt=now - timedelta(seconds=self.retention_seconds)
+                        ).delete()
+                        pruned_at = now
+                except DatabaseError:
+                    logger.exception("Polling stream events failed")
+        finally:
+            connections.close_all()
+
+
+_broker = None
+
+
+def get_broker():
+    global _broker
+    if _broker is None:
+        broker_class = import_string(getattr(settings, 'HIVEMIND_EVENT_BROKER', 'notebooks.events.DatabaseBroker'))
+        _broker = broker_class()
+    return _broker
+
+
+@receiver(setting_changed)
+def reset_broker(setting, **kwargs):
+    global _broker
+    if setting == 'HIVEMIND_EVENT_BROKER':
+        if _broker is not None and hasattr(_broker, 'close'):
+            _broker.close()
+        _broker = None
+
+
+def notebook_channel(notebook_id):
+    return f'notebook:{notebook_id}'
+
+
+def page_channel(page_id):
+    return f'page:{page_id}'
+
+
+def publish_event(notebook_id, page_id, event_type, **data):
+    """Broadcast an event to the notebook and page channels once the
+    current transaction commits, so listeners never see rolled back writes."""
+    event = {'type': event_type, 'notebook_id': str(notebook_id), 'page_id': str(page_id), **data}
+
+    transaction.on_commit(
+        lambda: get_broker().publish([notebook_channel(notebook_id), page_channel(page_id)], event)
+    )
+
+
+TICKET_SALT = 'notebooks.events.ticket'
+
+
+def stream_ticket(user_id, notebook_id):
+    """A signed ticket that lets `user_id` open the event streams of one notebook.
+
+    EventSource can't set headers, so browsers pass this in the stream URL
+    instead of their API token; it expires after
+    HIVEMIND_STREAM_TICKET_SECONDS and is useless for anything else.
+    """
+    return signing.dumps({'user': str(user_id), 'notebook': str(notebook_id)}, salt=TICKET_SALT, compress=True)
+
+
+def read_ticket(ticket, notebook_id):
+    """The user id a ticket from `stream_ticket` was issued to, or None if it
+    is forged, expired or for another notebook."""
+    max_age = getattr(settings, 'HIVEMIND_STREAM_TICKET_SECONDS', 60)
+    try:
+        data = signing.loads(ticket, salt=TICKET_SALT, max_age=max_age)
+    except signing.BadSignature:
+        return None
+    if not isinstance(data, dict) or data.get('notebook') != str(notebook_id):
+        return None
+    return data.get('user')
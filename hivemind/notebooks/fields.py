@@ -0,0 +1,142 @@
+"""Model fields for large text bodies."""
+import lzma
+import zlib
+
+from django import forms
+from django.conf import settings
+from django.db import models
+from django.db.models.query_utils import DeferredAttribute
+
+try:
+    import zstandard
+except ImportError:  # Optional, faster codec
+    zstandard = None
+
+# One-byte tag in front of every stored value says how the rest is encoded
+PLAIN = b'T'
+CODECS = {
+    'zlib': (b'Z', lambda data: zlib.compress(data, 6), zlib.decompress),
+    'lzma': (b'X', lambda data: lzma.compress(data, preset=1), lzma.decompress),
+}
+if zstandard is not None:
+    CODECS['zstd'] = (
+        b'S',
+        lambda data: zstandard.ZstdCompressor(level=3).compress(data),
+        lambda data: zstandard.ZstdDecompressor().decompress(data),
+    )
+DECOMPRESSORS = {tag: decompress for tag, _, decompress in CODECS.values()}
+
+
+def compression_codec():
+    return getattr(settings, 'HIVEMIND_COMPRESSION_CODEC', 'zlib')
+
+
+def compression_min_bytes():
+    return getattr(settings, 'HIVEMIND_COMPRESSION_MIN_BYTES', 1024)
+
+
+def encode_text(text, codec=None, min_bytes=None):
+    """Stored form of `text`: compressed with `codec` when that pays off."""
+    data = text.encode('utf-8')
+    codec = codec or compression_codec()
+    if min_bytes is None:
+        min_bytes = compression_min_bytes()
+    if codec in CODECS and len(data) >= min_bytes:
+        tag, compress, _ = CODECS[codec]
+        compressed = compress(data)
+        if len(compressed) < len(data):
+            return tag + compressed
+    return PLAIN + data
+
+
+def decode_text(data):
+    data = bytes(data)
+    tag, body = data[:1], data[1:]
+    if tag == PLAIN:
+        return body.decode('utf-8')
+    if tag not in DECOMPRESSORS:
+        raise ValueError(f"Unknown text encoding {tag!r}; is the codec's package installed?")
+    return DECOMPRESSORS[tag](body).decode('utf-8')
+
+
+class StoredText:
+    """A loaded value that has not been decoded yet."""
+    __slots__ = ('data',)
+
+    def __init__(self, data):
+        self.data = data
+
+    def __str__(self):
+        return decode_text(self.data)
+
+
+class CompressedTextDescriptor(DeferredAttribute):
+    """Decodes the stored bytes on first access and keeps the text."""
+
+    def __get__(self, instance, cls=None):
+        value = super().__get__(instance, cls)
+        if isinstance(value, StoredText):
+            value = instance.__dict__[self.field.attname] = str(value)
+        return value
+
+    def __set__(self, instance, value):
+        # Defining __set__ makes this a data descriptor, so __get__ runs
+        # even once the value is in the instance __dict__
+        instance.__dict__[self.field.attname] = value
+
+
+class CompressedTextField(models.BinaryField):
+    """A text field stored as bytes, compressed above a size threshold.
+
+    Bodies of at least HIVEMIND_COMPRESSION_MIN_BYTES are compressed with
+    HIVEMIND_COMPRESSION_CODEC when that makes them smaller. Every codec
+    stays readable whatever the setting, so it can be changed at any time.
+    Model instances decode on first access; values() and values_list()
+    return StoredText, which str() decodes. No text lookups are supported.
+    """
+    descriptor_class = CompressedTextDescriptor
+
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault('editable', True)
+        super().__init__(*args, **kwargs)
+
+    def _check_str_default_value(self):
+        # Defaults are text, like every other value of this field
+        return []
+
+    def deconstruct(self):
+        name, path, args, kwargs = super().deconstruct()
+        kwargs.pop('editable', None)
+        return name, path, args, kwargs
+
+    def pre_save(self, model_instance, add):
+        # A body that was loaded but never read is written back as stored
+        value = model_instance.__dict__.get(self.attname)
+        if isinstance(value, StoredText):
+            return value
+        return super().pre_save(model_instance, add)
+
+    def get_db_prep_value(self, value, connection, prepared=False):
+        if isinstance(value, StoredText):
+            value = value.data
+        elif isinstance(value, str):
+            value = encode_text(value)
+        return super().get_db_prep_value(value, connection, prepared)
+
+    def from_db_value(self, value, expression, connection):
+        if value is None:
+            return None
+        return StoredText(bytes(value))
+
+    def to_python(self, value):
+        if value is None or isinstance(value, str):
+            return value
+        if isinstance(value, StoredText):
+            return str(value)
+        return decode_text(value)
+
+    def value_to_string(self, obj):
+        return self.value_from_object(obj)
+
+    def formfield(self, **kwargs):
+        return models.Field.formfield(self, **{'widget': forms.Textarea, **kwargs})
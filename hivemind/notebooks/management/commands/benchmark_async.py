@@ -0,0 +1,41 @@
+import json
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from notebooks.benchmark import ASYNC_ENDPOINTS, run_async_benchmark
+
+
+class Command(BaseCommand):
+    help = "Compare the async read views with their sync views at several concurrency levels."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200, help="Requests per endpoint, mode and concurrency level.")
+        parser.add_argument(
+            '--concurrency', type=int, action='append',
+            help="Requests in flight at once (repeatable; default 1, 10 and 50).",
+        )
+        parser.add_argument('--endpoint', action='append', dest='endpoints', choices=ASYNC_ENDPOINTS, help="Only run this endpoint (repeatable).")
+        parser.add_argument('--output', help="Also save the results as JSON to this file.")
+
+    def handle(self, *args, **options):
+        try:
+            results = run_async_benchmark(options['requests'], options['concurrency'] or (1, 10, 50), options['endpoints'])
+        except ValueError as exc:
+            raise CommandError(str(exc))
+        if options['output']:
+            Path(options['output']).write_text(json.dumps(results, indent=2))
+
+        meta = results['meta']
+        self.stdout.write(f"{meta['requests']} requests per level on {meta['database']}")
+        self.stdout.write(f"{'endpoint':<18}{'conc':>6}{'mode':>7}{'req/s':>9}{'p50':>9}{'p95':>9}{'threads':>9}")
+        for name, row in results['endpoints'].items():
+            for level, modes in row['concurrency'].items():
+                for mode, stats in modes.items():
+                    line = (
+                        f"{name:<18}{level:>6}{mode:>7}{stats['throughput_rps']:>9.1f}"
+                        f"{stats['p50_ms']:>9.2f}{stats['p95_ms']:>9.2f}{stats['peak_threads']:>9}"
+                    )
+                    if stats['errors']:
+                        line += f"   {stats['errors']} errors"
+                    self.stdout.write(line)
@@ -0,0 +1,28 @@
+import json
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from notebooks.benchmark import run_auth_benchmark
+
+
+class Command(BaseCommand):
+    help = "Compare per-request token authentication cost with and without the token cache."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=2000, help="Authentications timed per mode.")
+        parser.add_argument('--output', help="Also save the results as JSON to this file.")
+
+    def handle(self, *args, **options):
+        try:
+            results = run_auth_benchmark(options['requests'])
+        except ValueError as exc:
+            raise CommandError(str(exc))
+        if options['output']:
+            Path(options['output']).write_text(json.dumps(results, indent=2))
+
+        meta = results['meta']
+        self.stdout.write(f"{meta['requests']} authentications per mode on {meta['database']}, cache {meta['cache_backend']}")
+        self.stdout.write(f"{'mode':<10}{'p50 us':>10}{'p99 us':>10}{'queries':>9}")
+        for mode, row in results['modes'].items():
+            self.stdout.write(f"{mode:<10}{row['p50_us']:>10.1f}{row['p99_us']:>10.1f}{row['queries_per_request']:>9.3f}")
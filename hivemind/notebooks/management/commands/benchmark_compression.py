@@ -0,0 +1,35 @@
+import json
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from notebooks.benchmark import run_compression_benchmark
+
+
+class Command(BaseCommand):
+    help = "Compare text body codecs by stored size and encode/decode cost on data from generate_dataset."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=1000, help="Blobs sampled.")
+        parser.add_argument('--min-bytes', type=int, default=1024, help="Compression threshold to test.")
+        parser.add_argument('--repeat', type=int, default=20, help="ORM write/read round trips per codec.")
+        parser.add_argument('--output', help="Also save the results as JSON to this file.")
+
+    def handle(self, *args, **options):
+        try:
+            results = run_compression_benchmark(options['limit'], options['min_bytes'], options['repeat'])
+        except ValueError as exc:
+            raise CommandError(str(exc))
+        if options['output']:
+            Path(options['output']).write_text(json.dumps(results, indent=2))
+
+        meta = results['meta']
+        self.stdout.write(f"{meta['bodies']} bodies, {meta['raw_bytes']} bytes, compressing from {meta['min_bytes']} bytes")
+        if meta['table_bytes']:
+            self.stdout.write("Tables now: " + ", ".join(f"{table} {size}" for table, size in meta['table_bytes'].items()))
+        self.stdout.write(f"{'codec':<8}{'stored':>12}{'ratio':>8}{'enc ms/MB':>11}{'dec ms/MB':>11}{'write ms':>10}{'read ms':>9}")
+        for codec, row in results['codecs'].items():
+            self.stdout.write(
+                f"{codec:<8}{row['stored_bytes']:>12}{row['ratio']:>8.3f}{row['encode_ms_per_mb']:>11.1f}"
+                f"{row['decode_ms_per_mb']:>11.1f}{row['orm_write_p50_ms'] or 0:>10.3f}{row['orm_read_p50_ms'] or 0:>9.3f}"
+            )
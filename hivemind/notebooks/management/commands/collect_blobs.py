@@ -0,0 +1,21 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from notebooks.blobs import collect_blobs
+
+
+class Command(BaseCommand):
+    help = "Delete text blobs that no draft, post or version refers to any more."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000, help="Blobs deleted per transaction.")
+        parser.add_argument('--every', type=float, help="Keep running, collecting every this many seconds.")
+
+    def handle(self, *args, **options):
+        while True:
+            deleted = collect_blobs(options['chunk_size'])
+            self.stdout.write(f"Deleted {deleted} unreferenced blobs.")
+            if not options['every']:
+                return
+            time.sleep(options['every'])
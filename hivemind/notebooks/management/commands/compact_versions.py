@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from notebooks.models import Notebook
+from notebooks.retention import compact_notebook
+
+
+class Command(BaseCommand):
+    help = "Remove old versions according to each notebook's retention policy. Safe to run while serving traffic."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--notebook', action='append', help="Only compact this notebook id (repeatable).")
+        parser.add_argument('--chunk-size', type=int, default=500, help="Versions handled per transaction.")
+
+    def handle(self, *args, **options):
+        notebooks = Notebook.objects.filter(retention_policy__isnull=False).order_by('notebook_id')
+        if options['notebook']:
+            notebooks = notebooks.filter(notebook_id__in=options['notebook'])
+
+        now = timezone.now()
+        total = 0
+        for notebook in notebooks.iterator(chunk_size=100):
+            kept, removed = compact_notebook(notebook, now, options['chunk_size'])
+            total += removed
+            self.stdout.write(f"{notebook.notebook_id}: kept {kept}, removed {removed}")
+        self.stdout.write(self.style.SUCCESS(f"Removed {total} versions."))
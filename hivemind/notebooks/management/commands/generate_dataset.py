@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from notebooks.benchmark import flush_dataset, generate_dataset
+
+
+class Command(BaseCommand):
+    help = "Create a synthetic dataset for benchmarking. The same options and seed give the same data shape."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=50)
+        parser.add_argument('--notebooks', type=int, default=5)
+        parser.add_argument('--members', type=int, default=10, help="Members per notebook.")
+        parser.add_argument('--pages', type=int, default=10, help="Pages per notebook.")
+        parser.add_argument('--versions', type=int, default=50, help="Length of each page's version chain.")
+        parser.add_argument('--posts', type=int, default=100, help="Posts per page.")
+        parser.add_argument('--votes', type=int, default=20, help="Most votes per post.")
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--flush', action='store_true', help="Delete previously generated data first.")
+
+    def handle(self, *args, **options):
+        if options['flush']:
+            flush_dataset()
+        counts = generate_dataset(
+            users=options['users'], notebooks=options['notebooks'], members=options['members'],
+            pages=options['pages'], versions=options['versions'], posts=options['posts'],
+            votes=options['votes'], seed=options['seed'],
+        )
+        self.stdout.write(', '.join(f"{count} {name}" for name, count in counts.items()))
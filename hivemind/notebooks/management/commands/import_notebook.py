@@ -0,0 +1,35 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from notebooks.models import User
+from notebooks.transfer import import_lines
+
+
+class Command(BaseCommand):
+    help = "Import a notebook from an NDJSON export (GET /api/notebooks/<id>/export/)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="Export file, or - for standard input.")
+        parser.add_argument('--owner', help="Username to make the notebook's admin instead of the exported one.")
+        parser.add_argument('--batch-size', type=int, default=500, help="Rows per bulk insert.")
+
+    def handle(self, *args, **options):
+        owner = None
+        if options['owner']:
+            owner = User.objects.filter(username=options['owner']).first()
+            if owner is None:
+                raise CommandError(f"No user named {options['owner']}.")
+
+        try:
+            if options['path'] == '-':
+                notebook, counts = import_lines(sys.stdin, owner, options['batch_size'])
+            else:
+                with open(options['path'], encoding='utf-8') as lines:
+                    notebook, counts = import_lines(lines, owner, options['batch_size'])
+        # TransferError and bad JSON are ValueErrors; a missing key is a malformed record
+        except (ValueError, KeyError) as exc:
+            raise CommandError(f"Import failed: {exc}")
+
+        summary = ", ".join(f"{count} {name}" for name, count in counts.items())
+        self.stdout.write(self.style.SUCCESS(f"Imported {notebook.notebook_id} ({notebook.title}): {summary}"))
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from notebooks.models import Page
+from notebooks.search import rebuild_page_index
+
+
+class Command(BaseCommand):
+    help = "Rebuild the search index for every page, e.g. after loading data from elsewhere."
+
+    def handle(self, *args, **options):
+        pages = Page.objects.select_related('notebook_id').order_by('created_at')
+        for page in pages.iterator():
+            with transaction.atomic():
+                count = rebuild_page_index(page)
+            self.stdout.write(f"{page.page_id}: {count} versions")
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from notebooks.counters import repair_counters
+from notebooks.models import Notebook
+
+
+class Command(BaseCommand):
+    help = "Recompute the page and notebook counters (open posts, versions, members, pages)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--notebook', action='append', help="Only repair this notebook id (repeatable).")
+        parser.add_argument('--chunk-size', type=int, default=500, help="Rows checked per query.")
+
+    def handle(self, *args, **options):
+        notebooks = Notebook.objects.all()
+        if options['notebook']:
+            notebooks = notebooks.filter(notebook_id__in=options['notebook'])
+        fixed_notebooks, fixed_pages = repair_counters(notebooks, options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(f"Fixed {fixed_notebooks} notebooks and {fixed_pages} pages."))
@@ -0,0 +1,44 @@
+import json
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from notebooks.benchmark import run_benchmark
+
+
+class Command(BaseCommand):
+    help = "Benchmark the API routes against data from generate_dataset and save the results as JSON."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200, help="Timed requests per endpoint.")
+        parser.add_argument('--warmup', type=int, default=10, help="Untimed requests per endpoint first.")
+        parser.add_argument('--endpoint', action='append', dest='endpoints', help="Only run this endpoint (repeatable).")
+        parser.add_argument('--output', help="Result file (default: benchmark-<commit>-<time>.json).")
+        parser.add_argument('--compare', help="Earlier result file to compare p95 latency and queries with.")
+
+    def handle(self, *args, **options):
+        try:
+            results = run_benchmark(options['requests'], options['warmup'], options['endpoints'])
+        except ValueError as exc:
+            raise CommandError(str(exc))
+
+        meta = results['meta']
+        output = options['output'] or f"benchmark-{meta['commit'] or 'local'}-{meta['timestamp'][:19].replace(':', '')}.json"
+        Path(output).write_text(json.dumps(results, indent=2))
+
+        baseline = {}
+        if options['compare']:
+            baseline = json.loads(Path(options['compare']).read_text())['endpoints']
+
+        self.stdout.write(f"{'endpoint':<18}{'p50':>9}{'p95':>9}{'p99':>9}{'req/s':>9}{'queries':>9}")
+        for name, row in results['endpoints'].items():
+            line = (
+                f"{name:<18}{row['p50_ms']:>9.2f}{row['p95_ms']:>9.2f}{row['p99_ms']:>9.2f}"
+                f"{row['throughput_rps']:>9.1f}{row['queries_mean']:>9.1f}"
+            )
+            before = baseline.get(name)
+            if before:
+                change = (row['p95_ms'] - before['p95_ms']) / before['p95_ms'] * 100 if before['p95_ms'] else 0
+                line += f"   p95 {change:+.0f}%, queries {before['queries_mean']:.1f} -> {row['queries_mean']:.1f}"
+            self.stdout.write(line)
+        self.stdout.write(f"Saved {output}")
@@ -0,0 +1,30 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from notebooks.events import get_broker
+from notebooks.merges import process_next_job
+
+
+class Command(BaseCommand):
+    help = "Apply queued post merges. Several workers may run at once."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help="Drain the queue once and exit.")
+        parser.add_argument('--poll', type=float, default=1.0, help="Seconds to sleep when the queue is empty.")
+
+    def handle(self, *args, **options):
+        if not getattr(get_broker(), 'cross_process', True):
+            raise CommandError(
+                "HIVEMIND_EVENT_BROKER only delivers events within one process, so streams "
+                "would never see this worker's merges. Use notebooks.events.DatabaseBroker "
+                "or another shared broker."
+            )
+        while True:
+            job = process_next_job()
+            if job is not None:
+                self.stdout.write(f"{job.status}: post {job.post_id} (attempt {job.attempts})")
+                continue
+            if options['once']:
+                return
+            time.sleep(options['poll'])
@@ -0,0 +1,133 @@
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models import Value
+from django.db.models.signals import m2m_changed, post_save, pre_delete
+from django.dispatch import receiver
+from rest_framework import permissions
+from rest_framework.exceptions import NotFound
+
+from .caching import cache_timeout, invalidate_on_commit
+from .models import Notebook
+
+ADMIN = 'admin'
+MEMBER = 'member'
+
+
+def cache_key(user_id):
+    return f'hivemind:membership:{user_id}'
+
+
+def _role_rows(user_id):
+    # From the primary even on replica-routed reads: the result is cached
+    # for later requests, which must not see memberships a replica lags on
+    admin = Notebook.objects.using(DEFAULT_DB_ALIAS).filter(admin_id=user_id).values_list('notebook_id', Value(ADMIN))
+    member = Notebook.user_ids.through.objects.using(DEFAULT_DB_ALIAS).filter(user_id=user_id).values_list('notebook_id', Value(MEMBER))
+    return member.union(admin, all=True)
+
+
+def _roles(rows):
+    roles = {}
+    for notebook_id, role in rows:
+        if roles.get(notebook_id) != ADMIN:
+            roles[notebook_id] = role
+    return roles
+
+
+def load_roles(user_id):
+    """{notebook_id: role} for every notebook the user can access, in one query."""
+    return _roles(_role_rows(user_id))
+
+
+def notebook_roles(user, request=None):
+    """The user's notebook roles, memoized on `request` and cached across requests.
+
+    Entries are dropped whenever the user's memberships change (see the
+    signal handlers below), so changes apply from the next request.
+    """
+    if user is None or user.is_anonymous:
+        return {}
+    if request is not None and getattr(request, '_notebook_roles', None) is not None:
+        return request._notebook_roles
+
+    roles = cache.get(cache_key(user.pk))
+    if roles is None:
+        roles = load_roles(user.pk)
+        cache.set(cache_key(user.pk), roles, cache_timeout('HIVEMIND_MEMBERSHIP_CACHE_TIMEOUT'))
+    if request is not None:
+        request._notebook_roles = roles
+    return roles
+
+
+async def anotebook_roles(user, request=None):
+    """notebook_roles for async views."""
+    if user is None or user.is_anonymous:
+        return {}
+    if request is not None and getattr(request, '_notebook_roles', None) is not None:
+        return request._notebook_roles
+
+    roles = await cache.aget(cache_key(user.pk))
+    if roles is None:
+        roles = _roles([row async for row in _role_rows(user.pk)])
+        await cache.aset(cache_key(user.pk), roles, cache_timeout('HIVEMIND_MEMBERSHIP_CACHE_TIMEOUT'))
+    if request is not None:
+        request._notebook_roles = roles
+    return roles
+
+
+def notebook_role(request, notebook_id):
+    """The requesting user's role in a notebook, or None."""
+    return notebook_roles(request.user, request).get(notebook_id)
+
+
+def invalidate(user_ids):
+    keys = [cache_key(user_id) for user_id in user_ids if user_id is not None]
+    if keys:
+        invalidate_on_commit(lambda: cache.delete_many(keys))
+
+
+@receiver(m2m_changed, sender=Notebook.user_ids.through)
+def members_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == 'pre_clear':
+        if reverse:
+            invalidate([instance.pk])
+        else:
+            invalidate(instance.user_ids.values_list('id', flat=True))
+    elif action in ('post_add', 'post_remove'):
+        invalidate([instance.pk] if reverse else pk_set)
+
+
+@receiver(post_save, sender=Notebook)
+def notebook_saved(sender, instance, created, **kwargs):
+    if created:
+        invalidate([instance.admin_id_id])
+
+
+@receiver(pre_delete, sender=Notebook)
+def notebook_deleted(sender, instance, **kwargs):
+    invalidate([instance.admin_id_id, *instance.user_ids.values_list('id', flat=True)])
+
+
+class IsNotebookMember(permissions.BasePermission):
+    """Allows notebook-scoped views only to the notebook's admin and members.
+
+    Non-members get 404, as if the notebook did not exist.
+    """
+
+    def has_permission(self, request, view):
+        notebook_id = view.kwargs.get('notebook_id')
+        if notebook_id is None:
+            return True
+        if notebook_role(request, notebook_id) is None:
+            raise NotFound("Notebook not found.")
+        return True
+
+
+class IsNotebookAdminOrReadOnly(IsNotebookMember):
+    """Like IsNotebookMember, but only the admin may change or delete."""
+
+    def has_permission(self, request, view):
+        super().has_permission(request, view)
+        notebook_id = view.kwargs.get('notebook_id')
+        if request.method in permissions.SAFE_METHODS or notebook_id is None:
+            return True
+        return notebook_role(request, notebook_id) == ADMIN
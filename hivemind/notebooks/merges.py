@@ -0,0 +1,139 @@
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .counters import adjust_page, deleted_count
+from .events import publish_event
+from .models import MergeJob, Page, Post
+from .versioning import create_version
+
+logger = logging.getLogger(__name__)
+
+
+def max_attempts():
+    return getattr(settings, 'HIVEMIND_MERGE_MAX_ATTEMPTS', 5)
+
+
+def retry_delay(attempts):
+    """How long a job waits after its `attempts`-th failure: doubling backoff."""
+    return timedelta(seconds=getattr(settings, 'HIVEMIND_MERGE_RETRY_SECONDS', 5) * 2 ** (attempts - 1))
+
+
+def enqueue_merge(post_id, page_id):
+    """Queue `post_id` for merging and return whether a merge is now pending.
+
+    A pending job for the post is left as is. A skipped or failed one (votes
+    withdrawn, or errors) is queued again from scratch, so a post that
+    crosses the threshold a second time still merges.
+    """
+    now = timezone.now()
+    requeued = MergeJob.objects.filter(
+        post_id=post_id, status__in=[MergeJob.SKIPPED, MergeJob.FAILED]
+    ).update(status=MergeJob.PENDING, attempts=0, error='', created_at=now, next_attempt_at=now)
+    if requeued:
+        return True
+    MergeJob.objects.bulk_create([MergeJob(post_id=post_id, page_id_id=page_id)], ignore_conflicts=True)
+    return MergeJob.objects.filter(post_id=post_id, status=MergeJob.PENDING).exists()
+
+
+def _claim_next(exclude=()):
+    """Lock and return the oldest pending job that can run now, or None.
+
+    Must run inside a transaction. Jobs waiting out a retry delay and those in
+    `exclude` are passed over. Other workers skip locked jobs, and the page
+    row lock makes merges for one page apply one at a time. A job whose page
+    still has an older pending job is left for later, to keep the order.
+    """
+    candidates = MergeJob.objects.filter(
+        status=MergeJob.PENDING, next_attempt_at__lte=timezone.now()
+    ).exclude(job_id__in=exclude).order_by('created_at')
+    for job_id in candidates.values_list('job_id', flat=True)[:20]:
+        jobs = MergeJob.objects.filter(job_id=job_id, status=MergeJob.PENDING)
+        if connection.features.has_select_for_update_skip_locked:
+            jobs = jobs.select_for_update(skip_locked=True)
+        job = jobs.first()
+        if job is None:
+            continue
+        list(Page.objects.select_for_update().filter(page_id=job.page_id_id).values_list('page_id', flat=True))
+        older = MergeJob.objects.filter(
+            page_id=job.page_id_id, status=MergeJob.PENDING, created_at__lt=job.created_at
+        ).exists()
+        if not older:
+            return job
+    return None
+
+
+def apply_merge(job):
+    """Merge the job's post into its page. Safe to call again for a finished post."""
+    post = Post.objects.select_related('draft_id', 'user_id', 'page_id__notebook_id').filter(post_id=job.post_id).first()
+    if post is None:
+        # Already merged or deleted by its author
+        job.status = MergeJob.SKIPPED
+        return
+
+    page = Page.objects.select_related('latest_version', 'notebook_id').get(page_id=post.page_id_id)
+    merge_threshold = page.notebook_id.merge_threshold
+    if merge_threshold is None or post.votes < merge_threshold:
+        # Votes were withdrawn before the worker got to it
+        job.status = MergeJob.SKIPPED
+        return
+
+    new_version = create_version(
+        page=page,
+        user=post.user_id,
+        previous_version=page.latest_version,
+        content=post.draft_id.content
+    )
+    page.latest_version = new_version
+    page.save()
+
+    publish_event(
+        page.notebook_id_id, page.page_id, 'merged',
+        post_id=str(post.post_id), version_id=str(new_version.version_id)
+    )
+    # The draft's delete cascades to the post; whichever removes it counts
+    removed = deleted_count(post.draft_id.delete(), Post) + deleted_count(post.delete(), Post)
+    adjust_page(page.page_id, posts=-removed)
+    job.status = MergeJob.DONE
+    job.version_id = new_version
+
+
+def process_next_job(exclude=()):
+    """Apply the next pending merge. Returns the job, or None when idle.
+
+    A failed attempt leaves the job pending until its retry delay has passed.
+    """
+    with transaction.atomic():
+        job = _claim_next(exclude)
+        if job is None:
+            return None
+        job.attempts += 1
+        try:
+            with transaction.atomic():
+                apply_merge(job)
+        except Exception as exc:
+            logger.exception("Merge job %s failed", job.job_id)
+            job.error = str(exc)
+            if job.attempts >= max_attempts():
+                job.status = MergeJob.FAILED
+            else:
+                job.next_attempt_at = timezone.now() + retry_delay(job.attempts)
+        job.save()
+        return job
+
+
+def run_pending(limit=None):
+    """Process pending jobs until the queue is empty or `limit` jobs ran.
+
+    Each job is tried at most once per call, even when it is due again.
+    """
+    seen = set()
+    while limit is None or len(seen) < limit:
+        job = process_next_job(exclude=seen)
+        if job is None:
+            break
+        seen.add(job.job_id)
+    return len(seen)
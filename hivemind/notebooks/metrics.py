@@ -0,0 +1,270 @@
+import contextvars
+import hmac
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from rest_framework import permissions
+from rest_framework.renderers import JSONRenderer
+
+from .authentication import CachedTokenAuthentication
+
+logger = logging.getLogger('notebooks.slow_requests')
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (1, 2, 3, 5, 10, 20, 50, 100)
+
+_current = contextvars.ContextVar('hivemind_request_timings', default=None)
+
+
+def metrics_enabled():
+    return getattr(settings, 'HIVEMIND_METRICS', True)
+
+
+def slow_request_ms():
+    return getattr(settings, 'HIVEMIND_SLOW_REQUEST_MS', None)
+
+
+class RequestTimings:
+    """Time spent per phase of one request, plus its queries.
+
+    Queries run inside a phase count as db time, not as time of the phase.
+    """
+
+    def __init__(self, keep_sql):
+        self.started = time.perf_counter()
+        self.phases = {'auth': 0.0, 'db': 0.0, 'serialize': 0.0, 'render': 0.0}
+        self.queries = 0
+        self.keep_sql = keep_sql
+        self.sql = []
+        self._active = set()
+
+    @contextmanager
+    def phase(self, name):
+        if name in self._active:
+            # Nested serializers, already being timed by the outer one
+            yield
+            return
+        self._active.add(name)
+        start, db_start = time.perf_counter(), self.phases['db']
+        try:
+            yield
+        finally:
+            self._active.discard(name)
+            self.phases[name] += time.perf_counter() - start - (self.phases['db'] - db_start)
+
+    def __call__(self, execute, sql, params, many, context):
+        # connection.execute_wrappers hook, see time_queries
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - start
+            self.phases['db'] += elapsed
+            self.queries += 1
+            if self.keep_sql:
+                self.sql.append((elapsed, sql))
+
+
+def _timed_execute(execute, sql, params, many, context):
+    timings = _current.get()
+    if timings is None:
+        return execute(sql, params, many, context)
+    return timings(execute, sql, params, many, context)
+
+
+@receiver(connection_created)
+def time_queries(sender, connection, **kwargs):
+    # Connections are per thread and async views query from threads the
+    # middleware never sees, so each connection reports to the timings of
+    # the request in its context (sync_to_async carries the context over).
+    # First in line, so execute_wrapper() blocks still pop their own wrapper.
+    if _timed_execute not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, _timed_execute)
+
+
+@contextmanager
+def phase(name):
+    """Attribute the enclosed time to `name` in the current request, if any."""
+    timings = _current.get()
+    if timings is None:
+        yield
+    else:
+        with timings.phase(name):
+            yield
+
+
+class Histogram:
+    def __init__(self, name, help_text, buckets):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels, value):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * len(self.buckets), 0, 0.0]
+            counts = series[0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            series[1] += 1
+            series[2] += value
+
+    def clear(self):
+        with self._lock:
+            self._series.clear()
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            series = sorted(self._series.items())
+            for labels, (counts, count, total) in series:
+                label_text = ','.join(f'{key}="{value}"' for key, value in labels)
+                for bound, bucket_count in zip(self.buckets, counts):
+                    lines.append(f'{self.name}_bucket{{{label_text},le="{bound}"}} {bucket_count}')
+                lines.append(f'{self.name}_bucket{{{label_text},le="+Inf"}} {count}')
+                lines.append(f'{self.name}_sum{{{label_text}}} {total}')
+                lines.append(f'{self.name}_count{{{label_text}}} {count}')
+        return '\n'.join(lines)
+
+
+REQUEST_SECONDS = Histogram('hivemind_request_duration_seconds', 'Time to produce a response.', DURATION_BUCKETS)
+DB_SECONDS = Histogram('hivemind_request_db_seconds', 'Time spent in database queries per request.', DURATION_BUCKETS)
+APP_SECONDS = Histogram('hivemind_request_app_seconds', 'View time per request, excluding DB, auth, serialization and rendering.', DURATION_BUCKETS)
+SERIALIZE_SECONDS = Histogram('hivemind_request_serialize_seconds', 'Serializer time per request, excluding DB.', DURATION_BUCKETS)
+RENDER_SECONDS = Histogram('hivemind_request_render_seconds', 'Response rendering time per request.', DURATION_BUCKETS)
+QUERIES = Histogram('hivemind_request_queries', 'Database queries per request.', QUERY_BUCKETS)
+HISTOGRAMS = (REQUEST_SECONDS, DB_SECONDS, APP_SECONDS, SERIALIZE_SECONDS, RENDER_SECONDS, QUERIES)
+
+
+def render_metrics():
+    return '\n'.join(histogram.render() for histogram in HISTOGRAMS) + '\n'
+
+
+def reset_metrics():
+    for histogram in HISTOGRAMS:
+        histogram.clear()
+
+
+class MetricsMiddleware:
+    """Times each request by phase and reports it in Server-Timing headers
+    and the Prometheus histograms served by MetricsView.
+
+    Requests slower than HIVEMIND_SLOW_REQUEST_MS are logged with their
+    slowest queries. Set HIVEMIND_METRICS = False to remove it entirely.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not metrics_enabled():
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        timings = RequestTimings(keep_sql=slow_request_ms() is not None)
+        token = _current.set(timings)
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.record(request, response, timings)
+
+    async def __acall__(self, request):
+        timings = RequestTimings(keep_sql=slow_request_ms() is not None)
+        token = _current.set(timings)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.record(request, response, timings)
+
+    def record(self, request, response, timings):
+        threshold = slow_request_ms()
+        total = time.perf_counter() - timings.started
+        phases = timings.phases
+        app = max(0.0, total - sum(phases.values()))
+        match = getattr(request, 'resolver_match', None)
+        view_name = match.view_name if match else 'unmatched'
+        response['Server-Timing'] = ', '.join([
+            f'auth;dur={phases["auth"] * 1000:.1f}',
+            f'db;dur={phases["db"] * 1000:.1f};desc="{timings.queries} queries"',
+            f'app;dur={app * 1000:.1f}',
+            f'serialize;dur={phases["serialize"] * 1000:.1f}',
+            f'render;dur={phases["render"] * 1000:.1f}',
+            f'total;dur={total * 1000:.1f};desc="{view_name}"',
+        ])
+
+        labels = (('method', request.method), ('view', view_name))
+        REQUEST_SECONDS.observe(labels, total)
+        DB_SECONDS.observe(labels, phases['db'])
+        APP_SECONDS.observe(labels, app)
+        SERIALIZE_SECONDS.observe(labels, phases['serialize'])
+        RENDER_SECONDS.observe(labels, phases['render'])
+        QUERIES.observe(labels, timings.queries)
+
+        if threshold is not None and total * 1000 >= threshold:
+            worst = sorted(timings.sql, key=lambda item: item[0], reverse=True)[:5]
+            logger.warning(
+                "Slow request %s %s: %.0f ms, %d queries (%.0f ms in DB)\n%s",
+                request.method, request.path, total * 1000, timings.queries, phases['db'] * 1000,
+                '\n'.join(f'  {elapsed * 1000:.1f} ms: {sql}' for elapsed, sql in worst),
+            )
+        return response
+
+
+class TimedTokenAuthentication(CachedTokenAuthentication):
+    def authenticate(self, request):
+        with phase('auth'):
+            return super().authenticate(request)
+
+    async def aauthenticate(self, request):
+        with phase('auth'):
+            return await super().aauthenticate(request)
+
+
+class TimedSerializerMixin:
+    """Counts a serializer's to_representation as the request's serialize phase."""
+
+    def to_representation(self, instance):
+        with phase('serialize'):
+            return super().to_representation(instance)
+
+
+class TimedJSONRenderer(JSONRenderer):
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        with phase('render'):
+            return super().render(data, accepted_media_type, renderer_context)
+
+
+class CanReadMetrics(permissions.BasePermission):
+    """Staff users, or scrapers presenting HIVEMIND_METRICS_TOKEN as a bearer
+    token. Unauthenticated INTERNAL_IPS are let in only when
+    HIVEMIND_METRICS_ALLOW_INTERNAL_IPS is set."""
+
+    def has_permission(self, request, view):
+        if request.user and request.user.is_staff:
+            return True
+        token = getattr(settings, 'HIVEMIND_METRICS_TOKEN', None)
+        if token:
+            scheme, _, given = request.META.get('HTTP_AUTHORIZATION', '').partition(' ')
+            if scheme.lower() == 'bearer' and hmac.compare_digest(given.encode(), token.encode()):
+                return True
+        if getattr(settings, 'HIVEMIND_METRICS_ALLOW_INTERNAL_IPS', False):
+            return request.META.get('REMOTE_ADDR') in getattr(settings, 'INTERNAL_IPS', ())
+        return False
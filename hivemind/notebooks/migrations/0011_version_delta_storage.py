@@ -0,0 +1,29 @@
+# Generated by Django 5.2.7 on 2026-10-18 01:32
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notebooks', '0010_alter_draft_content_alter_post_content_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='version',
+            name='base_version',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='delta_versions', to='notebooks.version'),
+        ),
+        migrations.AddField(
+            model_name='version',
+            name='chain_depth',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='version',
+            name='delta',
+            field=models.JSONField(blank=True, null=True),
+        ),
+    ]
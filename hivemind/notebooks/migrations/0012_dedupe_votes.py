@@ -0,0 +1,35 @@
+from django.db import migrations
+from django.db.models import Count
+
+
+def dedupe_votes(apps, schema_editor):
+    """Drop duplicate (user, post) votes left by concurrent toggles and
+    recount the affected posts, so the unique constraint can be added."""
+    Vote = apps.get_model('notebooks', 'Vote')
+    Post = apps.get_model('notebooks', 'Post')
+
+    duplicates = (
+        Vote.objects.values('user_id', 'post_id')
+        .annotate(n=Count('vote_id'))
+        .filter(n__gt=1)
+    )
+    affected = set()
+    for row in list(duplicates):
+        votes = Vote.objects.filter(user_id=row['user_id'], post_id=row['post_id'])
+        extra = list(votes.values_list('vote_id', flat=True)[1:])
+        Vote.objects.filter(vote_id__in=extra).delete()
+        affected.add(row['post_id'])
+
+    for post_id in affected:
+        Post.objects.filter(post_id=post_id).update(votes=Vote.objects.filter(post_id=post_id).count())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notebooks', '0011_version_delta_storage'),
+    ]
+
+    operations = [
+        migrations.RunPython(dedupe_votes, migrations.RunPython.noop),
+    ]
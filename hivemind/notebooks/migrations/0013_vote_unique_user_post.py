@@ -0,0 +1,17 @@
+# Generated by Django 5.2.7 on 2026-10-18 01:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notebooks', '0012_dedupe_votes'),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name='vote',
+            constraint=models.UniqueConstraint(fields=('user_id', 'post_id'), name='unique_vote_per_user_post'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.7 on 2026-10-18 01:47
+
+import django.db.models.deletion
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notebooks', '0013_vote_unique_user_post'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MergeJob',
+            fields=[
+                ('job_id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('post_id', models.UUIDField(unique=True)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('done', 'Done'), ('skipped', 'Skipped'), ('failed', 'Failed')], default='pending', max_length=16)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('error', models.TextField(blank=True, default='')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('page_id', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='merge_jobs', to='notebooks.page')),
+                ('version_id', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='notebooks.version')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'created_at'], name='mergejob_status_created_idx')],
+            },
+        ),
+    ]
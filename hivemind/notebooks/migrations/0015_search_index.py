@@ -0,0 +1,64 @@
+# Generated by Django 5.2.7 on 2026-10-18 01:54
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+import django.db.models.deletion
+import uuid
+from django.db import migrations, models
+
+
+class PostgresAddIndex(migrations.AddIndex):
+    """AddIndex that only touches PostgreSQL. The index is in the model state
+    everywhere; other databases search SearchTerm rows and have no GIN."""
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor == 'postgresql':
+            super().database_forwards(app_label, schema_editor, from_state, to_state)
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor == 'postgresql':
+            super().database_backwards(app_label, schema_editor, from_state, to_state)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notebooks', '0014_mergejob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchEntry',
+            fields=[
+                ('entry_id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('is_latest', models.BooleanField(default=True)),
+                ('document', django.contrib.postgres.search.SearchVectorField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('notebook_id', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_entries', to='notebooks.notebook')),
+                ('page_id', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_entries', to='notebooks.page')),
+                ('version_id', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='search_entry', to='notebooks.version')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='SearchTerm',
+            fields=[
+                ('term_id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('term', models.CharField(max_length=64)),
+                ('field', models.CharField(choices=[('A', 'Title'), ('B', 'Content')], max_length=1)),
+                ('score', models.FloatField()),
+                ('entry_id', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='terms', to='notebooks.searchentry')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='searchentry',
+            index=models.Index(fields=['notebook_id', 'is_latest'], name='searchentry_notebook_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='searchterm',
+            index=models.Index(fields=['term'], name='searchterm_term_idx'),
+        ),
+        PostgresAddIndex(
+            model_name='searchentry',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['document'], name='searchentry_document_gin'),
+        ),
+    ]
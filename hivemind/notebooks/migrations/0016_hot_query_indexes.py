@@ -0,0 +1,32 @@
+# Generated by Django 5.2.7 on 2026-10-18 02:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notebooks', '0015_search_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='draft',
+            index=models.Index(fields=['user_id', '-updated_at', '-draft_id'], name='draft_user_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['page_id', '-votes', '-created_at', '-post_id'], name='post_page_votes_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='version',
+            index=models.Index(fields=['page_id', 'created_at', 'version_id'], name='version_page_created_idx'),
+        ),
+        # Membership lookups by user (notebooks.membership.load_roles) read
+        # notebook ids straight from this index. The auto-created members
+        # table has no Meta to declare it in.
+        migrations.RunSQL(
+            'CREATE INDEX notebook_members_user_idx ON notebooks_notebook_user_ids (user_id, notebook_id)',
+            'DROP INDEX notebook_members_user_idx',
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-18 02:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notebooks', '0016_hot_query_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notebook',
+            name='retention_policy',
+            field=models.JSONField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,24 @@
+from django.db import migrations
+
+import notebooks.fields
+
+MODELS = [('version', 'version_id'), ('draft', 'draft_id'), ('post', 'post_id')]
+
+
+class Migration(migrations.Migration):
+    # Bodies move to compressed columns in three steps: this adds them,
+    # 0018_compressed_content_backfill copies the bodies over in chunks and
+    # 0018_compressed_content_swap drops the old columns.
+
+    dependencies = [
+        ('notebooks', '0017_notebook_retention_policy'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name=model_name,
+            name='content_stored',
+            field=notebooks.fields.CompressedTextField(blank=True, default=''),
+        )
+        for model_name, _ in MODELS
+    ]
@@ -0,0 +1,44 @@
+from django.db import migrations
+
+MODELS = [('version', 'version_id'), ('draft', 'draft_id'), ('post', 'post_id')]
+CHUNK_SIZE = 500
+
+
+def copy_bodies(apps, source, target):
+    """Copy every row's body from `source` to `target`, CHUNK_SIZE rows at a time."""
+    for model_name, pk in MODELS:
+        model = apps.get_model('notebooks', model_name)
+        last = None
+        while True:
+            rows = model.objects.order_by(pk).values_list(pk, source)
+            if last is not None:
+                rows = rows.filter(**{f'{pk}__gt': last})
+            batch = list(rows[:CHUNK_SIZE])
+            if not batch:
+                break
+            model.objects.bulk_update(
+                [model(**{pk: key, target: str(body)}) for key, body in batch], [target]
+            )
+            last = batch[-1][0]
+
+
+def compress_bodies(apps, schema_editor):
+    copy_bodies(apps, 'content', 'content_stored')
+
+
+def expand_bodies(apps, schema_editor):
+    copy_bodies(apps, 'content_stored', 'content')
+
+
+class Migration(migrations.Migration):
+    # Each chunk commits on its own, so the copy holds no long transaction
+    # or locks, and rerunning after a failure just copies again
+    atomic = False
+
+    dependencies = [
+        ('notebooks', '0018_compressed_content'),
+    ]
+
+    operations = [
+        migrations.RunPython(compress_bodies, expand_bodies),
+    ]
@@ -0,0 +1,18 @@
+from django.db import migrations
+
+MODELS = ['version', 'draft', 'post']
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notebooks', '0018_compressed_content_backfill'),
+    ]
+
+    operations = [
+        *[migrations.RemoveField(model_name=model_name, name='content') for model_name in MODELS],
+        *[
+            migrations.RenameField(model_name=model_name, old_name='content_stored', new_name='content')
+            for model_name in MODELS
+        ],
+    ]
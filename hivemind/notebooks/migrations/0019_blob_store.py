@@ -0,0 +1,40 @@
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+import notebooks.fields
+
+MODELS = ['version', 'draft', 'post']
+
+
+class Migration(migrations.Migration):
+    # Bodies move to blobs in three steps: this adds the Blob table and
+    # nullable references to it, 0019_blob_store_backfill fills them in
+    # chunks and 0019_blob_store_swap drops the old columns.
+
+    dependencies = [
+        ('notebooks', '0018_compressed_content_swap'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Blob',
+            fields=[
+                ('hash', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('content', notebooks.fields.CompressedTextField(blank=True, default='')),
+                ('size', models.PositiveIntegerField(default=0)),
+                ('last_used_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['last_used_at'], name='blob_last_used_idx')],
+            },
+        ),
+        *[
+            migrations.AddField(
+                model_name=model_name,
+                name='blob',
+                field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='notebooks.blob'),
+            )
+            for model_name in MODELS
+        ],
+    ]
@@ -0,0 +1,56 @@
+import hashlib
+
+from django.db import migrations
+
+MODELS = [('version', 'version_id'), ('draft', 'draft_id'), ('post', 'post_id')]
+CHUNK_SIZE = 500
+
+
+def move_bodies_to_blobs(apps, schema_editor):
+    Blob = apps.get_model('notebooks', 'Blob')
+    for model_name, pk in MODELS:
+        model = apps.get_model('notebooks', model_name)
+        last = None
+        while True:
+            rows = model.objects.order_by(pk).values_list(pk, 'content')
+            if last is not None:
+                rows = rows.filter(**{f'{pk}__gt': last})
+            batch = [(key, str(body)) for key, body in rows[:CHUNK_SIZE]]
+            if not batch:
+                break
+            hashes = {key: hashlib.sha256(text.encode('utf-8')).hexdigest() for key, text in batch}
+            Blob.objects.bulk_create(
+                [Blob(hash=hashes[key], content=text, size=len(text)) for key, text in batch],
+                ignore_conflicts=True,
+            )
+            model.objects.bulk_update([model(**{pk: key, 'blob_id': hashes[key]}) for key, _ in batch], ['blob'])
+            last = batch[-1][0]
+
+
+def move_bodies_from_blobs(apps, schema_editor):
+    for model_name, pk in MODELS:
+        model = apps.get_model('notebooks', model_name)
+        last = None
+        while True:
+            rows = model.objects.order_by(pk).values_list(pk, 'blob__content')
+            if last is not None:
+                rows = rows.filter(**{f'{pk}__gt': last})
+            batch = list(rows[:CHUNK_SIZE])
+            if not batch:
+                break
+            model.objects.bulk_update([model(**{pk: key, 'content': str(body)}) for key, body in batch], ['content'])
+            last = batch[-1][0]
+
+
+class Migration(migrations.Migration):
+    # Each chunk commits on its own, so the move holds no long transaction
+    # or locks, and rerunning after a failure picks the rows up again
+    atomic = False
+
+    dependencies = [
+        ('notebooks', '0019_blob_store'),
+    ]
+
+    operations = [
+        migrations.RunPython(move_bodies_to_blobs, move_bodies_from_blobs),
+    ]
@@ -0,0 +1,23 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+MODELS = ['version', 'draft', 'post']
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notebooks', '0019_blob_store_backfill'),
+    ]
+
+    operations = [
+        *[migrations.RemoveField(model_name=model_name, name='content') for model_name in MODELS],
+        *[
+            migrations.AlterField(
+                model_name=model_name,
+                name='blob',
+                field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='+', to='notebooks.blob'),
+            )
+            for model_name in MODELS
+        ],
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 5.2.7 on 2026-10-18 02:38
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def _count(model, field):
+    rows = model.objects.filter(**{field: OuterRef('pk')}).order_by().values(field).annotate(n=Count('*')).values('n')
+    return Coalesce(Subquery(rows, output_field=IntegerField()), Value(0))
+
+
+def fill_counters(apps, schema_editor):
+    Notebook = apps.get_model('notebooks', 'Notebook')
+    Page = apps.get_model('notebooks', 'Page')
+    Notebook.objects.update(
+        member_count=_count(Notebook.user_ids.through, 'notebook_id'),
+        page_count=_count(Page, 'notebook_id'),
+    )
+    Page.objects.update(
+        post_count=_count(apps.get_model('notebooks', 'Post'), 'page_id'),
+        version_count=_count(apps.get_model('notebooks', 'Version'), 'page_id'),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notebooks', '0019_blob_store_swap'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notebook',
+            name='member_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='notebook',
+            name='page_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='page',
+            name='post_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='page',
+            name='version_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
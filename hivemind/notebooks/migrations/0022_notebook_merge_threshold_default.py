@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-18 04:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notebooks', '0021_stream_events'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='notebook',
+            name='merge_threshold',
+            field=models.IntegerField(default=3, null=True),
+        ),
+    ]
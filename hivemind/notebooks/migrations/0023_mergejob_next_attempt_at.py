@@ -0,0 +1,19 @@
+# Generated by Django 5.2.7 on 2026-10-18 04:25
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notebooks', '0022_notebook_merge_threshold_default'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mergejob',
+            name='next_attempt_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
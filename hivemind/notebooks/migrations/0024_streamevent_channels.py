@@ -0,0 +1,24 @@
+# Generated by Django 5.2.7 on 2026-10-18 04:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notebooks', '0023_mergejob_next_attempt_at'),
+    ]
+
+    # Stream events are only kept for a few minutes; rows written before the
+    # upgrade are left without channels rather than converted
+    operations = [
+        migrations.RemoveField(
+            model_name='streamevent',
+            name='channel',
+        ),
+        migrations.AddField(
+            model_name='streamevent',
+            name='channels',
+            field=models.JSONField(default=list),
+        ),
+    ]
@@ -1,6 +1,14 @@
+from django.conf import settings
 from django.db import models
 from django.contrib.auth.models import AbstractUser
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
+from django.utils import timezone
+from datetime import timedelta
 import uuid
+
+from .fields import CompressedTextField
+from .patches import content_hash
 # Create your models here.
 class User(AbstractUser):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
@@ -8,61 +16,203 @@ class User(AbstractUser):
     def __str__(self):
         return self.username
 
-class Notebook(models.Model):
+class CounterFieldsMixin:
+    """Leaves `counter_fields` out of full saves of existing rows.
+
+    Counters move by F() updates (see counters.py), so an instance loaded
+    before one of them must not write its stale value back.
+    """
+    counter_fields = ()
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding and kwargs.get('update_fields') is None and not kwargs.get('force_insert'):
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.counter_fields
+            ]
+        super().save(*args, **kwargs)
+
+class Notebook(CounterFieldsMixin, models.Model):
     notebook_id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     admin_id = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, related_name='notebooks')
     title = models.CharField(max_length=255)
     user_ids = models.ManyToManyField(User, related_name='user_notebooks', blank=True)
     merge_threshold = models.IntegerField(null=True, default=3)
+    # Tiers applied by `manage.py compact_versions` (see retention.py); null keeps every version
+    retention_policy = models.JSONField(null=True, blank=True)
+    # Kept in step by the write paths (see counters.py)
+    member_count = models.IntegerField(default=0)
+    page_count = models.IntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    counter_fields = ('member_count', 'page_count')
+
     def __str__(self):
         return self.title
 
-class Version(models.Model):
+def blob_gc_grace():
+    return timedelta(seconds=getattr(settings, 'HIVEMIND_BLOB_GC_GRACE_SECONDS', 3600))
+
+class BlobManager(models.Manager):
+    def intern(self, texts):
+        """Make sure a blob exists for each text and return their hashes.
+
+        Blobs used within half the GC grace period cost one read. Older ones
+        get last_used_at refreshed first, so the collector cannot delete a
+        blob between here and the commit of the row that refers to it.
+        """
+        hashes = [content_hash(text) for text in texts]
+        unique = dict(zip(hashes, texts))
+        now = timezone.now()
+        fresh = set(
+            self.filter(hash__in=unique, last_used_at__gte=now - blob_gc_grace() / 2)
+            .values_list('hash', flat=True)
+        )
+        stale = [key for key in unique if key not in fresh]
+        if stale:
+            self.filter(hash__in=stale).update(last_used_at=now)
+            self.bulk_create([
+                Blob(hash=key, content=unique[key], size=len(unique[key]), last_used_at=now)
+                for key in stale
+            ], ignore_conflicts=True)
+        return hashes
+
+class Blob(models.Model):
+    """Text stored once, keyed by its SHA-256 (see patches.content_hash).
+
+    Drafts, posts and versions point at blobs, so copying text between them
+    copies a hash. Unreferenced blobs are removed by `manage.py collect_blobs`.
+    """
+    hash = models.CharField(max_length=64, primary_key=True)
+    content = CompressedTextField(default='', blank=True)
+    size = models.PositiveIntegerField(default=0)
+    last_used_at = models.DateTimeField(default=timezone.now)
+
+    objects = BlobManager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['last_used_at'], name='blob_last_used_idx'),
+        ]
+
+    def __str__(self):
+        return f"Blob {self.hash[:12]} ({self.size} chars)"
+
+class BlobContentQuerySet(models.QuerySet):
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = list(objs)
+        pending = [obj for obj in objs if obj._pending_content is not None or obj.blob_id is None]
+        for obj, key in zip(pending, Blob.objects.intern([obj.content for obj in pending])):
+            obj.blob_id = key
+            obj._pending_content = None
+        return super().bulk_create(objs, *args, **kwargs)
+
+class BlobContent(models.Model):
+    """Keeps the row's text in a shared Blob; `content` reads and writes it.
+
+    Assigned text is interned when the row is saved, so save with
+    update_fields=['blob'] after changing it.
+    """
+    blob = models.ForeignKey(Blob, on_delete=models.PROTECT, related_name='+')
+
+    objects = BlobContentQuerySet.as_manager()
+
+    class Meta:
+        abstract = True
+
+    _pending_content = None
+
+    @property
+    def content(self):
+        if self._pending_content is not None:
+            return self._pending_content
+        if self.blob_id is None:
+            return ''
+        return self.blob.content
+
+    @content.setter
+    def content(self, text):
+        self._pending_content = text
+
+    def save(self, *args, **kwargs):
+        if self._pending_content is not None or self.blob_id is None:
+            self.blob_id = Blob.objects.intern([self.content])[0]
+            self._pending_content = None
+        super().save(*args, **kwargs)
+
+class Version(BlobContent):
     version_id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     user_id = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, related_name='versions')
     page_id = models.ForeignKey('Page', on_delete=models.CASCADE, null=True, related_name='page')
     previous_version = models.ForeignKey('self', on_delete=models.CASCADE, null=True, related_name='prev_version')
-    content = models.TextField(default='', blank=True)
+    # Delta storage: when `delta` is set, `content` is empty and the text is
+    # rebuilt from `base_version` (the nearest full snapshot) forward.
+    delta = models.JSONField(null=True, blank=True)
+    base_version = models.ForeignKey('self', on_delete=models.CASCADE, null=True, blank=True, related_name='delta_versions')
+    chain_depth = models.PositiveIntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # Version history of a page, oldest first (VersionPagination order)
+            models.Index(fields=['page_id', 'created_at', 'version_id'], name='version_page_created_idx'),
+        ]
+
     def __str__(self):
         return f"Version {self.version_id} by {self.user_id}"
 
-class Page(models.Model):
+    def get_content(self):
+        from .versioning import version_content
+        return version_content(self)
+
+class Page(CounterFieldsMixin, models.Model):
     page_id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     notebook_id = models.ForeignKey(Notebook, on_delete=models.CASCADE, related_name='pages')
     title = models.CharField(max_length=255)
     latest_version = models.ForeignKey(Version, on_delete=models.SET_NULL, null=True, blank=True)
+    # Open posts and versions, kept in step by the write paths (see counters.py)
+    post_count = models.IntegerField(default=0)
+    version_count = models.IntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    counter_fields = ('post_count', 'version_count')
+
     def __str__(self):
         return self.title
 
-class Draft(models.Model):
+class Draft(BlobContent):
     draft_id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     user_id = models.ForeignKey(User, on_delete=models.CASCADE, null=True, related_name='creator')
     page_id = models.ForeignKey(Page, on_delete=models.CASCADE, null=True, related_name='origin')
-    content = models.TextField(default='', blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            # A user's drafts, most recently edited first (DraftPagination order)
+            models.Index(fields=['user_id', '-updated_at', '-draft_id'], name='draft_user_updated_idx'),
+        ]
+
     def __str__(self):
         return f"Draft {self.draft_id} by {self.user_id}"
 
-class Post(models.Model):
+class Post(BlobContent):
     post_id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     user_id = models.ForeignKey(User, on_delete=models.CASCADE, null=True, related_name='poster')
     page_id = models.ForeignKey(Page, on_delete=models.CASCADE, null=True, related_name='page_to_update')
     draft_id = models.ForeignKey(Draft, on_delete=models.CASCADE, null=True, related_name='draft')
-    content = models.TextField(default='', blank=True)
     votes = models.IntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            # Posts of a page, most voted first (PostPagination order)
+            models.Index(fields=['page_id', '-votes', '-created_at', '-post_id'], name='post_page_votes_idx'),
+        ]
+
     def __str__(self):
         return f"Post {self.post_id} by {self.user_id}"
     
@@ -70,3 +220,91 @@ class Vote(models.Model):
     vote_id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     user_id = models.ForeignKey(User, on_delete=models.CASCADE, null=True, related_name='user')
     post_id = models.ForeignKey(Post, on_delete=models.CASCADE, null=True, related_name='post')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user_id', 'post_id'], name='unique_vote_per_user_post'),
+        ]
+
+class MergeJob(models.Model):
+    """A queued merge of a post into its page, applied by the merge worker.
+
+    At most one job exists per post: duplicate enqueues are no-ops, and a
+    skipped or failed job is reset to pending when the post is queued again.
+    """
+    PENDING = 'pending'
+    DONE = 'done'
+    SKIPPED = 'skipped'
+    FAILED = 'failed'
+    STATUS_CHOICES = [(PENDING, 'Pending'), (DONE, 'Done'), (SKIPPED, 'Skipped'), (FAILED, 'Failed')]
+
+    job_id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    post_id = models.UUIDField(unique=True)
+    page_id = models.ForeignKey(Page, on_delete=models.CASCADE, related_name='merge_jobs')
+    version_id = models.ForeignKey(Version, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True, default='')
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'created_at'], name='mergejob_status_created_idx'),
+        ]
+
+    def __str__(self):
+        return f"MergeJob {self.job_id} for post {self.post_id} ({self.status})"
+
+class StreamEvent(models.Model):
+    """An event published through notebooks.events.DatabaseBroker.
+
+    Every process with stream listeners polls for new rows, so events reach
+    them from any process, such as the merge worker. One row carries an
+    event to all its channels. Rows are only kept for a few minutes.
+    """
+    event_id = models.BigAutoField(primary_key=True)
+    channels = models.JSONField(default=list)
+    payload = models.JSONField()
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+class SearchEntry(models.Model):
+    """Search index row for one version of a page, kept up to date by search.py.
+
+    On PostgreSQL `document` holds the page title (weight A) and the version
+    text (weight B) as a tsvector behind a GIN index. Other databases index
+    the same words as SearchTerm rows instead.
+    """
+    entry_id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    notebook_id = models.ForeignKey(Notebook, on_delete=models.CASCADE, related_name='search_entries')
+    page_id = models.ForeignKey(Page, on_delete=models.CASCADE, related_name='search_entries')
+    version_id = models.OneToOneField(Version, on_delete=models.CASCADE, related_name='search_entry')
+    is_latest = models.BooleanField(default=True)
+    document = SearchVectorField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['notebook_id', 'is_latest'], name='searchentry_notebook_idx'),
+            # Only created on PostgreSQL, see migration 0015
+            GinIndex(fields=['document'], name='searchentry_document_gin'),
+        ]
+
+class SearchTerm(models.Model):
+    """One word of a SearchEntry, for databases without full-text search."""
+    TITLE = 'A'
+    CONTENT = 'B'
+
+    term_id = models.BigAutoField(primary_key=True)
+    entry_id = models.ForeignKey(SearchEntry, on_delete=models.CASCADE, related_name='terms')
+    term = models.CharField(max_length=64)
+    field = models.CharField(max_length=1, choices=[(TITLE, 'Title'), (CONTENT, 'Content')])
+    # Occurrences scaled by the field weight, summed for ranking
+    score = models.FloatField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['term'], name='searchterm_term_idx'),
+        ]
+
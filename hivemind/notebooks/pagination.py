@@ -0,0 +1,177 @@
+import base64
+import json
+from functools import reduce
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """Cursor pagination that seeks past the last row instead of using offsets.
+
+    The cursor holds the ordering values of the last row returned, and the
+    next page is fetched with a lexicographic comparison on them. The last
+    ordering field must be unique so ties never split or repeat rows. Cost
+    stays flat however deep the client pages.
+    """
+    ordering = ()
+    # Alternative orderings clients pick with ?ordering=<name>, each ending in a unique field
+    orderings = {}
+    ordering_query_param = 'ordering'
+    page_size = 50
+    max_page_size = 200
+    page_size_query_param = 'page_size'
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        return self.page_of(list(self.page_queryset(queryset, request)))
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        """paginate_queryset for async views."""
+        return self.page_of([row async for row in self.page_queryset(queryset, request)])
+
+    def page_queryset(self, queryset, request):
+        """The rows of the requested page, plus one to tell whether there is a next."""
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.ordering = self.orderings.get(request.query_params.get(self.ordering_query_param), self.ordering)
+        queryset = queryset.order_by(*self.ordering)
+
+        position = self.decode_cursor(request)
+        if position is not None:
+            queryset = queryset.filter(self.after(self.coerce_position(queryset.model, position)))
+        return queryset[:self.page_size + 1]
+
+    def coerce_position(self, model, position):
+        """Convert cursor values with their ordering fields, so a tampered
+        cursor is a 404 rather than a database error."""
+        values = []
+        for field, value in zip(self.ordering, position):
+            try:
+                value = model._meta.get_field(field.lstrip('-')).to_python(value)
+            except FieldDoesNotExist:
+                pass
+            except (ValidationError, ValueError, TypeError):
+                raise NotFound(self.invalid_cursor_message)
+            if value is None:
+                raise NotFound(self.invalid_cursor_message)
+            values.append(value)
+        return values
+
+    def page_of(self, rows):
+        self.has_next = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        self.next_position = self.position_of(rows[-1]) if self.has_next else None
+        return rows
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return max(1, min(size, self.max_page_size))
+
+    def after(self, position):
+        """Q object selecting rows that sort strictly after `position`."""
+        clauses = []
+        for i, field in enumerate(self.ordering):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            equal = {f.lstrip('-'): value for f, value in zip(self.ordering[:i], position[:i])}
+            clauses.append(Q(**equal, **{f'{name}__{lookup}': position[i]}))
+        return reduce(lambda a, b: a | b, clauses)
+
+    def position_of(self, obj):
+        return [getattr(obj, field.lstrip('-')) for field in self.ordering]
+
+    def cursor_length(self):
+        return len(self.ordering)
+
+    def encode_cursor(self, position):
+        raw = json.dumps([str(value) if not isinstance(value, int) else value for value in position])
+        return base64.urlsafe_b64encode(raw.encode()).decode()
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            position = json.loads(base64.urlsafe_b64decode(encoded.encode()).decode())
+        except (ValueError, TypeError):
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(position, list) or len(position) != self.cursor_length():
+            raise NotFound(self.invalid_cursor_message)
+        return position
+
+    def get_next_link(self):
+        if self.next_position is None:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.next_position))
+
+    def get_paginated_response(self, data):
+        return Response({'next': self.get_next_link(), 'results': data})
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+
+class OffsetCursorPagination(KeysetPagination):
+    """Same cursor and response shape, but the cursor holds a row offset.
+
+    For orderings on computed scores such as search rank, where seeking
+    past a float value is not exact. The queryset keeps its own ordering.
+    """
+    def page_queryset(self, queryset, request):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        position = self.decode_cursor(request)
+        if position is not None and not (isinstance(position[0], int) and position[0] >= 0):
+            raise NotFound(self.invalid_cursor_message)
+        self.offset = position[0] if position else 0
+        return queryset[self.offset:self.offset + self.page_size + 1]
+
+    def page_of(self, rows):
+        self.has_next = len(rows) > self.page_size
+        self.next_position = [self.offset + self.page_size] if self.has_next else None
+        return rows[:self.page_size]
+
+    def cursor_length(self):
+        return 1
+
+
+class VersionPagination(KeysetPagination):
+    ordering = ('created_at', 'version_id')
+
+
+class PostPagination(KeysetPagination):
+    ordering = ('-votes', '-created_at', '-post_id')
+
+
+class DraftPagination(KeysetPagination):
+    ordering = ('-updated_at', '-draft_id')
+
+
+class NotebookPagination(KeysetPagination):
+    ordering = ('-updated_at', '-notebook_id')
+    orderings = {
+        'members': ('-member_count', '-updated_at', '-notebook_id'),
+        'pages': ('-page_count', '-updated_at', '-notebook_id'),
+    }
+
+
+class SearchPagination(OffsetCursorPagination):
+    page_size = 20
+    max_page_size = 100
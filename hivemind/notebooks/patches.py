@@ -0,0 +1,38 @@
+import hashlib
+
+
+class PatchError(ValueError):
+    pass
+
+
+def content_hash(text):
+    """SHA-256 of the UTF-8 text, hex encoded. Clients compute the same value."""
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def apply_patch(base, ops):
+    """Apply splice ops to `base` and return the new text.
+
+    Each op is ``[start, end, text]``: replace the characters ``base[start:end]``
+    with `text`. Offsets count Unicode code points in `base`, and ops must be
+    sorted and must not overlap.
+    """
+    if not isinstance(ops, list):
+        raise PatchError("ops must be a list.")
+    parts = []
+    position = 0
+    for op in ops:
+        if (
+            not isinstance(op, list) or len(op) != 3
+            or not all(isinstance(n, int) and not isinstance(n, bool) for n in op[:2])
+            or not isinstance(op[2], str)
+        ):
+            raise PatchError("Each op must be [start, end, text].")
+        start, end, text = op
+        if not position <= start <= end <= len(base):
+            raise PatchError("Ops must be in order, non-overlapping and within the content.")
+        parts.append(base[position:start])
+        parts.append(text)
+        position = end
+    parts.append(base[position:])
+    return ''.join(parts)
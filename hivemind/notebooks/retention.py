@@ -0,0 +1,215 @@
+"""Version retention policies and history compaction, run by the
+`compact_versions` management command."""
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .counters import adjust_page, deleted_count
+from .models import Page, Version
+from .versioning import encode_version, prefetch_content, snapshot_interval, version_content
+from .workspace import invalidate_notebooks
+
+KEEP_CHOICES = ('all', 'hour', 'day', 'week', 'month', 'year')
+KEEP_ALL = object()
+
+
+class PolicyError(ValueError):
+    pass
+
+
+def parse_policy(policy):
+    """Validate a notebook's retention_policy and return its tiers.
+
+    A policy is a list of tiers such as
+    ``[{"max_age_days": 30, "keep": "all"}, {"max_age_days": 365, "keep": "day"}, {"keep": "month"}]``:
+    versions younger than a tier's max_age_days are thinned to the newest
+    one per `keep` period. Only the last tier may leave out max_age_days;
+    if it does not, versions older than every tier are removed. Returns a
+    list of (max_age timedelta or None, keep) pairs.
+    """
+    if not isinstance(policy, list) or not policy:
+        raise PolicyError("Retention policy must be a non-empty list of tiers.")
+    tiers = []
+    for index, tier in enumerate(policy):
+        if not isinstance(tier, dict) or not set(tier) <= {'max_age_days', 'keep'}:
+            raise PolicyError("Each tier must be an object with 'keep' and 'max_age_days'.")
+        keep = tier.get('keep')
+        if keep not in KEEP_CHOICES:
+            raise PolicyError(f"'keep' must be one of {', '.join(KEEP_CHOICES)}.")
+        days = tier.get('max_age_days')
+        if days is None:
+            if index != len(policy) - 1:
+                raise PolicyError("Only the last tier may leave out max_age_days.")
+            tiers.append((None, keep))
+            continue
+        if isinstance(days, bool) or not isinstance(days, int) or days <= 0:
+            raise PolicyError("max_age_days must be a positive integer.")
+        if tiers and days <= tiers[-1][0].days:
+            raise PolicyError("Tiers must be ordered by increasing max_age_days.")
+        tiers.append((timedelta(days=days), keep))
+    return tiers
+
+
+def _period(created_at, keep):
+    local = timezone.localtime(created_at)
+    if keep == 'hour':
+        return local.date(), local.hour
+    if keep == 'day':
+        return local.date()
+    if keep == 'week':
+        return local.isocalendar()[:2]
+    if keep == 'month':
+        return local.year, local.month
+    return local.year
+
+
+def retention_bucket(tiers, now, created_at):
+    """The group a version falls in; only the newest of each group is kept.
+
+    Returns KEEP_ALL for versions that are all kept, or None for versions
+    older than every tier.
+    """
+    age = now - created_at
+    for index, (max_age, keep) in enumerate(tiers):
+        if max_age is None or age < max_age:
+            if keep == 'all':
+                return KEEP_ALL
+            return index, _period(created_at, keep)
+    return None
+
+
+def _delete_unreferenced(pending):
+    """Delete the dropped versions in `pending` that no other version still needs.
+
+    A dropped version stays while a version outside `pending` points at it
+    (directly, or through other dropped versions that a cascade would take
+    along), because that version's text is rebuilt through it. Returns how
+    many versions were deleted.
+    """
+    if not pending:
+        return 0
+    referenced = Version.objects.filter(
+        Q(previous_version__in=pending) | Q(base_version__in=pending)
+    ).exclude(version_id__in=pending).values_list('previous_version', 'base_version')
+    blocked = {ref for row in referenced for ref in row if ref in pending}
+    stack = list(blocked)
+    while stack:
+        for ref in pending[stack.pop()]:
+            if ref in pending and ref not in blocked:
+                blocked.add(ref)
+                stack.append(ref)
+
+    deletable = [version_id for version_id in pending if version_id not in blocked]
+    if not deletable:
+        return 0
+    deleted = deleted_count(Version.objects.filter(version_id__in=deletable).delete(), Version)
+    for version_id in deletable:
+        del pending[version_id]
+    return deleted
+
+
+def compact_page(page, tiers, now=None, chunk_size=500):
+    """Remove the versions of `page` that `tiers` does not keep.
+
+    Versions are walked oldest first, `chunk_size` at a time, each chunk in
+    its own transaction under the page row lock that merges also take. Every
+    surviving version is relinked to the previous survivor, re-encoded when
+    its delta pointed at a removed version, and keeps its exact text, so
+    comparisons between survivors are unchanged. The page's latest version
+    is always kept. Returns (kept, removed).
+    """
+    now = now or timezone.now()
+    versions = Version.objects.filter(page_id=page).select_related('blob').order_by('created_at', 'version_id')
+    # The last kept version and its text, which survivors are relinked to
+    previous, previous_text = None, None
+    # Dropped versions not deleted yet: version_id -> (previous_version_id, base_version_id)
+    pending = {}
+    cursor = None
+    kept = removed = 0
+
+    while True:
+        with transaction.atomic():
+            latest_id = (
+                Page.objects.select_for_update().filter(page_id=page.page_id)
+                .values_list('latest_version', flat=True).first()
+            )
+            rows = versions
+            if cursor is not None:
+                rows = rows.filter(
+                    Q(created_at__gt=cursor.created_at)
+                    | Q(created_at=cursor.created_at, version_id__gt=cursor.version_id)
+                )
+            chunk = list(rows[:chunk_size + 1])
+            following = chunk.pop() if len(chunk) > chunk_size else None
+
+            prefetch_content(chunk)
+            texts = [version_content(version) for version in chunk]
+            for index, version in enumerate(chunk):
+                text = texts[index]
+                bucket = retention_bucket(tiers, now, version.created_at)
+                later = chunk[index + 1] if index + 1 < len(chunk) else following
+                keep = version.version_id == latest_id or (
+                    bucket is not None and (
+                        bucket is KEEP_ALL or later is None
+                        or retention_bucket(tiers, now, later.created_at) != bucket
+                    )
+                )
+                if not keep:
+                    pending[version.version_id] = (version.previous_version_id, version.base_version_id)
+                    removed += 1
+                    continue
+
+                if _relink(version, text, previous, previous_text):
+                    version.save(update_fields=['previous_version', 'blob', 'delta', 'base_version', 'chain_depth'])
+                previous, previous_text = version, text
+                kept += 1
+
+            if chunk:
+                cursor = chunk[-1]
+            adjust_page(page.page_id, versions=-_delete_unreferenced(pending))
+        if following is None:
+            if removed:
+                invalidate_notebooks([page.notebook_id_id])
+            return kept, removed
+
+
+def _relink(version, text, previous, previous_text):
+    """Make a surviving version follow `previous`. Returns whether it changed."""
+    previous_id = previous.version_id if previous is not None else None
+    if version.delta is None:
+        if version.previous_version_id == previous_id:
+            return False
+        version.previous_version = previous
+        return True
+    if version.previous_version_id != previous_id:
+        # Its delta is against a removed version
+        encode_version(version, text, previous, previous_text)
+        return True
+
+    # Same parent, but the chain before it may have been re-encoded
+    base_id = previous.base_version_id or previous.version_id
+    depth = previous.chain_depth + 1
+    if (version.base_version_id, version.chain_depth) == (base_id, depth):
+        return False
+    if depth < snapshot_interval():
+        version.base_version_id, version.chain_depth = base_id, depth
+    else:
+        encode_version(version, text, None)
+        version.previous_version = previous
+    return True
+
+
+def compact_notebook(notebook, now=None, chunk_size=500):
+    """Apply the notebook's retention policy to all its pages. Returns (kept, removed)."""
+    if notebook.retention_policy is None:
+        return 0, 0
+    tiers = parse_policy(notebook.retention_policy)
+    now = now or timezone.now()
+    kept = removed = 0
+    for page in Page.objects.filter(notebook_id=notebook).order_by('page_id').iterator(chunk_size=100):
+        page_kept, page_removed = compact_page(page, tiers, now, chunk_size)
+        kept += page_kept
+        removed += page_removed
+    return kept, removed
@@ -0,0 +1,120 @@
+"""Read replica routing.
+
+ReplicaRoutingMiddleware picks a replica for each GET, HEAD or OPTIONS
+request and ReplicaRouter sends that request's reads to it. Everything
+else (writes, unsafe requests, management commands, the merge worker)
+uses 'default'. After a client sends an unsafe request, its reads stay on
+'default' for HIVEMIND_REPLICA_STICKY_SECONDS, so it sees its own writes
+(a voter sees their vote) even while the replicas lag. The client carries
+that state in a signed cookie, so it holds whichever process serves its
+next request.
+"""
+import contextvars
+import random
+from contextlib import contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+_read_alias = contextvars.ContextVar('hivemind_read_alias', default=None)
+_pinned = contextvars.ContextVar('hivemind_primary_pinned', default=False)
+
+
+def replica_aliases():
+    """HIVEMIND_READ_REPLICAS, or by default every database besides 'default'."""
+    aliases = getattr(settings, 'HIVEMIND_READ_REPLICAS', None)
+    if aliases is None:
+        aliases = [alias for alias in settings.DATABASES if alias != DEFAULT_DB_ALIAS]
+    return aliases
+
+
+def sticky_seconds():
+    return getattr(settings, 'HIVEMIND_REPLICA_STICKY_SECONDS', 5)
+
+
+STICKY_COOKIE = 'hivemind_primary'
+STICKY_SALT = 'notebooks.routing.sticky'
+
+
+def _is_sticky(request):
+    """Whether the client sent an unsafe request in the last sticky_seconds()."""
+    return request.get_signed_cookie(STICKY_COOKIE, default=None, salt=STICKY_SALT, max_age=sticky_seconds()) is not None
+
+
+def _pick_alias(request, replicas):
+    if replicas and request.method in SAFE_METHODS and not _pinned.get() and not _is_sticky(request):
+        return random.choice(replicas)
+    return None
+
+
+@contextmanager
+def primary_reads():
+    """Keep reads on 'default' inside the block, also for requests handled in it.
+
+    For batch operations, which must read the batch's own uncommitted writes.
+    """
+    pinned, alias = _pinned.set(True), _read_alias.set(None)
+    try:
+        yield
+    finally:
+        _read_alias.reset(alias)
+        _pinned.reset(pinned)
+
+
+def _stick(request, response, replicas):
+    if replicas and request.method not in SAFE_METHODS:
+        response.set_signed_cookie(
+            STICKY_COOKIE, '1', salt=STICKY_SALT, max_age=sticky_seconds(), httponly=True, samesite='Lax'
+        )
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        return _read_alias.get()
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas copy the primary's schema
+        return False if db in replica_aliases() else None
+
+
+class ReplicaRoutingMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        replicas = replica_aliases()
+        token = _read_alias.set(_pick_alias(request, replicas))
+        try:
+            response = self.get_response(request)
+        finally:
+            _read_alias.reset(token)
+        _stick(request, response, replicas)
+        return response
+
+    async def __acall__(self, request):
+        replicas = replica_aliases()
+        # Async ORM queries run in threads that see this context
+        token = _read_alias.set(_pick_alias(request, replicas))
+        try:
+            response = await self.get_response(request)
+        finally:
+            _read_alias.reset(token)
+        _stick(request, response, replicas)
+        return response
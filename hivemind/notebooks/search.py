@@ -0,0 +1,134 @@
+import re
+from collections import Counter
+
+from django.conf import settings
+from django.contrib.postgres.search import (
+    SearchQuery, SearchRank, SearchVector, SearchVectorCombinable, SearchVectorField,
+)
+from django.db import connection
+from django.db.models import Count, F, Func, Sum, TextField, Value
+
+from .models import SearchEntry, SearchTerm, Version
+
+WORD_RE = re.compile(r'\w+')
+# Weights match PostgreSQL's ts_rank defaults for A (title) and B (content)
+TITLE_WEIGHT = 1.0
+CONTENT_WEIGHT = 0.4
+
+
+def search_config():
+    return getattr(settings, 'HIVEMIND_SEARCH_CONFIG', 'english')
+
+
+def uses_postgres():
+    return connection.vendor == 'postgresql'
+
+
+def tokenize(text):
+    return [word for word in WORD_RE.findall(text.lower()) if len(word) <= 64]
+
+
+class ContentLexemes(SearchVectorCombinable, Func):
+    """The weight B (content) part of a stored document."""
+    function = 'ts_filter'
+    template = "%(function)s(%(expressions)s, '{b}')"
+    output_field = SearchVectorField()
+
+
+def _vector(text, weight):
+    return SearchVector(Value(text, output_field=TextField()), config=search_config(), weight=weight)
+
+
+def _terms(entry, text, field, weight):
+    return [
+        SearchTerm(entry_id=entry, term=term, field=field, score=count * weight)
+        for term, count in Counter(tokenize(text)).items()
+    ]
+
+
+def index_version(version, content, is_latest=True):
+    """Add `version` of its page to the search index."""
+    page = version.page_id
+    if is_latest:
+        SearchEntry.objects.filter(page_id=page, is_latest=True).update(is_latest=False)
+    entry = SearchEntry(notebook_id_id=page.notebook_id_id, page_id=page, version_id=version, is_latest=is_latest)
+    if uses_postgres():
+        entry.document = _vector(page.title, 'A') + _vector(content, 'B')
+        entry.save()
+        return entry
+    entry.save()
+    SearchTerm.objects.bulk_create(
+        _terms(entry, page.title, SearchTerm.TITLE, TITLE_WEIGHT)
+        + _terms(entry, content, SearchTerm.CONTENT, CONTENT_WEIGHT)
+    )
+    return entry
+
+
+def rebuild_page_index(page):
+    """Replace the page's search entries with one per version."""
+    from .versioning import prefetch_content
+
+    SearchEntry.objects.filter(page_id=page).delete()
+    versions = list(Version.objects.filter(page_id=page).select_related('blob').order_by('created_at', 'version_id'))
+    prefetch_content(versions)
+    for version in versions:
+        version.page_id = page
+        index_version(version, version.get_content(), is_latest=version.version_id == page.latest_version_id)
+    return len(versions)
+
+
+def reindex_title(page):
+    """Refresh the title words of the page's latest entry; older ones keep their title."""
+    entries = SearchEntry.objects.filter(page_id=page, is_latest=True)
+    if uses_postgres():
+        entries.update(document=_vector(page.title, 'A') + ContentLexemes(F('document')))
+        return
+    for entry in entries:
+        entry.terms.filter(field=SearchTerm.TITLE).delete()
+        SearchTerm.objects.bulk_create(_terms(entry, page.title, SearchTerm.TITLE, TITLE_WEIGHT))
+
+
+def search_entries(notebook_id, query, history=False):
+    """Entries of a notebook matching `query`, best first, annotated with `rank`.
+
+    Only the current version of each page is searched unless `history`.
+    """
+    entries = SearchEntry.objects.filter(notebook_id=notebook_id)
+    if not history:
+        entries = entries.filter(is_latest=True)
+
+    if uses_postgres():
+        search_query = SearchQuery(query, config=search_config(), search_type='websearch')
+        entries = entries.filter(document=search_query).annotate(rank=SearchRank(F('document'), search_query))
+    else:
+        # Every word must match, like plainto_tsquery, without stemming
+        terms = set(tokenize(query))
+        if not terms:
+            return entries.none()
+        entries = (
+            entries.filter(terms__term__in=terms)
+            .annotate(matched=Count('terms__term', distinct=True), rank=Sum('terms__score'))
+            .filter(matched=len(terms))
+        )
+    return entries.order_by('-rank', '-created_at', '-entry_id')
+
+
+def snippet(text, query, width=160):
+    """A window of `text` around the first match of `query`.
+
+    Returns {"text", "matches"}, where matches are [start, end] offsets of
+    words starting with a query word, relative to the snippet.
+    """
+    terms = sorted(set(tokenize(query)), key=len, reverse=True)
+    pattern = re.compile(r'\b(?:%s)\w*' % '|'.join(map(re.escape, terms)), re.IGNORECASE) if terms else None
+    first = pattern.search(text) if pattern else None
+
+    start = max(0, first.start() - width // 4) if first else 0
+    if start:
+        # Begin on a word boundary
+        space = text.find(' ', start)
+        if 0 <= space < (first.start() if first else start + width):
+            start = space + 1
+    window = text[start:start + width]
+    matches = [[m.start(), m.end()] for m in pattern.finditer(window)] if pattern else []
+    return {'text': window, 'matches': matches}
@@ -1,56 +1,243 @@
-from rest_framework import serializers
-from .models import User, Notebook, Page, Version, Draft, Post, Vote
+from rest_framework import serializers, permissions
+from django.db import models
+from .metrics import TimedSerializerMixin
+from .models import User, Notebook, Page, Version, Draft, Post, Vote, SearchEntry
+from .retention import PolicyError, parse_policy
+from .search import snippet
+from .versioning import prefetch_content
 
-class UserSerializer(serializers.ModelSerializer):
+def split_paths(paths):
+    """Group dotted paths by their first segment: ['a.b', 'a', 'c'] -> {'a': ['b'], 'c': []}."""
+    tree = {}
+    for path in paths:
+        head, _, rest = path.partition('.')
+        children = tree.setdefault(head, [])
+        if rest:
+            children.append(rest)
+    return tree
+
+def query_param_list(request, name):
+    if request is None:
+        return []
+    value = request.query_params.get(name, '')
+    return [part.strip() for part in value.split(',') if part.strip()]
+
+class ExpandableFieldsMixin(TimedSerializerMixin):
+    """Sparse fieldsets and relation expansion driven by ?fields= and ?expand=.
+
+    Relations listed in Meta.expandable_fields render as ids unless expanded,
+    and Meta.deferred_fields (content bodies) are left out of read responses
+    unless named in fields or expand. Dotted paths reach nested serializers,
+    e.g. ?expand=page_id.latest_version.content
+    """
+    def __init__(self, *args, fields=None, expand=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Nested serializers get their paths from the parent, the root reads the request
+        self._fields_paths = fields
+        self._expand_paths = expand
+
+    def requested_paths(self):
+        request = self.context.get('request')
+        fields = self._fields_paths
+        expand = self._expand_paths
+        if fields is None:
+            fields = query_param_list(request, 'fields')
+        if expand is None:
+            expand = query_param_list(request, 'expand')
+        return split_paths(fields), split_paths(expand)
+
+    def get_fields(self):
+        fields = super().get_fields()
+        only, expand = self.requested_paths()
+
+        for name, (serializer_class, options) in getattr(self.Meta, 'expandable_fields', {}).items():
+            if name in expand:
+                fields[name] = serializer_class(read_only=True, fields=only.get(name, []), expand=expand[name], **options)
+            else:
+                fields[name] = serializers.PrimaryKeyRelatedField(read_only=True, **options)
+
+        request = self.context.get('request')
+        if request is None or request.method in permissions.SAFE_METHODS:
+            for name in getattr(self.Meta, 'deferred_fields', {}):
+                if name not in only and name not in expand:
+                    fields.pop(name, None)
+
+        if only:
+            fields = {name: field for name, field in fields.items() if name in only}
+        return fields
+
+    def query_plan(self, prefix=''):
+        """Return (select_related, prefetch_related, defer) lookups matching this output."""
+        select, prefetch, defer = [], [], []
+        opts = self.Meta.model._meta
+        for name, columns in getattr(self.Meta, 'deferred_fields', {}).items():
+            if name not in self.fields:
+                defer.extend(prefix + column for column in columns)
+            else:
+                # Bodies kept in related rows (blobs) are joined when shown
+                select.extend(prefix + column for column in columns if opts.get_field(column).is_relation)
+
+        for name, (serializer_class, options) in getattr(self.Meta, 'expandable_fields', {}).items():
+            if name not in self.fields:
+                continue
+            path = prefix + name
+            field = self.fields[name]
+            if options.get('many'):
+                prefetch.append(path)
+            elif isinstance(field, ExpandableFieldsMixin):
+                select.append(path)
+                nested = field.query_plan(path + '__')
+                select += nested[0]
+                prefetch += nested[1]
+                defer += nested[2]
+        return select, prefetch, defer
+
+    def validator_lookups(self, prefix=''):
+        """Columns that change whenever this output does, content bodies aside.
+
+        Built from Meta.validator_fields of this serializer and every nested
+        one it expands, so ETags can be computed with a values() query.
+        """
+        lookups = [prefix + name for name in getattr(self.Meta, 'validator_fields', [])]
+        for name, (serializer_class, options) in getattr(self.Meta, 'expandable_fields', {}).items():
+            field = self.fields.get(name)
+            if isinstance(field, ExpandableFieldsMixin) and not options.get('many'):
+                lookups += field.validator_lookups(prefix + name + '__')
+        return lookups
+
+class PrefetchContentListSerializer(serializers.ListSerializer):
+    """Rebuilds delta-encoded version content for the whole list in one go.
+
+    The child serializer says which version each item shows via `version_for`.
+    """
+    def to_representation(self, data):
+        items = list(data.all() if isinstance(data, models.manager.BaseManager) else data)
+        prefetch_content([self.child.version_for(item) for item in items])
+        return super().to_representation(items)
+
+class UserSerializer(ExpandableFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = User
         fields = ['id', 'username', 'email']
+        validator_fields = ['id', 'username', 'email']
 
-class NotebookSerializer(serializers.ModelSerializer):
-    admin_id = UserSerializer(read_only=True)
-    user_ids = UserSerializer(many=True, read_only=True)
-
+class NotebookSerializer(ExpandableFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Notebook
-        fields = ['notebook_id', 'admin_id', 'title', 'user_ids', 'merge_threshold', 'created_at', 'updated_at']
-    
-class VersionSerializer(serializers.ModelSerializer):
-    user_id = UserSerializer(read_only=True)
-    content = serializers.CharField(required=False, allow_blank=True)
+        fields = ['notebook_id', 'admin_id', 'title', 'user_ids', 'merge_threshold', 'retention_policy', 'member_count', 'page_count', 'created_at', 'updated_at']
+        read_only_fields = ['member_count', 'page_count']
+        expandable_fields = {
+            'admin_id': (UserSerializer, {}),
+            'user_ids': (UserSerializer, {'many': True}),
+        }
+        # Membership changes go through NotebookDetailView, which saves the row
+        validator_fields = ['notebook_id', 'updated_at', 'member_count', 'page_count']
+
+    def validate_retention_policy(self, value):
+        if value is not None:
+            try:
+                parse_policy(value)
+            except PolicyError as exc:
+                raise serializers.ValidationError(str(exc))
+        return value
+
+class VersionSerializer(ExpandableFieldsMixin, serializers.ModelSerializer):
+    # Rebuilt from the delta chain when the version is delta-encoded
+    content = serializers.CharField(source='get_content', read_only=True)
 
     class Meta:
         model = Version
         fields = ['version_id', 'user_id', 'page_id', 'previous_version', 'content', 'created_at']
+        list_serializer_class = PrefetchContentListSerializer
+        expandable_fields = {
+            'user_id': (UserSerializer, {}),
+        }
+        deferred_fields = {'content': ['blob', 'delta']}
+        # Content never changes; compaction may relink previous_version
+        validator_fields = ['version_id', 'previous_version']
 
-class PageSerializer(serializers.ModelSerializer):
-    notebook_id = NotebookSerializer(read_only=True)
-    latest_version = VersionSerializer(read_only=True)
+    def version_for(self, obj):
+        return obj if 'content' in self.fields else None
 
+class PageSerializer(ExpandableFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Page
-        fields = ['page_id', 'notebook_id', 'title', 'latest_version', 'created_at', 'updated_at']
+        fields = ['page_id', 'notebook_id', 'title', 'latest_version', 'post_count', 'version_count', 'created_at', 'updated_at']
+        read_only_fields = ['post_count', 'version_count']
+        list_serializer_class = PrefetchContentListSerializer
+        expandable_fields = {
+            'notebook_id': (NotebookSerializer, {}),
+            'latest_version': (VersionSerializer, {}),
+        }
+        validator_fields = ['page_id', 'updated_at', 'latest_version', 'post_count', 'version_count']
 
-class DraftSerializer(serializers.ModelSerializer):
-    user_id = UserSerializer(read_only=True)
-    page_id = PageSerializer(read_only=True)
+    def version_for(self, obj):
+        field = self.fields.get('latest_version')
+        if isinstance(field, VersionSerializer) and obj.latest_version:
+            return field.version_for(obj.latest_version)
+        return None
+
+class DraftSerializer(ExpandableFieldsMixin, serializers.ModelSerializer):
     content = serializers.CharField(required=False, allow_blank=True)
 
     class Meta:
         model = Draft
         fields = ['draft_id', 'user_id', 'page_id', 'content', 'created_at', 'updated_at']
+        list_serializer_class = PrefetchContentListSerializer
+        expandable_fields = {
+            'user_id': (UserSerializer, {}),
+            'page_id': (PageSerializer, {}),
+        }
+        deferred_fields = {'content': ['blob']}
+
+    def version_for(self, obj):
+        field = self.fields.get('page_id')
+        if isinstance(field, PageSerializer) and obj.page_id:
+            return field.version_for(obj.page_id)
+        return None
 
-class PostSerializer(serializers.ModelSerializer):
-    user_id = UserSerializer(read_only=True)
-    page_id = PageSerializer(read_only=True)
+class PostSerializer(ExpandableFieldsMixin, serializers.ModelSerializer):
     voted = serializers.SerializerMethodField()
     content = serializers.CharField(required=False, allow_blank=True)
 
     class Meta:
         model = Post
         fields = ['post_id', 'user_id', 'page_id', 'draft_id', 'content', 'votes', 'created_at', 'updated_at', 'voted']
-    
+        list_serializer_class = PrefetchContentListSerializer
+        expandable_fields = {
+            'user_id': (UserSerializer, {}),
+            'page_id': (PageSerializer, {}),
+        }
+        deferred_fields = {'content': ['blob']}
+
+    def version_for(self, obj):
+        field = self.fields.get('page_id')
+        if isinstance(field, PageSerializer) and obj.page_id:
+            return field.version_for(obj.page_id)
+        return None
+
     def get_voted(self, obj):
+        # List querysets annotate `voted` with an EXISTS subquery
+        if hasattr(obj, 'voted'):
+            return obj.voted
         user = self.context['request'].user
         if not user or user.is_anonymous:
             return False
-        return Vote.objects.filter(post_id=obj, user_id=user).exists()
\ No newline at end of file
+        return Vote.objects.filter(post_id=obj, user_id=user).exists()
+
+class SearchResultSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    title = serializers.CharField(source='page_id.title', read_only=True)
+    rank = serializers.FloatField(read_only=True)
+    snippet = serializers.SerializerMethodField()
+
+    class Meta:
+        model = SearchEntry
+        fields = ['page_id', 'version_id', 'title', 'is_latest', 'rank', 'created_at', 'snippet']
+        list_serializer_class = PrefetchContentListSerializer
+
+    def version_for(self, obj):
+        return obj.version_id
+
+    def get_snippet(self, obj):
+        return snippet(obj.version_id.get_content(), self.context.get('query', ''))
+
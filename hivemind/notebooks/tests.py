@@ -1,3 +1,1586 @@
-from django.test import TestCase
+import asyncio
+import base64
+import json
+import random
+import threading
+import time
+import unittest
+from unittest import mock
+from datetime import timedelta
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, sync_to_async
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, connection, connections, models, transaction
+from django.http import HttpResponse
+from django.test import AsyncClient, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.client import AsyncRequestFactory, RequestFactory
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve, reverse
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APITestCase
+
+from .authentication import LOCAL, SHARED, cache_mode, resolve_token
+from .blobs import collect_blobs
+from .counters import repair_counters
+from .diff import diff_stats, diff_texts
+from .benchmark import generate_dataset, run_async_benchmark, run_auth_benchmark, run_benchmark, run_compression_benchmark
+from .events import DatabaseBroker, InProcessBroker, get_broker, stream_ticket
+from .fields import PLAIN
+from .membership import ADMIN, MEMBER, notebook_roles
+from . import metrics
+from .metrics import RequestTimings, render_metrics, reset_metrics
+from . import merges
+from .merges import enqueue_merge, run_pending
+from .models import User, Notebook, Page, Version, Draft, Post, Vote, MergeJob, Blob, StreamEvent
+from .patches import content_hash
+from .retention import compact_notebook
+from .routing import ReplicaRouter, ReplicaRoutingMiddleware, _read_alias
+from .transfer import TransferError, import_lines
+from .versioning import LRUCache, apply_delta, content_cache, create_version, make_delta
+from .views import AsyncPageListCreateView, AsyncPostListCreateView, AsyncVersionCompareView, AsyncVersionListView, AsyncVersionSingleView
+from .voting import toggle_vote
+from .workspace import cached_snapshot, snapshot_key
+
+
+NOTEBOOK_EXPAND = 'admin_id,user_ids'
+PAGE_EXPAND = 'notebook_id.admin_id,notebook_id.user_ids,latest_version.user_id,latest_version.content'
+
+
+def nested(prefix, expand):
+    return ','.join(f'{prefix}.{path}' for path in expand.split(','))
+
+
+class ListQueryCountTests(APITestCase):
+    """List endpoints must run the same number of queries for 1 row or 20."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='owner', password='pw')
+        self.other = User.objects.create_user(username='other', password='pw')
+        self.client.force_authenticate(self.user)
+        self.notebook = self.make_notebook()
+        self.page = self.make_page(self.notebook)
+
+    def make_notebook(self):
+        notebook = Notebook.objects.create(title='Notebook', admin_id=self.user)
+        notebook.user_ids.add(self.other)
+        return notebook
+
+    def make_page(self, notebook, versions=3):
+        page = Page.objects.create(title='Page', notebook_id=notebook)
+        version = None
+        for i in range(versions):
+            version = create_version(page, self.user, version, f'line {i}\n' * (i + 1))
+        page.latest_version = version
+        page.save()
+        return page
+
+    def make_post(self, page, voters):
+        draft = Draft.objects.create(user_id=self.other, page_id=page, content='draft')
+        post = Post.objects.create(user_id=self.other, page_id=page, draft_id=draft, content='draft')
+        for voter in voters:
+            Vote.objects.create(post_id=post, user_id=voter)
+        return post
+
+    def count_queries(self, url):
+        content_cache.clear()
+        cache.clear()
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(ctx.captured_queries)
+
+    def assertConstantQueries(self, url, grow, expand='', times=20):
+        """Check both the lean default shape and a fully expanded one."""
+        urls = [url, f'{url}?expand={expand}'] if expand else [url]
+        grow()
+        before = [self.count_queries(u) for u in urls]
+        for _ in range(times):
+            grow()
+        self.assertEqual([self.count_queries(u) for u in urls], before)
+
+    def test_notebook_list(self):
+        self.assertConstantQueries(reverse('notebook-list-create'), self.make_notebook, NOTEBOOK_EXPAND)
+
+    def test_page_list(self):
+        url = reverse('page-list-create', args=[self.notebook.notebook_id])
+        self.assertConstantQueries(url, lambda: self.make_page(self.notebook), PAGE_EXPAND)
+
+    def test_version_list(self):
+        url = reverse('version-list', args=[self.notebook.notebook_id, self.page.page_id])
+        state = {'version': self.page.latest_version}
+
+        def grow():
+            state['version'] = create_version(self.page, self.user, state['version'], 'more\n')
+
+        self.assertConstantQueries(url, grow, 'user_id,content')
+
+    def test_draft_list(self):
+        url = reverse('draft-list-create', args=[self.notebook.notebook_id])
+
+        def grow():
+            Draft.objects.create(user_id=self.user, page_id=self.make_page(self.notebook), content='x')
+
+        self.assertConstantQueries(url, grow, f'user_id,content,{nested("page_id", PAGE_EXPAND)}')
+
+    def test_post_list(self):
+        url = reverse('post-list-create', args=[self.notebook.notebook_id, self.page.page_id])
+        expand = f'user_id,content,{nested("page_id", PAGE_EXPAND)}'
+        self.assertConstantQueries(url, lambda: self.make_post(self.page, [self.user, self.other]), expand)
+
+    def test_post_list_voted_flag(self):
+        voted = self.make_post(self.page, [self.user])
+        self.make_post(self.page, [self.other])
+        url = reverse('post-list-create', args=[self.notebook.notebook_id, self.page.page_id])
+        response = self.client.get(url)
+        flags = {item['post_id']: item['voted'] for item in response.data['results']}
+        self.assertEqual(list(flags.values()).count(True), 1)
+        self.assertTrue(flags[str(voted.post_id)])
+
+    def test_post_list_pages_through_ties(self):
+        posts = [self.make_post(self.page, []) for _ in range(7)]
+        Post.objects.filter(pk__in=[p.pk for p in posts[:4]]).update(votes=2)
+        url = reverse('post-list-create', args=[self.notebook.notebook_id, self.page.page_id])
+
+        seen = []
+        next_url = f'{url}?page_size=3'
+        while next_url:
+            response = self.client.get(next_url)
+            self.assertLessEqual(len(response.data['results']), 3)
+            seen += [(item['votes'], item['post_id']) for item in response.data['results']]
+            next_url = response.data['next']
+
+        self.assertEqual(len(seen), 7)
+        self.assertEqual({post_id for _, post_id in seen}, {str(p.post_id) for p in posts})
+        self.assertEqual([votes for votes, _ in seen], [2] * 4 + [0] * 3)
+
+    def test_tampered_cursor_is_not_found(self):
+        self.make_post(self.page, [])
+        url = reverse('post-list-create', args=[self.notebook.notebook_id, self.page.page_id])
+        cursors = [["abc", "x", "y"], [1, None, "y"], [{}, [], 1], [1, 2], 'junk']
+        for position in cursors:
+            cursor = base64.urlsafe_b64encode(json.dumps(position).encode()).decode()
+            response = self.client.get(url, {'cursor': cursor})
+            self.assertEqual(response.status_code, 404, position)
+            self.assertEqual(response.json()['detail'], 'Invalid cursor')
+        self.assertEqual(self.client.get(url, {'cursor': '%%%'}).status_code, 404)
+
+
+class SparseFieldsTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='owner', password='pw')
+        self.client.force_authenticate(self.user)
+        self.notebook = Notebook.objects.create(title='Notebook', admin_id=self.user)
+        self.page = Page.objects.create(title='Page', notebook_id=self.notebook)
+        self.page.latest_version = create_version(self.page, self.user, None, 'body')
+        self.page.save()
+        self.url = reverse('page-list-create', args=[self.notebook.notebook_id])
+
+    def test_lean_defaults(self):
+        item = self.client.get(self.url).data[0]
+        self.assertEqual(item['notebook_id'], self.notebook.notebook_id)
+        self.assertEqual(item['latest_version'], self.page.latest_version.version_id)
+
+    def test_fields_and_expand(self):
+        item = self.client.get(self.url, {'fields': 'title,latest_version', 'expand': 'latest_version.content'}).data[0]
+        self.assertEqual(set(item), {'title', 'latest_version'})
+        self.assertEqual(item['latest_version']['content'], 'body')
+
+    def test_unrequested_content_is_deferred(self):
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.get(self.url, {'expand': 'latest_version'})
+        select = next(q['sql'] for q in ctx.captured_queries if 'FROM "notebooks_page"' in q['sql'])
+        self.assertIn('"notebooks_version"', select)
+        self.assertNotIn('"notebooks_blob"', select)
+        self.assertNotIn('"notebooks_version"."delta"', select)
+
+    def test_expanded_content_is_selected(self):
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.get(self.url, {'expand': 'latest_version.content'})
+        select = next(q['sql'] for q in ctx.captured_queries if 'FROM "notebooks_page"' in q['sql'])
+        self.assertIn('"notebooks_blob"', select)
+        self.assertIn('"notebooks_version"."delta"', select)
+
+
+class RecordingBroker(InProcessBroker):
+    def __init__(self):
+        super().__init__()
+        self.published = []
+
+    def publish(self, channels, event):
+        self.published.append((channels, event))
+        super().publish(channels, event)
+
+
+def streamed_body(response):
+    """The whole body of a StreamingHttpResponse, whether its iterator is sync or async."""
+    if not response.is_async:
+        return b''.join(response.streaming_content)
+
+    async def read():
+        return b''.join([chunk async for chunk in response.streaming_content])
+    return async_to_sync(read)()
+
+
+class DiffTests(SimpleTestCase):
+    def assertRoundTrips(self, old, new, granularity):
+        ops = diff_texts(old, new, granularity)
+        self.assertEqual(''.join(text for tag, text in ops if tag != '-'), new)
+        self.assertEqual(''.join(text for tag, text in ops if tag != '+'), old)
+        return ops
+
+    def test_line_and_word_scripts(self):
+        self.assertEqual(
+            self.assertRoundTrips('one\ntwo\nthree\n', 'one\n2\nthree\nfour\n', 'line'),
+            [['=', 'one\n'], ['-', 'two\n'], ['+', '2\n'], ['=', 'three\n'], ['+', 'four\n']],
+        )
+        self.assertEqual(
+            self.assertRoundTrips('the quick fox\n', 'the slow fox\n', 'word'),
+            [['=', 'the '], ['-', 'quick'], ['+', 'slow'], ['=', ' fox\n']],
+        )
+        self.assertEqual(diff_texts('same\n', 'same\n'), [['=', 'same\n']])
+
+    def test_large_rewrites_stay_cheap(self):
+        old = ''.join(f'keep {i}\n' if i % 2 else f'old {i}\n' for i in range(20000))
+        new = ''.join(f'keep {i}\n' if i % 2 else f'new {i}\n' for i in range(20000))
+        started = time.perf_counter()
+        ops = self.assertRoundTrips(old, new, 'line')
+        # Past the Myers budget lines unique to both texts still match
+        kept = ''.join(text for tag, text in ops if tag == '=')
+        self.assertEqual(kept, ''.join(f'keep {i}\n' for i in range(1, 20000, 2)))
+        self.assertRoundTrips(old, new, 'word')
+        self.assertRoundTrips('x\n' * 5000 + 'y\n' * 5000, 'y\n' * 5000 + 'x\n' * 5000, 'word')
+        self.assertLess(time.perf_counter() - started, 10)
+
+
+class VersionCompareTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='owner', password='pw')
+        self.client.force_authenticate(self.user)
+        notebook = Notebook.objects.create(title='Notebook', admin_id=self.user)
+        self.page = Page.objects.create(title='Page', notebook_id=notebook)
+        self.old = ''.join(f'line {i}\n' for i in range(3000))
+        self.new = ''.join(f'line {i}\n' if i % 3 else f'changed {i}\n' for i in range(3000))
+        self.first = create_version(self.page, self.user, None, self.old)
+        self.page.latest_version = create_version(self.page, self.user, self.first, self.new)
+        self.page.save()
+        self.url = reverse('version-compare', args=[notebook.notebook_id, self.page.page_id])
+        self.params = {'version1': str(self.first.version_id), 'diff': 'line'}
+        self.key = f'hivemind:diff:{self.first.version_id}:{self.page.latest_version_id}:line'
+        cache.clear()
+
+    def test_diff_is_cached(self):
+        response = self.client.get(self.url, self.params)
+        self.assertEqual(response.status_code, 200)
+        ops = diff_texts(self.old, self.new)
+        self.assertEqual(response.data['ops'], ops)
+        self.assertEqual(response.data['stats'], diff_stats(ops))
+        self.assertEqual(cache.get(self.key), ops)
+
+    @override_settings(HIVEMIND_DIFF_CACHE_MAX_CHARS=100)
+    def test_large_diffs_are_not_cached(self):
+        self.assertEqual(self.client.get(self.url, self.params).status_code, 200)
+        self.assertIsNone(cache.get(self.key))
+
+    def test_stream(self):
+        expected = self.client.get(self.url, self.params).data
+        response = self.client.get(self.url, {**self.params, 'stream': '1'})
+        self.assertTrue(response.streaming)
+        lines = [json.loads(line) for line in streamed_body(response).decode().splitlines()]
+        self.assertEqual(lines[0]['granularity'], 'line')
+        self.assertGreater(len(lines), 3)
+        self.assertEqual([op for line in lines[1:-1] for op in line['ops']], expected['ops'])
+        self.assertEqual(lines[-1], {'stats': expected['stats']})
+
+
+class InProcessBrokerTests(SimpleTestCase):
+    async def test_publish_from_another_thread(self):
+        broker = InProcessBroker()
+        subscription = broker.subscribe('page:1')
+        thread = threading.Thread(target=broker.publish, args=(['page:1'], {'type': 'vote'}))
+        thread.start()
+        thread.join()
+        self.assertEqual(await subscription.get(timeout=1), {'type': 'vote'})
+        subscription.close()
+        self.assertEqual(broker._subscribers, {})
+
+    async def test_slow_listener_drops_oldest(self):
+        broker = InProcessBroker(queue_size=2)
+        subscription = broker.subscribe('page:1')
+        for i in range(3):
+            broker.publish(['page:1'], {'n': i})
+        await asyncio.sleep(0)
+        self.assertEqual([(await subscription.get(timeout=1))['n'] for _ in range(2)], [1, 2])
+        self.assertIsNone(await subscription.get(timeout=0.01))
+
+
+@override_settings(HIVEMIND_EVENT_BROKER='notebooks.tests.RecordingBroker')
+class EventPublishingTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='owner', password='pw')
+        self.client.force_authenticate(self.user)
+        self.notebook = Notebook.objects.create(title='Notebook', admin_id=self.user, merge_threshold=2)
+        self.page = Page.objects.create(title='Page', notebook_id=self.notebook)
+        self.draft = Draft.objects.create(user_id=self.user, page_id=self.page, content='text')
+        self.post = Post.objects.create(user_id=self.user, page_id=self.page, draft_id=self.draft)
+
+    def test_vote_is_broadcast_after_commit(self):
+        url = reverse('vote-post', args=[self.notebook.notebook_id, self.page.page_id, self.post.post_id])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(url)
+        [(channels, event)] = get_broker().published
+        self.assertEqual(channels, [f'notebook:{self.notebook.notebook_id}', f'page:{self.page.page_id}'])
+        self.assertEqual(event['votes'], 1)
+
+
+@override_settings(HIVEMIND_EVENT_BROKER='notebooks.events.InProcessBroker')
+class EventStreamTests(TransactionTestCase):
+    async def test_stream_delivers_events(self):
+        user = await User.objects.acreate(username='owner')
+        token = await Token.objects.acreate(user=user)
+        notebook = await Notebook.objects.acreate(title='Notebook', admin_id=user)
+
+        ticket = await AsyncClient().post(
+            reverse('notebook-events-ticket', args=[notebook.notebook_id]), headers={'Authorization': f'Token {token.key}'}
+        )
+        self.assertEqual(ticket.status_code, 200)
+        response = await AsyncClient().get(
+            reverse('notebook-events', args=[notebook.notebook_id]), {'ticket': ticket.json()['ticket']}
+        )
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        stream = aiter(response.streaming_content)
+        self.assertEqual(await anext(stream), b': connected\n\n')
+
+        get_broker().publish([f'notebook:{notebook.notebook_id}'], {'type': 'vote', 'votes': 3})
+        chunk = (await anext(stream)).decode()
+        self.assertTrue(chunk.startswith('event: vote\n'))
+        self.assertEqual(json.loads(chunk.split('data: ')[1])['votes'], 3)
+        await stream.aclose()
+
+    async def test_stream_requires_membership(self):
+        user = await User.objects.acreate(username='outsider')
+        token = await Token.objects.acreate(user=user)
+        notebook = await Notebook.objects.acreate(title='Notebook')
+        response = await AsyncClient().get(
+            reverse('notebook-events', args=[notebook.notebook_id]), headers={'Authorization': f'Token {token.key}'}
+        )
+        self.assertEqual(response.status_code, 404)
+        response = await AsyncClient().get(
+            reverse('notebook-events', args=[notebook.notebook_id]), {'ticket': stream_ticket(user.pk, notebook.notebook_id)}
+        )
+        self.assertEqual(response.status_code, 404)
+
+    async def test_page_must_belong_to_notebook(self):
+        user = await User.objects.acreate(username='owner')
+        token = await Token.objects.acreate(user=user)
+        notebook = await Notebook.objects.acreate(title='Notebook', admin_id=user)
+        other_page = await Page.objects.acreate(title='Page', notebook_id=await Notebook.objects.acreate(title='Other'))
+        url = reverse('page-events', args=[notebook.notebook_id, other_page.page_id])
+
+        response = await AsyncClient().get(url, headers={'Authorization': f'Token {token.key}'})
+        self.assertEqual(response.status_code, 404)
+        response = await AsyncClient().post(f'{url}ticket/', headers={'Authorization': f'Token {token.key}'})
+        self.assertEqual(response.status_code, 404)
+
+    async def test_rejects_url_tokens_and_foreign_tickets(self):
+        user = await User.objects.acreate(username='owner')
+        token = await Token.objects.acreate(user=user)
+        notebook = await Notebook.objects.acreate(title='Notebook', admin_id=user)
+        other = await Notebook.objects.acreate(title='Other', admin_id=user)
+        url = reverse('notebook-events', args=[notebook.notebook_id])
+
+        self.assertEqual((await AsyncClient().get(url, {'token': token.key})).status_code, 401)
+        self.assertEqual((await AsyncClient().get(url, {'ticket': stream_ticket(user.pk, other.notebook_id)})).status_code, 401)
+        self.assertEqual((await AsyncClient().get(url, {'ticket': 'forged'})).status_code, 401)
+        ticket = stream_ticket(user.pk, notebook.notebook_id)
+        with override_settings(HIVEMIND_STREAM_TICKET_SECONDS=-1):
+            self.assertEqual((await AsyncClient().get(url, {'ticket': ticket})).status_code, 401)
+
+
+class FastDatabaseBroker(DatabaseBroker):
+    poll_seconds = 0.05
+
+
+@override_settings(HIVEMIND_EVENT_BROKER='notebooks.tests.FastDatabaseBroker')
+class DatabaseBrokerTests(TransactionTestCase):
+    async def test_worker_merge_reaches_stream(self):
+        user = await User.objects.acreate(username='owner')
+        notebook = await Notebook.objects.acreate(title='Notebook', admin_id=user, merge_threshold=1)
+        page = await Page.objects.acreate(title='Page', notebook_id=notebook)
+        draft = await Draft.objects.acreate(user_id=user, page_id=page, content='merged text')
+        post = await Post.objects.acreate(user_id=user, page_id=page, draft_id=draft, votes=1)
+        await sync_to_async(enqueue_merge)(post.post_id, page.page_id)
+
+        response = await AsyncClient().get(
+            reverse('page-events', args=[notebook.notebook_id, page.page_id]),
+            {'ticket': stream_ticket(user.pk, notebook.notebook_id)},
+        )
+        stream = aiter(response.streaming_content)
+        self.assertEqual(await anext(stream), b': connected\n\n')
+
+        # The worker publishes from its own broker, as a separate process would
+        worker_broker = FastDatabaseBroker()
+        with mock.patch('notebooks.events._broker', worker_broker):
+            self.assertEqual(await sync_to_async(run_pending)(), 1)
+        chunk = (await asyncio.wait_for(anext(stream), 5)).decode()
+        self.assertTrue(chunk.startswith('event: merged\n'))
+        self.assertEqual(json.loads(chunk.split('data: ')[1])['post_id'], str(post.post_id))
+        await stream.aclose()
+
+    async def test_event_committed_late_is_delivered_once(self):
+        broker = FastDatabaseBroker()
+        subscription = broker.subscribe('notebook:1', 'page:1')
+        await sync_to_async(broker.publish)(['notebook:1', 'page:1'], {'n': 1})
+        self.assertEqual(await subscription.get(timeout=5), {'n': 1})
+
+        # A row with a lower id and no later timestamp that only became
+        # visible after the poller had moved past the first
+        first = await StreamEvent.objects.aget()
+        self.assertEqual(first.channels, ['notebook:1', 'page:1'])
+        late = await StreamEvent.objects.acreate(event_id=first.event_id - 1, channels=['page:1'], payload={'n': 0})
+        await StreamEvent.objects.filter(pk=late.pk).aupdate(created_at=first.created_at)
+        self.assertEqual(await subscription.get(timeout=5), {'n': 0})
+        self.assertIsNone(await subscription.get(timeout=0.3))
+        subscription.close()
+        broker.close()
+
+    @override_settings(HIVEMIND_EVENT_BROKER='notebooks.events.InProcessBroker')
+    def test_worker_refuses_in_process_broker(self):
+        with self.assertRaises(CommandError):
+            call_command('run_merge_worker', once=True)
+
+
+class VoteToggleTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='owner', password='pw')
+        self.client.force_authenticate(self.user)
+        self.notebook = Notebook.objects.create(title='Notebook', admin_id=self.user, merge_threshold=None)
+        self.page = Page.objects.create(title='Page', notebook_id=self.notebook)
+        self.post = Post.objects.create(user_id=self.user, page_id=self.page)
+        self.url = reverse('vote-post', args=[self.notebook.notebook_id, self.page.page_id, self.post.post_id])
+
+    def test_toggle(self):
+        self.assertEqual(self.client.patch(self.url).data, {'votes': 1, 'voted': True})
+        self.assertEqual(self.client.patch(self.url).data, {'votes': 0, 'voted': False})
+        self.assertFalse(Vote.objects.exists())
+
+    def test_missing_post(self):
+        self.post.delete()
+        self.assertEqual(self.client.patch(self.url).status_code, 404)
+        self.assertFalse(Vote.objects.exists())
+
+    def test_duplicate_vote_rejected(self):
+        Vote.objects.create(user_id=self.user, post_id=self.post)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Vote.objects.create(user_id=self.user, post_id=self.post)
+
+
+def legacy_toggle_vote(post_id, user):
+    """The read-modify-write toggle the vote view used before toggle_vote."""
+    with transaction.atomic():
+        post = Post.objects.get(post_id=post_id)
+        existing_vote = Vote.objects.filter(post_id=post, user_id=user).first()
+        if existing_vote:
+            post.votes = models.F('votes') - 1
+            existing_vote.delete()
+        else:
+            post.votes = models.F('votes') + 1
+            Vote.objects.create(post_id=post, user_id=user)
+        post.save()
+        post.refresh_from_db()
+        page = post.page_id
+        page.notebook_id.merge_threshold
+
+
+@unittest.skipUnless(connection.vendor == 'postgresql', 'concurrency stress test needs PostgreSQL')
+class VoteConcurrencyTests(TransactionTestCase):
+    threads = 8
+    toggles_per_user = 25
+
+    def setUp(self):
+        self.users = [User.objects.create(username=f'voter{i}') for i in range(self.threads)]
+        notebook = Notebook.objects.create(title='Notebook', merge_threshold=None)
+        page = Page.objects.create(title='Page', notebook_id=notebook)
+        self.post = Post.objects.create(page_id=page)
+
+    def hammer(self, toggle):
+        """Each user toggles from several threads at once; returns votes/sec."""
+        errors = []
+
+        def worker(user):
+            for _ in range(self.toggles_per_user):
+                try:
+                    toggle(self.post.post_id, user)
+                except IntegrityError as exc:
+                    # The legacy path hits the unique index on double clicks
+                    errors.append(exc)
+            connections.close_all()
+
+        workers = [threading.Thread(target=worker, args=(user,)) for user in self.users for _ in range(2)]
+        start = time.perf_counter()
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        return len(workers) * self.toggles_per_user / elapsed, errors
+
+    def test_counts_stay_consistent_under_contention(self):
+        rate, errors = self.hammer(toggle_vote)
+        self.assertEqual(errors, [])
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.votes, Vote.objects.filter(post_id=self.post).count())
+
+    def test_faster_than_read_modify_write(self):
+        legacy_rate, _ = self.hammer(legacy_toggle_vote)
+        Vote.objects.all().delete()
+        Post.objects.filter(pk=self.post.pk).update(votes=0)
+        rate, errors = self.hammer(toggle_vote)
+        self.assertEqual(errors, [])
+        self.assertGreater(rate, legacy_rate)
+
+
+class MergePipelineTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='owner', password='pw')
+        self.client.force_authenticate(self.user)
+        self.notebook = Notebook.objects.create(title='Notebook', admin_id=self.user, merge_threshold=1)
+        self.page = Page.objects.create(title='Page', notebook_id=self.notebook)
+        self.page.latest_version = create_version(self.page, self.user, None, '')
+        self.page.save()
+
+    def make_post(self, content):
+        draft = Draft.objects.create(user_id=self.user, page_id=self.page, content=content)
+        return Post.objects.create(user_id=self.user, page_id=self.page, draft_id=draft)
+
+    def vote(self, post):
+        url = reverse('vote-post', args=[self.notebook.notebook_id, self.page.page_id, post.post_id])
+        return self.client.patch(url)
+
+    def test_vote_queues_merge_without_applying_it(self):
+        post = self.make_post('merged text')
+        self.assertTrue(self.vote(post).data['merge_queued'])
+        self.assertTrue(Post.objects.filter(pk=post.pk).exists())
+        self.assertEqual(MergeJob.objects.get().status, MergeJob.PENDING)
+
+    def test_worker_applies_merge_once(self):
+        post = self.make_post('merged text')
+        self.vote(post)
+        enqueue_merge(post.post_id, self.page.page_id)
+        self.assertEqual(MergeJob.objects.count(), 1)
+
+        self.assertEqual(run_pending(), 1)
+        self.page.refresh_from_db()
+        self.assertEqual(self.page.latest_version.get_content(), 'merged text')
+        self.assertFalse(Post.objects.filter(pk=post.pk).exists())
+        self.assertEqual(MergeJob.objects.get().status, MergeJob.DONE)
+        self.assertEqual(run_pending(), 0)
+
+    def test_withdrawn_vote_is_skipped(self):
+        post = self.make_post('merged text')
+        self.vote(post)
+        self.vote(post)
+        run_pending()
+        self.assertEqual(MergeJob.objects.get().status, MergeJob.SKIPPED)
+        self.assertTrue(Post.objects.filter(pk=post.pk).exists())
+
+    def test_skipped_post_is_queued_again(self):
+        post = self.make_post('merged text')
+        self.vote(post)
+        self.vote(post)
+        run_pending()
+        self.assertTrue(self.vote(post).data['merge_queued'])
+        self.assertEqual(MergeJob.objects.get().status, MergeJob.PENDING)
+
+        self.assertEqual(run_pending(), 1)
+        self.assertEqual(MergeJob.objects.get().status, MergeJob.DONE)
+        self.page.refresh_from_db()
+        self.assertEqual(self.page.latest_version.get_content(), 'merged text')
+
+    def test_failed_job_is_queued_again(self):
+        post = self.make_post('merged text')
+        MergeJob.objects.create(post_id=post.post_id, page_id=self.page, status=MergeJob.FAILED, attempts=5, error='boom')
+        self.assertTrue(self.vote(post).data['merge_queued'])
+        job = MergeJob.objects.get()
+        self.assertEqual((job.status, job.attempts, job.error), (MergeJob.PENDING, 0, ''))
+
+    def test_failed_merge_is_retried_after_a_delay(self):
+        post = self.make_post('merged text')
+        self.vote(post)
+        real_apply = merges.apply_merge
+        calls = []
+
+        def flaky_apply(job):
+            calls.append(job.job_id)
+            if len(calls) == 1:
+                raise RuntimeError('lock timeout')
+            real_apply(job)
+
+        with mock.patch('notebooks.merges.apply_merge', flaky_apply):
+            self.assertEqual(run_pending(), 1)
+            job = MergeJob.objects.get()
+            self.assertEqual((job.status, job.attempts, job.error), (MergeJob.PENDING, 1, 'lock timeout'))
+            self.assertGreater(job.next_attempt_at, timezone.now())
+            # Not due yet
+            self.assertEqual(run_pending(), 0)
+
+            MergeJob.objects.update(next_attempt_at=timezone.now())
+            self.assertEqual(run_pending(), 1)
+        job = MergeJob.objects.get()
+        self.assertEqual((job.status, job.attempts), (MergeJob.DONE, 2))
+        self.assertEqual(len(calls), 2)
+        self.page.refresh_from_db()
+        self.assertEqual(self.page.latest_version.get_content(), 'merged text')
+
+    @override_settings(HIVEMIND_MERGE_RETRY_SECONDS=0)
+    def test_one_pass_tries_a_job_once(self):
+        post = self.make_post('merged text')
+        self.vote(post)
+        with mock.patch('notebooks.merges.apply_merge', side_effect=RuntimeError('deadlock')) as apply:
+            self.assertEqual(run_pending(), 1)
+        self.assertEqual(apply.call_count, 1)
+        self.assertEqual(MergeJob.objects.get().status, MergeJob.PENDING)
+
+    def test_merges_for_a_page_apply_in_order(self):
+        first, second = self.make_post('first'), self.make_post('second')
+        self.vote(first)
+        self.vote(second)
+        run_pending()
+        self.page.refresh_from_db()
+        latest = self.page.latest_version
+        self.assertEqual(latest.get_content(), 'second')
+        self.assertEqual(latest.previous_version.get_content(), 'first')
+
+
+class DraftPatchTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='owner', password='pw')
+        self.client.force_authenticate(self.user)
+        self.notebook = Notebook.objects.create(title='Notebook', admin_id=self.user)
+        self.page = Page.objects.create(title='Page', notebook_id=self.notebook)
+        self.draft = Draft.objects.create(user_id=self.user, page_id=self.page, content='caf\u00e9 \U0001f600 world')
+        self.url = reverse('draft-detail', args=[self.notebook.notebook_id, self.draft.draft_id])
+
+    def test_ops_apply_against_matching_base(self):
+        base = self.draft.content
+        response = self.client.patch(self.url, {'base_hash': content_hash(base), 'ops': [[0, 4, 'tea'], [7, 12, 'there']]}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.draft.refresh_from_db()
+        self.assertEqual(self.draft.content, 'tea \U0001f600 there')
+        self.assertEqual(response.data['content_hash'], content_hash(self.draft.content))
+
+    def test_stale_base_is_rejected(self):
+        response = self.client.patch(self.url, {'base_hash': content_hash('old'), 'ops': [[0, 0, 'x']]}, format='json')
+        self.assertEqual(response.status_code, 412)
+        self.assertEqual(response.data['content_hash'], content_hash(self.draft.content))
+        self.draft.refresh_from_db()
+        self.assertEqual(self.draft.content, 'caf\u00e9 \U0001f600 world')
+
+    def test_invalid_ops_are_rejected(self):
+        base_hash = content_hash(self.draft.content)
+        for ops in ([[5, 2, '']], [[0, 100, '']], [[4, 6, 'a'], [0, 1, 'b']], ['x']):
+            response = self.client.patch(self.url, {'base_hash': base_hash, 'ops': ops}, format='json')
+            self.assertEqual(response.status_code, 400)
+
+
+class ConditionalGetTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='owner', password='pw')
+        self.client.force_authenticate(self.user)
+        self.notebook = Notebook.objects.create(title='Notebook', admin_id=self.user)
+        self.page = Page.objects.create(title='Page', notebook_id=self.notebook)
+        self.version = create_version(self.page, self.user, None, 'body')
+        self.page.latest_version = self.version
+        self.page.save()
+
+    def revalidate(self, url, **params):
+        first = self.client.get(url, params)
+        self.assertEqual(first.status_code, 200)
+        return first, self.client.get(url, params, HTTP_IF_NONE_MATCH=first['ETag'])
+
+    def test_version_is_cacheable_and_revalidates_without_content(self):
+        url = reverse('version-single', args=[self.notebook.notebook_id, self.page.page_id, self.version.version_id])
+        first, _ = self.revalidate(url, expand='content')
+        self.assertIn('max-age', first['Cache-Control'])
+        with self.assertNumQueries(1):
+            second = self.client.get(url, {'expand': 'content'}, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(second.status_code, 304)
+        self.assertEqual(second['ETag'], first['ETag'])
+
+        other = self.client.get(url, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(other.status_code, 200)
+
+    def test_page_etag_changes_with_latest_version(self):
+        url = reverse('page-detail', args=[self.notebook.notebook_id, self.page.page_id])
+        first, second = self.revalidate(url)
+        self.assertEqual(second.status_code, 304)
+
+        self.page.latest_version = create_version(self.page, self.user, self.version, 'changed')
+        self.page.save()
+        third = self.client.get(url, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(third.status_code, 200)
+        self.assertNotEqual(third['ETag'], first['ETag'])
+
+    def test_version_list_etag_changes_when_a_version_is_added(self):
+        url = reverse('version-list', args=[self.notebook.notebook_id, self.page.page_id])
+        first, second = self.revalidate(url)
+        self.assertEqual(second.status_code, 304)
+
+        create_version(self.page, self.user, self.version, 'changed')
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=first['ETag']).status_code, 200)
+
+
+class SearchTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='owner', password='pw')
+        self.client.force_authenticate(self.user)
+        self.notebook = Notebook.objects.create(title='Notebook', admin_id=self.user)
+        self.url = reverse('notebook-search', args=[self.notebook.notebook_id])
+
+    def make_page(self, title, *contents):
+        page = Page.objects.create(title=title, notebook_id=self.notebook)
+        version = None
+        for content in contents:
+            version = create_version(page, self.user, version, content)
+        page.latest_version = version
+        page.save()
+        return page
+
+    def search(self, q, **params):
+        response = self.client.get(self.url, {'q': q, **params})
+        self.assertEqual(response.status_code, 200)
+        return response.data['results']
+
+    def test_ranks_title_matches_first_with_snippets(self):
+        body = self.make_page('Recipes', 'Slice the mango thinly and serve cold.')
+        title = self.make_page('Mango notes', 'Nothing else here.')
+        self.make_page('Other', 'Unrelated text.')
+
+        results = self.search('mango')
+        self.assertEqual([r['page_id'] for r in results], [title.page_id, body.page_id])
+        text = results[1]['snippet']['text']
+        start, end = results[1]['snippet']['matches'][0]
+        self.assertEqual(text[start:end].lower(), 'mango')
+
+    def test_history_includes_earlier_versions(self):
+        page = self.make_page('Page', 'the old walrus', 'the new penguin')
+        self.assertEqual(self.search('walrus'), [])
+        results = self.search('walrus', history='1')
+        self.assertEqual(len(results), 1)
+        self.assertFalse(results[0]['is_latest'])
+        self.assertEqual(results[0]['version_id'], page.latest_version.previous_version_id)
+
+    def test_renamed_page_is_found_by_new_title(self):
+        page = self.make_page('Draft', 'body text')
+        url = reverse('page-detail', args=[self.notebook.notebook_id, page.page_id])
+        self.client.patch(url, {'title': 'Quarterly planning'}, format='json')
+        self.assertEqual([r['page_id'] for r in self.search('quarterly')], [page.page_id])
+        self.assertEqual(len(self.search('body')), 1)
+
+    def test_pages_through_results(self):
+        for i in range(5):
+            self.make_page(f'Page {i}', 'shared keyword')
+        response = self.client.get(self.url, {'q': 'keyword', 'page_size': 2})
+        seen = []
+        while True:
+            seen += [r['page_id'] for r in response.data['results']]
+            if not response.data['next']:
+                break
+            response = self.client.get(response.data['next'])
+        self.assertEqual(len(seen), 5)
+        self.assertEqual(len(set(seen)), 5)
+
+    def test_requires_membership(self):
+        outsider = User.objects.create_user(username='outsider', password='pw')
+        self.client.force_authenticate(outsider)
+        self.assertEqual(self.client.get(self.url, {'q': 'x'}).status_code, 404)
+
+
+class MembershipTests(APITestCase):
+    def setUp(self):
+        self.admin = User.objects.create_user(username='admin', password='pw')
+        self.member = User.objects.create_user(username='member', password='pw')
+        self.notebook = Notebook.objects.create(title='Notebook', admin_id=self.admin)
+        self.page = Page.objects.create(title='Page', notebook_id=self.notebook)
+        self.pages_url = reverse('page-list-create', args=[self.notebook.notebook_id])
+
+    def test_roles_are_cached_until_membership_changes(self):
+        self.assertEqual(notebook_roles(self.admin), {self.notebook.notebook_id: ADMIN})
+        with self.assertNumQueries(0):
+            notebook_roles(self.admin)
+
+        self.assertEqual(notebook_roles(self.member), {})
+        self.notebook.user_ids.add(self.member)
+        self.assertEqual(notebook_roles(self.member), {self.notebook.notebook_id: MEMBER})
+        self.notebook.user_ids.remove(self.member)
+        self.assertEqual(notebook_roles(self.member), {})
+
+    def test_notebook_scoped_views_require_membership(self):
+        self.client.force_authenticate(self.member)
+        self.assertEqual(self.client.get(self.pages_url).status_code, 404)
+
+        self.client.force_authenticate(self.admin)
+        url = reverse('notebook-detail', args=[self.notebook.notebook_id])
+        self.client.patch(url, {'add_user_ids': [str(self.member.id)]}, format='json')
+
+        self.client.force_authenticate(self.member)
+        self.assertEqual(self.client.get(self.pages_url).status_code, 200)
+
+    def test_only_the_admin_changes_the_notebook(self):
+        self.notebook.user_ids.add(self.member)
+        url = reverse('notebook-detail', args=[self.notebook.notebook_id])
+        self.client.force_authenticate(self.member)
+        self.assertEqual(self.client.get(url).status_code, 200)
+        response = self.client.patch(url, {'remove_user_ids': [str(self.member.id)]}, format='json')
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(self.client.delete(url).status_code, 403)
+        self.assertTrue(self.notebook.user_ids.filter(pk=self.member.pk).exists())
+
+        self.client.force_authenticate(self.admin)
+        self.assertEqual(self.client.patch(url, {'title': 'Renamed'}, format='json').status_code, 200)
+
+    def test_pages_are_scoped_to_their_notebook(self):
+        other = Notebook.objects.create(title='Other', admin_id=self.member)
+        self.client.force_authenticate(self.member)
+        url = reverse('page-detail', args=[other.notebook_id, self.page.page_id])
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+
+def plan_nodes(plan):
+    yield plan
+    for child in plan.get('Plans', []):
+        yield from plan_nodes(child)
+
+
+@unittest.skipUnless(connection.vendor == 'postgresql', 'query plans are checked on PostgreSQL')
+class QueryPlanTests(APITestCase):
+    """Hot endpoint queries must be served from indexes at realistic volumes.
+
+    Every query an endpoint runs is captured and EXPLAINed. A sequential scan
+    fails the test, and so does a sort step unless the planner expects it to
+    sort only a handful of rows (such as one user's few notebooks).
+    """
+    users = 20000
+    notebooks = 5000
+    members_per_user = 2
+    max_sort_rows = 50
+    # One busy notebook whose page history, posts and drafts dominate the lists
+    hot_pages = 20
+    hot_versions = 400
+    hot_posts = 300
+    hot_drafts = 300
+
+    @classmethod
+    def setUpTestData(cls):
+        rng = random.Random(13)
+        users = User.objects.bulk_create([User(username=f'user{i}') for i in range(cls.users)])
+        notebooks = Notebook.objects.bulk_create([
+            Notebook(title=f'Notebook {i}', admin_id=users[i], merge_threshold=None) for i in range(cls.notebooks)
+        ])
+        Membership = Notebook.user_ids.through
+        Membership.objects.bulk_create([
+            Membership(notebook_id=notebook.pk, user_id=user.pk)
+            for user in users for notebook in rng.sample(notebooks, cls.members_per_user)
+        ], ignore_conflicts=True)
+
+        # Background: one small page per notebook
+        pages = Page.objects.bulk_create([Page(title='Page', notebook_id=notebook) for notebook in notebooks])
+        hot = Page.objects.bulk_create([Page(title=f'Hot {i}', notebook_id=notebooks[0]) for i in range(cls.hot_pages)])
+        Version.objects.bulk_create(
+            [Version(page_id=page, user_id=rng.choice(users), content='text') for page in pages for _ in range(2)]
+            + [Version(page_id=hot[0], user_id=rng.choice(users), content='text') for _ in range(cls.hot_versions)]
+        )
+        drafts = Draft.objects.bulk_create(
+            [Draft(page_id=page, user_id=rng.choice(users)) for page in pages]
+            + [Draft(page_id=rng.choice(hot), user_id=users[0]) for _ in range(cls.hot_drafts)]
+        )
+        posts = Post.objects.bulk_create(
+            [Post(page_id=draft.page_id, user_id=draft.user_id, draft_id=draft) for draft in drafts[:len(pages)]]
+            + [
+                Post(page_id=hot[0], user_id=rng.choice(users), draft_id=drafts[-1], votes=rng.randrange(20))
+                for _ in range(cls.hot_posts)
+            ]
+        )
+        Vote.objects.bulk_create([Vote(post_id=post, user_id=user) for post in posts for user in rng.sample(users, 3)])
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+        cls.user = users[0]
+        cls.notebook = notebooks[0]
+        Membership.objects.get_or_create(notebook_id=cls.notebook.pk, user_id=cls.user.pk)
+        cls.page = hot[0]
+        cls.post = Post.objects.filter(page_id=cls.page).first()
+
+    def setUp(self):
+        self.client.force_authenticate(self.user)
+
+    def assertIndexed(self, method, url):
+        cache.clear()
+        with CaptureQueriesContext(connection) as ctx:
+            response = getattr(self.client, method)(url)
+        self.assertLess(response.status_code, 300)
+
+        for query in ctx.captured_queries:
+            sql = query['sql']
+            if not sql.lstrip().upper().startswith(('SELECT', 'WITH', 'UPDATE', 'DELETE', 'INSERT')):
+                continue
+            with connection.cursor() as cursor:
+                cursor.execute('EXPLAIN (FORMAT JSON) ' + sql)
+                plan = cursor.fetchone()[0]
+            plan = (json.loads(plan) if isinstance(plan, str) else plan)[0]['Plan']
+            for node in plan_nodes(plan):
+                kind = node['Node Type']
+                if kind == 'Seq Scan' or (kind in ('Sort', 'Incremental Sort') and node['Plan Rows'] > self.max_sort_rows):
+                    with connection.cursor() as cursor:
+                        cursor.execute('EXPLAIN ' + sql)
+                        text = '\n'.join(row[0] for row in cursor.fetchall())
+                    self.fail(f"{kind} in:\n{sql}\n{text}")
+
+    def test_post_list(self):
+        self.assertIndexed('get', reverse('post-list-create', args=[self.notebook.notebook_id, self.page.page_id]))
+
+    def test_version_list(self):
+        self.assertIndexed('get', reverse('version-list', args=[self.notebook.notebook_id, self.page.page_id]))
+
+    def test_draft_list(self):
+        self.assertIndexed('get', reverse('draft-list-create', args=[self.notebook.notebook_id]))
+
+    def test_vote_toggle(self):
+        self.assertIndexed('patch', reverse('vote-post', args=[self.notebook.notebook_id, self.page.page_id, self.post.post_id]))
+
+    def test_notebook_list(self):
+        self.assertIndexed('get', reverse('notebook-list-create'))
+
+    def test_workspace(self):
+        self.assertIndexed('get', reverse('notebook-workspace', args=[self.notebook.notebook_id]))
+
+
+class BenchmarkTests(TestCase):
+    def test_benchmark_runs_every_endpoint_on_generated_data(self):
+        counts = generate_dataset(users=5, notebooks=1, members=3, pages=1, versions=5, posts=3, votes=3)
+        self.assertEqual(counts['versions'], 5)
+
+        # Raises if any request fails
+        results = run_benchmark(requests=3, warmup=0)
+        self.assertEqual(len(results['endpoints']), 12)
+        for name, row in results['endpoints'].items():
+            self.assertLessEqual(row['p50_ms'], row['p99_ms'])
+
+        compression = run_compression_benchmark(limit=10, min_bytes=64, repeat=2)
+        self.assertLess(compression['codecs']['zlib']['ratio'], compression['codecs']['none']['ratio'])
+
+        auth = run_auth_benchmark(requests=5)
+        self.assertEqual((auth['modes']['uncached']['queries_per_request'], auth['modes']['local']['queries_per_request']), (1, 0))
+
+
+class MetricsTests(APITestCase):
+    def setUp(self):
+        reset_metrics()
+        self.user = User.objects.create_user(username='owner', password='pw')
+        self.notebook = Notebook.objects.create(title='Notebook', admin_id=self.user)
+        token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+        self.url = reverse('page-list-create', args=[self.notebook.notebook_id])
+
+    def test_server_timing_and_histograms(self):
+        response = self.client.get(self.url)
+        timing = dict(part.split(';', 1) for part in response['Server-Timing'].split(', '))
+        self.assertEqual(set(timing), {'auth', 'db', 'app', 'serialize', 'render', 'total'})
+        self.assertRegex(timing['db'], r'desc="[1-9]\d* queries"')
+        self.assertRegex(timing['total'], r'desc="page-list-create"$')
+
+        self.user.is_staff = True
+        self.user.save()
+        text = self.client.get(reverse('metrics')).content.decode()
+        self.assertIn('hivemind_request_duration_seconds_count{method="GET",view="page-list-create"} 1', text)
+        self.assertIn('hivemind_request_queries_bucket{method="GET",view="page-list-create",le="+Inf"} 1', text)
+
+    def test_metrics_need_staff(self):
+        url = reverse('metrics')
+        self.assertEqual(self.client.get(url, REMOTE_ADDR='10.0.0.1').status_code, 403)
+        self.user.is_staff = True
+        self.user.save()
+        self.assertEqual(self.client.get(url, REMOTE_ADDR='10.0.0.1').status_code, 200)
+
+    @override_settings(HIVEMIND_METRICS_TOKEN='scrape-secret')
+    def test_metrics_accept_the_scrape_token(self):
+        url = reverse('metrics')
+        self.client.credentials()
+        self.assertEqual(self.client.get(url).status_code, 401)
+        self.assertEqual(self.client.get(url, HTTP_AUTHORIZATION='Bearer wrong').status_code, 401)
+        self.assertEqual(self.client.get(url, HTTP_AUTHORIZATION='Bearer scrape-secret').status_code, 200)
+
+    def test_internal_ips_are_opt_in(self):
+        url = reverse('metrics')
+        self.client.credentials()
+        self.assertEqual(self.client.get(url, REMOTE_ADDR='127.0.0.1').status_code, 401)
+        with self.settings(HIVEMIND_METRICS_ALLOW_INTERNAL_IPS=True):
+            self.assertEqual(self.client.get(url, REMOTE_ADDR='127.0.0.1').status_code, 200)
+
+    def test_serialization_is_timed_apart_from_its_queries(self):
+        timings = RequestTimings(keep_sql=False)
+        token = metrics._current.set(timings)
+        try:
+            with metrics.phase('serialize'):
+                # A nested serializer, and a query it runs
+                with metrics.phase('serialize'):
+                    time.sleep(0.05)
+                timings.phases['db'] += 0.03
+        finally:
+            metrics._current.reset(token)
+        self.assertGreaterEqual(timings.phases['serialize'], 0.02)
+        self.assertLess(timings.phases['serialize'], 0.045)
+
+    @override_settings(HIVEMIND_SLOW_REQUEST_MS=0)
+    def test_slow_requests_are_logged_with_their_queries(self):
+        with self.assertLogs('notebooks.slow_requests', 'WARNING') as logs:
+            self.client.get(self.url)
+        self.assertIn(f'GET {self.url}', logs.output[0])
+        self.assertIn('SELECT', logs.output[0])
+
+
+class DeltaTests(SimpleTestCase):
+    def test_round_trips(self):
+        texts = [
+            '', 'one', 'one\ntwo\n', 'one\ntwo', 'one\r\ntwo\r\n', 'two\none\n',
+            'caf\u00e9\n\U0001f600\n', 'a\n' * 50, 'a\n' * 25 + 'b\n' + 'a\n' * 25,
+        ]
+        for old in texts:
+            for new in texts:
+                self.assertEqual(apply_delta(old, make_delta(old, new)), new, (old, new))
+        # Unchanged lines are copied, not stored
+        self.assertEqual(make_delta('one\ntwo\nthree\n', 'one\n2\nthree\n'), [[0, 1], '2\n', [2, 3]])
+
+
+class ContentCacheTests(SimpleTestCase):
+    def test_bounded_by_total_characters(self):
+        lru = LRUCache(10, sizeof=len)
+        lru.set('a', 'xxxx')
+        lru.set('b', 'xxxx')
+        self.assertEqual(lru.get('a'), 'xxxx')
+        # 'b' is now least recently used
+        lru.set('c', 'xxxx')
+        self.assertIsNone(lru.get('b'))
+        self.assertEqual((lru.get('a'), lru.get('c'), lru.size), ('xxxx', 'xxxx', 8))
+        lru.set('a', 'xx')
+        self.assertEqual(lru.size, 6)
+        # Too big to keep at all, and it replaces the old value
+        lru.set('c', 'x' * 11)
+        self.assertEqual((lru.get('c'), lru.size), (None, 2))
+        lru.delete('a')
+        lru.clear()
+        self.assertEqual((lru.get('a'), lru.size), (None, 0))
+
+
+@override_settings(HIVEMIND_VERSION_STORAGE='delta', HIVEMIND_VERSION_SNAPSHOT_INTERVAL=3)
+class DeltaStorageTests(TestCase):
+    def setUp(self):
+        user = User.objects.create_user(username='owner', password='pw')
+        page = Page.objects.create(title='Page', notebook_id=Notebook.objects.create(title='Notebook', admin_id=user))
+        self.texts = [''.join(f'line {j}\n' for j in range(i + 1)) for i in range(7)]
+        self.versions = []
+        previous = None
+        for text in self.texts:
+            previous = create_version(page, user, previous, text)
+            self.versions.append(previous)
+
+    def test_snapshot_every_interval(self):
+        rows = Version.objects.filter(pk__in=[v.pk for v in self.versions]).order_by('created_at')
+        self.assertEqual([v.chain_depth for v in rows], [0, 1, 2, 0, 1, 2, 0])
+        self.assertEqual([v.delta is None for v in rows], [True, False, False, True, False, False, True])
+        bases = [v.base_version_id for v in rows]
+        self.assertEqual(bases, [None, rows[0].pk, rows[0].pk, None, rows[3].pk, rows[3].pk, None])
+
+    def test_rebuilt_from_chain_and_cached(self):
+        content_cache.clear()
+        last_delta = Version.objects.get(pk=self.versions[5].pk)
+        # The whole snapshot chain in one query
+        with self.assertNumQueries(1):
+            self.assertEqual(last_delta.get_content(), self.texts[5])
+        self.assertEqual(content_cache.get(self.versions[4].pk), self.texts[4])
+
+        fresh = Version.objects.get(pk=self.versions[4].pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(fresh.get_content(), self.texts[4])
+
+        content_cache.clear()
+        for version, text in zip(Version.objects.filter(pk__in=[v.pk for v in self.versions]).order_by('created_at'), self.texts):
+            self.assertEqual(version.get_content(), text)
+
+    @override_settings(HIVEMIND_VERSION_STORAGE='full')
+    def test_full_storage_keeps_whole_texts(self):
+        version = create_version(self.versions[-1].page_id, self.versions[-1].user_id, self.versions[-1], 'new\n')
+        self.assertIsNone(version.delta)
+        self.assertEqual(Version.objects.get(pk=version.pk).get_content(), 'new\n')
+
+
+@override_settings(HIVEMIND_VERSION_STORAGE='delta', HIVEMIND_VERSION_SNAPSHOT_INTERVAL=3)
+class RetentionTests(APITestCase):
+    POLICY = [{'max_age_days': 30, 'keep': 'all'}, {'max_age_days': 365, 'keep': 'day'}]
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='owner', password='pw')
+        self.client.force_authenticate(self.user)
+        self.notebook = Notebook.objects.create(title='Notebook', admin_id=self.user, retention_policy=self.POLICY)
+        self.page = Page.objects.create(title='Page', notebook_id=self.notebook)
+
+    def make_history(self, days_ago):
+        # Midday, so versions a few minutes apart share a calendar day
+        self.now = timezone.now().replace(hour=12, minute=0, second=0, microsecond=0)
+        version, history = None, []
+        for i, days in enumerate(days_ago):
+            version = create_version(self.page, self.user, version, ''.join(f'line {j}\n' for j in range(i + 1)))
+            created_at = self.now - timedelta(days=days, minutes=len(days_ago) - i)
+            Version.objects.filter(pk=version.pk).update(created_at=created_at)
+            history.append(version.version_id)
+        self.page.latest_version = version
+        self.page.save()
+        return history
+
+    def test_policy_is_validated(self):
+        url = reverse('notebook-detail', args=[self.notebook.notebook_id])
+        response = self.client.patch(url, {'retention_policy': [{'keep': 'day'}, {'max_age_days': 5, 'keep': 'all'}]}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_compaction_keeps_policy_versions_with_their_text(self):
+        history = self.make_history([400, 400, 100, 100, 100, 99, 40, 40, 5, 5, 1, 0])
+        texts = {version_id: Version.objects.get(pk=version_id).get_content() for version_id in history}
+
+        kept, removed = compact_notebook(self.notebook, now=self.now, chunk_size=3)
+        self.assertEqual((kept, removed), (7, 5))
+
+        content_cache.clear()
+        versions = list(Version.objects.filter(page_id=self.page).order_by('created_at'))
+        expected = [history[i] for i in (4, 5, 7, 8, 9, 10, 11)]
+        self.assertEqual([v.version_id for v in versions], expected)
+        self.assertIsNone(versions[0].previous_version_id)
+        for older, newer in zip(versions, versions[1:]):
+            self.assertEqual(newer.previous_version_id, older.version_id)
+        for version in versions:
+            self.assertEqual(version.get_content(), texts[version.version_id])
+
+        url = reverse('version-compare', args=[self.notebook.notebook_id, self.page.page_id])
+        response = self.client.get(url, {'version1': str(versions[0].version_id), 'diff': 'line'})
+        self.assertEqual(response.status_code, 200)
+
+
+class CompressedTextTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='owner', password='pw')
+        self.notebook = Notebook.objects.create(title='Notebook', admin_id=self.user)
+        self.page = Page.objects.create(title='Page', notebook_id=self.notebook)
+
+    def stored(self, draft):
+        return Draft.objects.filter(pk=draft.pk).values_list('blob__content', flat=True).get().data
+
+    @override_settings(HIVEMIND_COMPRESSION_MIN_BYTES=100)
+    def test_large_bodies_are_stored_compressed(self):
+        body = 'the same line of pasted log output\n' * 200
+        large = Draft.objects.create(user_id=self.user, page_id=self.page, content=body)
+        small = Draft.objects.create(user_id=self.user, page_id=self.page, content='short ünïcode')
+
+        self.assertLess(len(self.stored(large)), len(body) // 10)
+        self.assertEqual(self.stored(small), PLAIN + 'short ünïcode'.encode())
+        self.assertEqual(Draft.objects.get(pk=large.pk).content, body)
+        self.assertEqual(Draft.objects.get(pk=small.pk).content, 'short ünïcode')
+
+        with override_settings(HIVEMIND_COMPRESSION_CODEC='lzma'):
+            other = Draft.objects.create(user_id=self.user, page_id=self.page, content=body + 'x')
+        self.assertEqual(Draft.objects.get(pk=other.pk).content, body + 'x')
+
+
+class BlobTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='owner', password='pw')
+        self.client.force_authenticate(self.user)
+        self.notebook = Notebook.objects.create(title='Notebook', admin_id=self.user, merge_threshold=1)
+        self.page = Page.objects.create(title='Page', notebook_id=self.notebook)
+
+    @override_settings(HIVEMIND_VERSION_STORAGE='full')
+    def test_text_is_stored_once_from_draft_to_version(self):
+        draft = Draft.objects.create(user_id=self.user, page_id=self.page, content='shared text')
+        Draft.objects.create(user_id=self.user, page_id=self.page, content='shared text')
+        url = reverse('post-list-create', args=[self.notebook.notebook_id, self.page.page_id])
+        post_id = self.client.post(url, {'draft_id': str(draft.draft_id)}, format='json').data['post_id']
+        self.client.patch(reverse('vote-post', args=[self.notebook.notebook_id, self.page.page_id, post_id]))
+        run_pending()
+
+        self.page.refresh_from_db()
+        self.assertEqual(self.page.latest_version.blob_id, draft.blob_id)
+        self.assertEqual(self.page.latest_version.content, 'shared text')
+        self.assertEqual(Blob.objects.count(), 1)
+
+    def test_collector_removes_only_old_unreferenced_blobs(self):
+        draft = Draft.objects.create(user_id=self.user, page_id=self.page, content='first')
+        old_blob = draft.blob_id
+        draft.content = 'second'
+        draft.save()
+        Draft.objects.create(user_id=self.user, page_id=self.page, content='unsaved elsewhere').delete()
+
+        self.assertEqual(collect_blobs(), 0)
+        Blob.objects.update(last_used_at=timezone.now() - timedelta(days=1))
+        self.assertEqual(collect_blobs(), 2)
+        self.assertFalse(Blob.objects.filter(pk=old_blob).exists())
+        self.assertEqual(Draft.objects.get(pk=draft.pk).content, 'second')
+
+
+class ExportImportTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='owner', password='pw')
+        self.voter = User.objects.create_user(username='voter', password='pw')
+        self.client.force_authenticate(self.user)
+        self.notebook = Notebook.objects.create(title='Notebook', admin_id=self.user)
+        self.notebook.user_ids.add(self.voter)
+        self.page = Page.objects.create(title='Page', notebook_id=self.notebook)
+        version = None
+        for i in range(5):
+            version = create_version(self.page, self.user, version, ''.join(f'line {j}\n' for j in range(i + 1)))
+        self.page.latest_version = version
+        self.page.save()
+        draft = Draft.objects.create(user_id=self.voter, page_id=self.page, content='proposal')
+        self.post = Post.objects.create(user_id=self.voter, page_id=self.page, draft_id=draft, content='proposal')
+        toggle_vote(self.post.post_id, self.user)
+        toggle_vote(self.post.post_id, self.voter)
+
+    def test_export_round_trips_through_import(self):
+        history = list(Version.objects.filter(page_id=self.page).order_by('created_at').values_list('version_id', 'previous_version', 'created_at'))
+        texts = {version.version_id: version.get_content() for version in Version.objects.filter(page_id=self.page)}
+
+        response = self.client.get(reverse('notebook-export', args=[self.notebook.notebook_id]))
+        self.assertEqual(response.status_code, 200)
+        lines = streamed_body(response).decode().splitlines()
+        self.assertEqual(json.loads(lines[0])['type'], 'notebook')
+
+        self.notebook.delete()
+        content_cache.clear()
+        notebook, counts = import_lines(lines, batch_size=2)
+
+        self.assertEqual(counts, {'pages': 1, 'versions': 5, 'drafts': 1, 'posts': 1, 'votes': 2})
+        self.assertEqual(notebook.admin_id, self.user)
+        self.assertEqual(list(notebook.user_ids.all()), [self.voter])
+        page = Page.objects.get(pk=self.page.pk)
+        self.assertEqual(page.latest_version_id, history[-1][0])
+        imported = list(Version.objects.filter(page_id=page).order_by('created_at').values_list('version_id', 'previous_version', 'created_at'))
+        self.assertEqual(imported, history)
+        for version in Version.objects.filter(page_id=page):
+            self.assertEqual(version.get_content(), texts[version.version_id])
+        self.assertEqual(Post.objects.get(pk=self.post.pk).votes, 2)
+        self.assertEqual(Vote.objects.filter(post_id=self.post.pk).count(), 2)
+        with self.assertRaises(TransferError):
+            import_lines(lines)
+
+    async def test_export_streams_under_asgi(self):
+        token = await Token.objects.acreate(user=self.user)
+        response = await AsyncClient().get(
+            reverse('notebook-export', args=[self.notebook.notebook_id]), headers={'Authorization': f'Token {token.key}'}
+        )
+        # An async iterator, which ASGI sends record by record instead of buffering
+        self.assertTrue(response.streaming and response.is_async)
+        chunks = [chunk async for chunk in response.streaming_content]
+        self.assertGreater(len(chunks), 1)
+        self.assertEqual(json.loads(chunks[0])['type'], 'notebook')
+        self.assertTrue(all(chunk.decode().count('\n') == 1 for chunk in chunks))
+
+
+class BatchTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='owner', password='pw')
+        self.other = User.objects.create_user(username='other', password='pw')
+        token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+
+    def test_operations_share_results_and_a_transaction(self):
+        operations = [
+            {'method': 'POST', 'path': '/api/notebooks/', 'body': {'title': 'Batched'}},
+            {'method': 'PATCH', 'path': '/api/notebooks/{$0.notebook_id}/', 'body': {'add_user_ids': [str(self.other.id)]}},
+            {'method': 'POST', 'path': '/api/notebooks/{$0.notebook_id}/pages/', 'body': {'title': 'Page'}},
+            {'method': 'POST', 'path': '/api/notebooks/{$0.notebook_id}/drafts/', 'body': {'page_id': '{$2.page_id}'}},
+            {'method': 'PATCH', 'path': '/api/notebooks/{$0.notebook_id}/drafts/{$3.draft_id}', 'body': {'content': '{$1.title} text'}},
+            {'method': 'GET', 'path': '/api/notebooks/{$0.notebook_id}/?expand=user_ids'},
+        ]
+        response = self.client.post(reverse('batch'), {'operations': operations}, format='json')
+        self.assertEqual(response.status_code, 200, response.data)
+        results = response.data['results']
+        self.assertEqual([result['status'] for result in results], [201, 200, 201, 201, 200, 200])
+        self.assertEqual([user['username'] for user in results[5]['body']['user_ids']], ['other'])
+        # Only whole-string references are filled in inside bodies
+        self.assertEqual(Draft.objects.get().content, '{$1.title} text')
+
+        operations[1]['path'] = '/api/notebooks/{$0.missing}/'
+        response = self.client.post(reverse('batch'), {'operations': operations}, format='json')
+        self.assertEqual((response.status_code, response.data['failed']), (400, 1))
+        operations[1]['path'] = '/api/notebooks/{$0.notebook_id}/pages/00000000-0000-0000-0000-000000000000/'
+        response = self.client.post(reverse('batch'), {'operations': operations}, format='json')
+        self.assertEqual((response.status_code, response.data['failed']), (404, 1))
+        self.assertEqual(Notebook.objects.count(), 1)
+
+    @override_settings(HIVEMIND_READ_REPLICAS=['replica'])
+    def test_operations_run_through_middleware_and_read_the_primary(self):
+        reset_metrics()
+        operations = [
+            {'method': 'POST', 'path': '/api/notebooks/', 'body': {'title': 'Batched'}},
+            # A read from the replica alias, which does not exist here, would fail
+            {'method': 'GET', 'path': '/api/notebooks/{$0.notebook_id}/'},
+        ]
+        response = self.client.post(reverse('batch'), {'operations': operations}, format='json')
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(response.data['results'][1]['body']['title'], 'Batched')
+        self.assertIn('hivemind_request_duration_seconds_count{method="GET",view="notebook-detail"} 1', render_metrics())
+
+    def test_operations_use_the_batch_credentials(self):
+        self.client.credentials()
+        self.client.force_authenticate(self.user)
+        operations = [{'method': 'GET', 'path': '/api/me/'}]
+        response = self.client.post(reverse('batch'), {'operations': operations}, format='json')
+        self.assertEqual((response.status_code, response.data['failed']), (401, 0))
+
+    def test_only_notebooks_api_paths_are_allowed(self):
+        for path in ('/auth/users/me/', '/auth/token/logout/', '/api/metrics/', '/api/batch/'):
+            operations = [{'method': 'POST', 'path': path}]
+            response = self.client.post(reverse('batch'), {'operations': operations}, format='json')
+            self.assertEqual(response.status_code, 400, path)
+            self.assertIn('cannot be used in a batch', response.data['detail'])
+        self.assertTrue(Token.objects.exists())
+
+
+class WorkspaceTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='owner', password='pw')
+        self.member = User.objects.create_user(username='member', password='pw')
+        self.client.force_authenticate(self.user)
+        self.notebook = Notebook.objects.create(title='Notebook', admin_id=self.user)
+        self.notebook.user_ids.add(self.member)
+        self.url = reverse('notebook-workspace', args=[self.notebook.notebook_id])
+        for i in range(3):
+            page = Page.objects.create(title=f'Page {i}', notebook_id=self.notebook)
+            page.latest_version = create_version(page, self.member, None, 'text')
+            page.save()
+            draft = Draft.objects.create(user_id=self.member, page_id=page, content='idea')
+            Post.objects.create(user_id=self.member, page_id=page, draft_id=draft, content='idea')
+        self.page = page
+        self.post = Post.objects.filter(page_id=page).get()
+        repair_counters()
+
+    def test_snapshot_is_normalized_and_built_in_fixed_queries(self):
+        notebook_roles(self.user)
+        with self.assertNumQueries(5):
+            data = self.client.get(self.url).data
+        self.assertEqual(set(data['users']), {str(self.user.id), str(self.member.id)})
+        self.assertEqual(len(data['notebook']['page_ids']), 3)
+        page = data['pages'][str(self.page.page_id)]
+        self.assertEqual(page['open_posts'], 1)
+        self.assertEqual(data['versions'][str(page['latest_version'])]['user_id'], self.member.id)
+        self.assertEqual((data['votes'], data['drafts']), ({}, {}))
+
+    def test_writes_invalidate_the_cached_snapshot(self):
+        first = self.client.get(self.url)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(self.url).data, first.data)
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=first['ETag']).status_code, 304)
+
+        toggle_vote(self.post.post_id, self.user)
+        draft = Draft.objects.create(user_id=self.user, page_id=self.page, content='mine')
+        data = self.client.get(self.url).data
+        self.assertEqual(data['votes'], {str(self.post.post_id): self.page.page_id})
+        self.assertEqual(data['drafts'][str(draft.draft_id)]['content_hash'], content_hash('mine'))
+
+        url = reverse('post-list-create', args=[self.notebook.notebook_id, self.page.page_id])
+        self.client.post(url, {'draft_id': str(draft.draft_id)}, format='json')
+        self.assertEqual(self.client.get(self.url).data['pages'][str(self.page.page_id)]['open_posts'], 2)
+        self.notebook.user_ids.remove(self.member)
+        self.assertEqual(self.client.get(self.url).data['notebook']['user_ids'], [])
+
+
+class CounterTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='owner', password='pw')
+        self.member = User.objects.create_user(username='member', password='pw')
+        self.client.force_authenticate(self.user)
+
+    def counts(self):
+        self.notebook.refresh_from_db()
+        self.page.refresh_from_db()
+        return self.notebook.member_count, self.notebook.page_count, self.page.post_count, self.page.version_count
+
+    def test_write_paths_keep_counters_and_repair_restores_them(self):
+        response = self.client.post(reverse('notebook-list-create'), {'title': 'Notebook', 'merge_threshold': 1}, format='json')
+        self.notebook = Notebook.objects.get(pk=response.data['notebook_id'])
+        nb = self.notebook.notebook_id
+        url = reverse('notebook-detail', args=[nb])
+        self.assertEqual(self.client.patch(url, {'add_user_ids': [str(self.member.id)]}, format='json').data['member_count'], 1)
+        page_id = self.client.post(reverse('page-list-create', args=[nb]), {'title': 'Page'}, format='json').data['page_id']
+        self.page = Page.objects.get(pk=page_id)
+
+        posts_url = reverse('post-list-create', args=[nb, page_id])
+        post_ids = []
+        for text in ('one', 'two'):
+            draft = Draft.objects.create(user_id=self.user, page_id=self.page, content=text)
+            post_ids.append(self.client.post(posts_url, {'draft_id': str(draft.draft_id)}, format='json').data['post_id'])
+        self.assertEqual(self.counts(), (1, 1, 2, 1))
+
+        # A stale instance saved in full must not write its counters back
+        stale = Page.objects.get(pk=page_id)
+        self.client.delete(reverse('post-detail', args=[nb, page_id, post_ids[0]]))
+        self.client.patch(reverse('vote-post', args=[nb, page_id, post_ids[1]]))
+        run_pending()
+        stale.title = 'Renamed'
+        stale.save()
+        self.assertEqual(self.counts(), (1, 1, 0, 2))
+
+        Page.objects.update(post_count=7, version_count=0)
+        self.assertEqual(repair_counters(), (0, 1))
+        self.assertEqual(self.counts(), (1, 1, 0, 2))
+
+
+class TokenCacheTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='owner', password='pw')
+        self.token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+        self.url = reverse('current-user')
+
+    def test_tokens_are_cached_until_logout_or_deactivation(self):
+        self.assertEqual(self.client.get(self.url).status_code, 200)
+        with self.assertNumQueries(0):
+            self.assertEqual(resolve_token(self.token.key), self.user)
+
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.client.get(self.url).status_code, 401)
+        self.user.is_active = True
+        self.user.save()
+        self.assertEqual(self.client.get(self.url).status_code, 200)
+
+        self.assertEqual(self.client.post('/auth/token/logout/').status_code, 204)
+        self.assertEqual(self.client.get(self.url).status_code, 401)
+
+
+    def test_auto_mode_shares_the_cache_when_the_backend_is_shared(self):
+        self.assertEqual(cache_mode(), LOCAL)
+        shared = {'default': {'BACKEND': 'django.core.cache.backends.db.DatabaseCache', 'LOCATION': 'cache'}}
+        with self.settings(CACHES=shared):
+            self.assertEqual(cache_mode(), SHARED)
+            with self.settings(HIVEMIND_TOKEN_CACHE=LOCAL):
+                self.assertEqual(cache_mode(), LOCAL)
+
+@override_settings(HIVEMIND_READ_REPLICAS=['replica'])
+class RoutingTests(SimpleTestCase):
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.middleware = ReplicaRoutingMiddleware(lambda request: HttpResponse(ReplicaRouter().db_for_read(Page) or ''))
+
+    def read_alias(self, method, cookies=None):
+        request = self.factory.generic(method, '/api/pages/')
+        request.COOKIES.update(cookies or {})
+        response = self.middleware(request)
+        return response.content.decode() or None, response.cookies
+
+    def test_reads_go_to_replicas_until_the_client_writes(self):
+        self.assertEqual(self.read_alias('GET')[0], 'replica')
+        alias, cookies = self.read_alias('POST')
+        self.assertIsNone(alias)
+        sticky = {name: morsel.value for name, morsel in cookies.items()}
+        # Reads its own write from the primary, in any process; other clients still use the replica
+        self.assertIsNone(self.read_alias('GET', sticky)[0])
+        self.assertEqual(self.read_alias('GET')[0], 'replica')
+        self.assertEqual(self.read_alias('GET', {name: 'forged' for name in sticky})[0], 'replica')
+        self.assertIsNone(ReplicaRouter().db_for_read(Page))
+        self.assertEqual(ReplicaRouter().db_for_write(Page), 'default')
+
+    def test_stickiness_expires(self):
+        sticky = {name: morsel.value for name, morsel in self.read_alias('POST')[1].items()}
+        with override_settings(HIVEMIND_REPLICA_STICKY_SECONDS=-1):
+            self.assertEqual(self.read_alias('GET', sticky)[0], 'replica')
+
+
+class PrimaryCacheFillTests(TestCase):
+    def test_cached_reads_use_the_primary(self):
+        user = User.objects.create_user(username='owner', password='pw')
+        notebook = Notebook.objects.create(title='Notebook', admin_id=user)
+        cache.clear()
+        # An alias that does not exist here: any query routed to it fails
+        token = _read_alias.set('replica')
+        try:
+            self.assertEqual(notebook_roles(user), {notebook.notebook_id: ADMIN})
+            snapshot = cached_snapshot(snapshot_key(notebook.notebook_id, user.pk), notebook.notebook_id, user)
+        finally:
+            _read_alias.reset(token)
+        self.assertEqual(snapshot['notebook']['title'], 'Notebook')
+
+
+@override_settings(HIVEMIND_VERSION_STORAGE='delta', HIVEMIND_VERSION_SNAPSHOT_INTERVAL=3)
+class AsyncReadTests(TransactionTestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='owner', password='pw')
+        self.token = Token.objects.create(user=self.user)
+        self.client.defaults['HTTP_AUTHORIZATION'] = f'Token {self.token.key}'
+        self.notebook = Notebook.objects.create(title='Notebook', admin_id=self.user)
+        self.page = Page.objects.create(title='Page', notebook_id=self.notebook)
+        previous = None
+        for i in range(5):
+            previous = create_version(self.page, self.user, previous, 'line\n' * (i + 1))
+        self.page.latest_version = previous
+        self.page.save()
+        draft = Draft.objects.create(page_id=self.page, user_id=self.user, content='draft')
+        Post.objects.create(page_id=self.page, user_id=self.user, draft_id=draft, content='post', votes=0)
+        repair_counters()
+
+    def test_async_views_respond_like_the_sync_views(self):
+        nb, pg = self.notebook.notebook_id, self.page.page_id
+        first = Version.objects.filter(page_id=self.page).order_by('created_at').first()
+        requests = [
+            (AsyncPageListCreateView, reverse('page-list-create', args=[nb]), {'expand': 'latest_version.content,notebook_id.user_ids'}),
+            (AsyncVersionListView, reverse('version-list', args=[nb, pg]), {'expand': 'user_id,content', 'page_size': 2}),
+            (AsyncVersionSingleView, reverse('version-single', args=[nb, pg, first.version_id]), {'expand': 'content'}),
+            (AsyncPostListCreateView, reverse('post-list-create', args=[nb, pg]), {'expand': 'user_id,content'}),
+            (AsyncVersionCompareView, reverse('version-compare', args=[nb, pg]), {'version1': first.version_id, 'diff': 'word'}),
+            (AsyncVersionCompareView, reverse('version-compare', args=[nb, pg]), {}),
+        ]
+        factory = RequestFactory()
+        for view_class, url, params in requests:
+            view, kwargs = view_class.as_view(), resolve(url).kwargs
+            for headers in ({'Authorization': f'Token {self.token.key}'}, {}):
+                content_cache.clear()
+                response = async_to_sync(view)(factory.get(url, params, headers=headers), **kwargs)
+                content_cache.clear()
+                expected = view.sync_view(factory.get(url, params, headers=headers), **kwargs).render()
+                self.assertEqual(
+                    (response.status_code, response.content, response.get('ETag')),
+                    (expected.status_code, expected.content, expected.get('ETag')),
+                )
+
+        headers = {'Authorization': f'Token {self.token.key}'}
+        url = reverse('version-list', args=[nb, pg])
+        versions = async_to_sync(AsyncVersionListView.as_view())
+        etag = versions(factory.get(url, headers=headers), **resolve(url).kwargs)['ETag']
+        response = versions(factory.get(url, headers={**headers, 'If-None-Match': etag}), **resolve(url).kwargs)
+        self.assertEqual(response.status_code, 304)
+        # Writes go to the sync view
+        url = reverse('page-list-create', args=[nb])
+        request = factory.post(url, {'title': 'Second'}, content_type='application/json', headers=headers)
+        response = async_to_sync(AsyncPageListCreateView.as_view())(request, **resolve(url).kwargs)
+        self.assertEqual(response.status_code, 201)
+
+    async def test_compare_streams_asynchronously(self):
+        first = await Version.objects.filter(page_id=self.page).order_by('created_at').afirst()
+        url = reverse('version-compare', args=[self.notebook.notebook_id, self.page.page_id])
+        params = {'version1': str(first.version_id), 'diff': 'line', 'stream': '1'}
+        headers = {'Authorization': f'Token {self.token.key}'}
+        kwargs = resolve(url).kwargs
+        async_view = AsyncVersionCompareView.as_view()
+        for view in (async_view, sync_to_async(async_view.sync_view)):
+            # Both stream with an async iterator under ASGI
+            response = await view(AsyncRequestFactory().get(url, params, headers=headers), **kwargs)
+            self.assertTrue(response.streaming and response.is_async)
+            chunks = [chunk async for chunk in response.streaming_content]
+            self.assertEqual(json.loads(chunks[0])['granularity'], 'line')
+            self.assertEqual(json.loads(chunks[-1])['stats'], {'inserted': 20, 'deleted': 0})
+
+    def test_async_benchmark(self):
+        generate_dataset(users=3, notebooks=1, members=2, pages=1, versions=3, posts=2, votes=2)
+        results = run_async_benchmark(requests=4, concurrency=(2,), only=['page-list', 'version-compare'])
+        for row in results['endpoints'].values():
+            for mode in ('sync', 'async'):
+                self.assertEqual(row['concurrency']['2'][mode]['errors'], 0)
@@ -0,0 +1,287 @@
+"""Notebook export as NDJSON and the matching bulk import.
+
+An export is one JSON object per line, each with a "type": the notebook
+first, then for every page the page itself, its versions oldest first
+(with full text), the drafts behind its open posts, the posts and their
+votes. Users are referred to by username, so a file can be loaded into
+another deployment.
+"""
+import json
+
+from django.db import transaction
+from django.db.models import Count, F, Q
+from django.utils.dateparse import parse_datetime
+
+from .counters import repair_counters
+from .models import User, Notebook, Page, Version, Draft, Post, Vote
+from .search import rebuild_page_index
+from .versioning import encode_version, prefetch_content, version_content
+
+FORMAT_VERSION = 1
+
+
+class TransferError(ValueError):
+    pass
+
+
+def _username(user):
+    return user.username if user is not None else None
+
+
+def _chunks(queryset, order, size):
+    """Iterate `queryset` in keyset-paginated chunks ordered by `order` (unique last)."""
+    last = None
+    while True:
+        rows = queryset.order_by(*order)
+        if last is not None:
+            rows = rows.filter(**{f'{order[-1]}__gt': last})
+        chunk = list(rows[:size])
+        if not chunk:
+            return
+        yield chunk
+        last = getattr(chunk[-1], order[-1])
+
+
+def export_records(notebook, chunk_size=200):
+    """Yield the export records of `notebook` as dicts, reading `chunk_size` rows at a time."""
+    yield {
+        'type': 'notebook',
+        'format': FORMAT_VERSION,
+        'notebook_id': str(notebook.notebook_id),
+        'title': notebook.title,
+        'admin': _username(notebook.admin_id),
+        'members': list(notebook.user_ids.order_by('username').values_list('username', flat=True)),
+        'merge_threshold': notebook.merge_threshold,
+        'retention_policy': notebook.retention_policy,
+        'created_at': notebook.created_at.isoformat(),
+        'updated_at': notebook.updated_at.isoformat(),
+    }
+
+    for pages in _chunks(Page.objects.filter(notebook_id=notebook), ['page_id'], chunk_size):
+        for page in pages:
+            yield {
+                'type': 'page',
+                'page_id': str(page.page_id),
+                'title': page.title,
+                'latest_version': str(page.latest_version_id) if page.latest_version_id else None,
+                'created_at': page.created_at.isoformat(),
+                'updated_at': page.updated_at.isoformat(),
+            }
+            yield from _page_records(page, chunk_size)
+
+
+def _page_records(page, chunk_size):
+    versions = Version.objects.filter(page_id=page).select_related('user_id', 'blob')
+    last = None
+    while True:
+        # Oldest first, so an importer always has a version's parent already
+        rows = versions.order_by('created_at', 'version_id')
+        if last is not None:
+            rows = rows.filter(
+                Q(created_at__gt=last.created_at)
+                | Q(created_at=last.created_at, version_id__gt=last.version_id)
+            )
+        chunk = list(rows[:chunk_size])
+        if not chunk:
+            break
+        prefetch_content(chunk)
+        for version in chunk:
+            yield {
+                'type': 'version',
+                'version_id': str(version.version_id),
+                'page_id': str(page.page_id),
+                'previous_version': str(version.previous_version_id) if version.previous_version_id else None,
+                'user': _username(version.user_id),
+                'content': version_content(version),
+                'created_at': version.created_at.isoformat(),
+            }
+        last = chunk[-1]
+
+    posts = Post.objects.filter(page_id=page).select_related('user_id', 'blob', 'draft_id__user_id', 'draft_id__blob')
+    for chunk in _chunks(posts, ['post_id'], chunk_size):
+        for post in chunk:
+            draft = post.draft_id
+            if draft is not None:
+                yield {
+                    'type': 'draft',
+                    'draft_id': str(draft.draft_id),
+                    'page_id': str(page.page_id),
+                    'user': _username(draft.user_id),
+                    'content': draft.content,
+                    'created_at': draft.created_at.isoformat(),
+                    'updated_at': draft.updated_at.isoformat(),
+                }
+            yield {
+                'type': 'post',
+                'post_id': str(post.post_id),
+                'page_id': str(page.page_id),
+                'draft_id': str(draft.draft_id) if draft is not None else None,
+                'user': _username(post.user_id),
+                'content': post.content,
+                'votes': post.votes,
+                'created_at': post.created_at.isoformat(),
+                'updated_at': post.updated_at.isoformat(),
+            }
+        voters = Vote.objects.filter(post_id__in=chunk).select_related('user_id').order_by('post_id', 'vote_id')
+        for vote in voters.iterator(chunk_size=chunk_size):
+            yield {'type': 'vote', 'post_id': str(vote.post_id_id), 'user': _username(vote.user_id)}
+
+
+def export_lines(notebook, chunk_size=200):
+    for record in export_records(notebook, chunk_size):
+        yield json.dumps(record) + '\n'
+
+
+class Importer:
+    """Loads export records with one bulk_create per model every `batch_size` rows.
+
+    Everything runs in one transaction. Foreign keys are checked at commit,
+    so versions can name parents and pages their latest version before those
+    rows are written. Versions are delta-encoded against their parent as they
+    arrive, like create_version does.
+    """
+
+    def __init__(self, owner=None, batch_size=500):
+        self.owner = owner
+        self.batch_size = batch_size
+        self.users = {}
+        self.notebook = None
+        self.notebook_record = None
+        self.pending = {Page: [], Version: [], Draft: [], Post: [], Vote: []}
+        # Text of the last version per page, to delta-encode its successor
+        self.last_version = None
+        self.counts = {'pages': 0, 'versions': 0, 'drafts': 0, 'posts': 0, 'votes': 0}
+
+    def user(self, username):
+        if username is None:
+            return None
+        if username not in self.users:
+            self.users[username] = User.objects.filter(username=username).first()
+        return self.users[username]
+
+    def add(self, obj):
+        batch = self.pending[type(obj)]
+        batch.append(obj)
+        if len(batch) >= self.batch_size:
+            self.flush(type(obj))
+
+    def flush(self, model=None):
+        for each in ([model] if model else self.pending):
+            batch = self.pending[each]
+            if not batch:
+                continue
+            each.objects.bulk_create(batch)
+            # auto_now_add/auto_now overwrote the exported timestamps on insert
+            stamps = list(getattr(batch[0], '_exported', {}))
+            if stamps:
+                for obj in batch:
+                    for name in stamps:
+                        setattr(obj, name, obj._exported[name])
+                each.objects.bulk_update(batch, stamps)
+            self.pending[each] = []
+
+    def stamp(self, obj, record, *names):
+        obj._exported = {name: parse_datetime(record[name]) for name in names}
+        return obj
+
+    def load(self, records):
+        with transaction.atomic():
+            for record in records:
+                handler = getattr(self, f"load_{record.get('type')}", None)
+                if handler is None:
+                    raise TransferError(f"Unknown record type {record.get('type')!r}.")
+                if self.notebook is None and record['type'] != 'notebook':
+                    raise TransferError("The first record must be the notebook.")
+                handler(record)
+            if self.notebook is None:
+                raise TransferError("The file has no notebook record.")
+            self.flush()
+            self.finish()
+        return self.notebook
+
+    def load_notebook(self, record):
+        if self.notebook is not None:
+            raise TransferError("The file has more than one notebook record.")
+        if record.get('format') != FORMAT_VERSION:
+            raise TransferError(f"Unsupported export format {record.get('format')!r}.")
+        if Notebook.objects.filter(notebook_id=record['notebook_id']).exists():
+            raise TransferError(f"Notebook {record['notebook_id']} already exists.")
+        self.notebook = Notebook.objects.create(
+            notebook_id=record['notebook_id'],
+            title=record['title'],
+            admin_id=self.owner or self.user(record['admin']),
+            merge_threshold=record['merge_threshold'],
+            retention_policy=record.get('retention_policy'),
+        )
+        members = [self.user(username) for username in record['members']]
+        self.notebook.user_ids.add(*[member for member in members if member is not None])
+        self.notebook_record = record
+
+    def load_page(self, record):
+        self.add(self.stamp(Page(
+            page_id=record['page_id'],
+            notebook_id=self.notebook,
+            title=record['title'],
+            latest_version_id=record['latest_version'],
+        ), record, 'created_at', 'updated_at'))
+        self.counts['pages'] += 1
+
+    def load_version(self, record):
+        version = Version(version_id=record['version_id'], page_id_id=record['page_id'], user_id=self.user(record['user']))
+        previous = self.last_version
+        if previous is None or str(previous.version_id) != record['previous_version'] or previous.page_id_id != record['page_id']:
+            previous = None
+        encode_version(version, record['content'], previous, previous and previous._text)
+        # The parent link is kept even when it could not be delta-encoded against
+        version.previous_version_id = record['previous_version']
+        version._text = record['content']
+        self.last_version = version
+        self.add(self.stamp(version, record, 'created_at'))
+        self.counts['versions'] += 1
+
+    def load_draft(self, record):
+        self.add(self.stamp(Draft(
+            draft_id=record['draft_id'], page_id_id=record['page_id'],
+            user_id=self.user(record['user']), content=record['content'],
+        ), record, 'created_at', 'updated_at'))
+        self.counts['drafts'] += 1
+
+    def load_post(self, record):
+        self.add(self.stamp(Post(
+            post_id=record['post_id'], page_id_id=record['page_id'], draft_id_id=record['draft_id'],
+            user_id=self.user(record['user']), content=record['content'], votes=record['votes'],
+        ), record, 'created_at', 'updated_at'))
+        self.counts['posts'] += 1
+
+    def load_vote(self, record):
+        user = self.user(record['user'])
+        if user is not None:
+            self.add(Vote(post_id_id=record['post_id'], user_id=user))
+            self.counts['votes'] += 1
+
+    def finish(self):
+        # Votes by users missing here were skipped, so recount
+        recount = (
+            Post.objects.filter(page_id__notebook_id=self.notebook)
+            .annotate(voted=Count('post')).exclude(votes=F('voted'))
+            .values_list('post_id', 'voted')
+        )
+        Post.objects.bulk_update(
+            [Post(post_id=post_id, votes=voted) for post_id, voted in recount],
+            ['votes'], batch_size=self.batch_size,
+        )
+        repair_counters(Notebook.objects.filter(pk=self.notebook.pk))
+        for page in Page.objects.filter(notebook_id=self.notebook).select_related('notebook_id').iterator():
+            rebuild_page_index(page)
+        Notebook.objects.filter(pk=self.notebook.pk).update(
+            created_at=parse_datetime(self.notebook_record['created_at']),
+            updated_at=parse_datetime(self.notebook_record['updated_at']),
+        )
+
+
+def import_lines(lines, owner=None, batch_size=500):
+    """Import a notebook from NDJSON lines. Returns (notebook, counts)."""
+    importer = Importer(owner, batch_size)
+    records = (json.loads(line) for line in lines if line.strip())
+    notebook = importer.load(records)
+    return notebook, importer.counts
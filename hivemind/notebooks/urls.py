@@ -1,20 +1,37 @@
-from .views import UserListCreateView, UserDetailView, CurrentUserView, NotebookListCreateView, NotebookDetailView, PageListCreateView, PageDetailView, VersionListView, VersionSingleView, DraftListCreateView, DraftDetailView, PostListCreateView, PostDetailView, PostVoteView, VersionCompareView
+from .views import UserListCreateView, UserDetailView, CurrentUserView, NotebookListCreateView, NotebookDetailView, AsyncPageListCreateView, PageDetailView, AsyncVersionListView, AsyncVersionSingleView, DraftListCreateView, DraftDetailView, AsyncPostListCreateView, PostDetailView, PostVoteView, AsyncVersionCompareView, EventStreamView, EventTicketView, NotebookSearchView, NotebookWorkspaceView, NotebookExportView, BatchView, MetricsView
+from django.conf import settings
 from django.urls import path
 
+
+def read_view(view_class):
+    # HIVEMIND_ASYNC_READ_VIEWS = True serves the async views instead of the sync DRF ones
+    view = view_class.as_view()
+    return view if getattr(settings, 'HIVEMIND_ASYNC_READ_VIEWS', False) else view.sync_view
+
+
 urlpatterns = [
     path('users/', UserListCreateView.as_view(), name='user-list-create'),
     path('users/<uuid:id>/', UserDetailView.as_view(), name='user-detail'),
+    path('batch/', BatchView.as_view(), name='batch'),
+    path('metrics/', MetricsView.as_view(), name='metrics'),
     path('me/', CurrentUserView.as_view(), name='current-user'),
     path('notebooks/', NotebookListCreateView.as_view(), name='notebook-list-create'),
     path('notebooks/<uuid:notebook_id>/', NotebookDetailView.as_view(), name='notebook-detail'),
-    path('notebooks/<uuid:notebook_id>/pages/', PageListCreateView.as_view(), name='page-list-create'),
+    path('notebooks/<uuid:notebook_id>/workspace/', NotebookWorkspaceView.as_view(), name='notebook-workspace'),
+    path('notebooks/<uuid:notebook_id>/export/', NotebookExportView.as_view(), name='notebook-export'),
+    path('notebooks/<uuid:notebook_id>/search/', NotebookSearchView.as_view(), name='notebook-search'),
+    path('notebooks/<uuid:notebook_id>/events/', EventStreamView.as_view(), name='notebook-events'),
+    path('notebooks/<uuid:notebook_id>/events/ticket/', EventTicketView.as_view(), name='notebook-events-ticket'),
+    path('notebooks/<uuid:notebook_id>/pages/', read_view(AsyncPageListCreateView), name='page-list-create'),
     path('notebooks/<uuid:notebook_id>/pages/<uuid:page_id>/', PageDetailView.as_view(), name='page-detail'),
-    path('notebooks/<uuid:notebook_id>/pages/<uuid:page_id>/versions/', VersionListView.as_view(), name='version-list'),
-    path('notebooks/<uuid:notebook_id>/pages/<uuid:page_id>/versions/compare/', VersionCompareView.as_view(), name='version-compare'),
-    path('notebooks/<uuid:notebook_id>/pages/<uuid:page_id>/versions/<uuid:version_id>/', VersionSingleView.as_view(), name='version-single'),
+    path('notebooks/<uuid:notebook_id>/pages/<uuid:page_id>/events/', EventStreamView.as_view(), name='page-events'),
+    path('notebooks/<uuid:notebook_id>/pages/<uuid:page_id>/events/ticket/', EventTicketView.as_view(), name='page-events-ticket'),
+    path('notebooks/<uuid:notebook_id>/pages/<uuid:page_id>/versions/', read_view(AsyncVersionListView), name='version-list'),
+    path('notebooks/<uuid:notebook_id>/pages/<uuid:page_id>/versions/compare/', read_view(AsyncVersionCompareView), name='version-compare'),
+    path('notebooks/<uuid:notebook_id>/pages/<uuid:page_id>/versions/<uuid:version_id>/', read_view(AsyncVersionSingleView), name='version-single'),
     path('notebooks/<uuid:notebook_id>/drafts/', DraftListCreateView.as_view(), name='draft-list-create'),
     path('notebooks/<uuid:notebook_id>/drafts/<uuid:draft_id>', DraftDetailView.as_view(), name='draft-detail'),
-    path('notebooks/<uuid:notebook_id>/pages/<uuid:page_id>/posts/', PostListCreateView.as_view(), name='post-list-create'),
+    path('notebooks/<uuid:notebook_id>/pages/<uuid:page_id>/posts/', read_view(AsyncPostListCreateView), name='post-list-create'),
     path('notebooks/<uuid:notebook_id>/pages/<uuid:page_id>/posts/<uuid:post_id>/', PostDetailView.as_view(), name='post-detail'),
     path('notebooks/<uuid:notebook_id>/pages/<uuid:page_id>/posts/<uuid:post_id>/vote/', PostVoteView.as_view(), name='vote-post'),
 ]
\ No newline at end of file
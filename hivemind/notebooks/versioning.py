@@ -0,0 +1,232 @@
+import difflib
+import threading
+from collections import OrderedDict
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import SynchronousOnlyOperation
+from django.db.models import Q
+
+from .counters import adjust_page
+from .models import Version
+from .search import index_version
+
+
+def storage_mode():
+    return getattr(settings, 'HIVEMIND_VERSION_STORAGE', 'full')
+
+
+def snapshot_interval():
+    return max(1, getattr(settings, 'HIVEMIND_VERSION_SNAPSHOT_INTERVAL', 20))
+
+
+class LRUCache:
+    """Small thread-safe LRU mapping used for immutable version data.
+
+    Holds entries up to a total `maxsize`, each weighing `sizeof(value)`
+    (1 by default, so `maxsize` counts entries). A value heavier than the
+    whole cache is not stored.
+    """
+
+    def __init__(self, maxsize, sizeof=None):
+        self.maxsize = maxsize
+        self.sizeof = sizeof or (lambda value: 1)
+        self.size = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._data:
+                return default
+            self._data.move_to_end(key)
+            return self._data[key][0]
+
+    def set(self, key, value):
+        weight = self.sizeof(value)
+        if weight > self.maxsize:
+            self.delete(key)
+            return
+        with self._lock:
+            self._pop(key)
+            self._data[key] = (value, weight)
+            self.size += weight
+            while self.size > self.maxsize:
+                _, (_, evicted) = self._data.popitem(last=False)
+                self.size -= evicted
+
+    def delete(self, key):
+        with self._lock:
+            self._pop(key)
+
+    def _pop(self, key):
+        entry = self._data.pop(key, None)
+        if entry is not None:
+            self.size -= entry[1]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.size = 0
+
+
+# Rebuilt version texts, bounded by their total length in characters
+content_cache = LRUCache(getattr(settings, 'HIVEMIND_VERSION_CACHE_CHARS', 16_000_000), sizeof=len)
+
+
+def make_delta(old, new):
+    """Encode `new` as a list of ops against `old`.
+
+    Each op is either ``[start, end]`` (copy those lines from `old`) or a
+    string (insert it verbatim). Lines keep their line endings.
+    """
+    old_lines = old.splitlines(keepends=True)
+    new_lines = new.splitlines(keepends=True)
+    matcher = difflib.SequenceMatcher(None, old_lines, new_lines, autojunk=False)
+    ops = []
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == 'equal':
+            ops.append([i1, i2])
+        elif tag in ('replace', 'insert'):
+            ops.append(''.join(new_lines[j1:j2]))
+    return ops
+
+
+def apply_delta(old, ops):
+    old_lines = old.splitlines(keepends=True)
+    parts = []
+    for op in ops:
+        if isinstance(op, str):
+            parts.append(op)
+        else:
+            parts.extend(old_lines[op[0]:op[1]])
+    return ''.join(parts)
+
+
+def encode_version(version, content, previous_version, previous_content=None):
+    """Set `version`'s storage fields to hold `content` after `previous_version`.
+
+    Used for new versions and when compaction relinks a surviving one.
+    """
+    version.previous_version = previous_version
+    if (
+        storage_mode() == 'delta'
+        and previous_version is not None
+        and previous_version.chain_depth + 1 < snapshot_interval()
+    ):
+        if previous_content is None:
+            previous_content = version_content(previous_version)
+        version.delta = make_delta(previous_content, content)
+        version.chain_depth = previous_version.chain_depth + 1
+        version.base_version_id = previous_version.base_version_id or previous_version.version_id
+        version.content = ''
+    else:
+        version.delta = None
+        version.chain_depth = 0
+        version.base_version = None
+        version.content = content
+
+
+def create_version(page, user, previous_version, content):
+    """Create a Version for `page`, delta-encoded when storage mode allows it."""
+    version = Version(user_id=user, page_id=page)
+    encode_version(version, content, previous_version)
+    version.save()
+    adjust_page(version.page_id_id, versions=1)
+    content_cache.set(version.version_id, content)
+    index_version(version, content)
+    return version
+
+
+def _chain_queryset(base_ids):
+    return Version.objects.filter(
+        Q(version_id__in=base_ids) | Q(base_version_id__in=base_ids)
+    ).select_related('blob').only('version_id', 'previous_version', 'delta', 'blob__content')
+
+
+def version_content(version, chain=None):
+    """Return the full text of `version`, rebuilding it from its delta chain.
+
+    `chain` may map version ids to already loaded ancestors; anything
+    missing is fetched with a single query for the whole snapshot chain.
+    """
+    if version.delta is None:
+        return version.content
+
+    rebuilt = getattr(version, '_rebuilt_content', None)
+    if rebuilt is not None:
+        return rebuilt
+    cached = content_cache.get(version.version_id)
+    if cached is not None:
+        return cached
+
+    try:
+        text = _replay(version, dict(chain or {}))
+    except Version.DoesNotExist:
+        # History compaction relinked the chain while we walked it; the
+        # version's row now points at the surviving ancestors
+        text = _replay(Version.objects.get(version_id=version.version_id), {})
+    version._rebuilt_content = text
+    return text
+
+
+def _replay(version, chain):
+    fetched = False
+
+    # Walk back to the nearest snapshot or cached ancestor, then replay forward.
+    pending = []
+    current = version
+    while True:
+        cached = content_cache.get(current.version_id)
+        if cached is not None:
+            text = cached
+            break
+        if current.delta is None:
+            text = current.content
+            break
+        pending.append(current)
+        previous_id = current.previous_version_id
+        if previous_id not in chain and not fetched and content_cache.get(previous_id) is None:
+            chain.update((v.version_id, v) for v in _chain_queryset([version.base_version_id]))
+            fetched = True
+        current = chain.get(previous_id) or Version.objects.get(version_id=previous_id)
+
+    for v in reversed(pending):
+        text = apply_delta(text, v.delta)
+        content_cache.set(v.version_id, text)
+    return text
+
+
+def _unbuilt(versions):
+    return [
+        v for v in versions
+        if v is not None and v.delta is not None
+        and getattr(v, '_rebuilt_content', None) is None
+        and content_cache.get(v.version_id) is None
+    ]
+
+
+def prefetch_content(versions):
+    """Rebuild the text of many versions using one query for all their chains."""
+    pending = _unbuilt(versions)
+    if not pending:
+        return
+    chain = {v.version_id: v for v in _chain_queryset({v.base_version_id for v in pending})}
+    chain.update((v.version_id, v) for v in versions if v is not None)
+    for v in pending:
+        version_content(v, chain)
+
+
+async def aprefetch_content(versions):
+    """prefetch_content for async views, so serializing the versions afterwards runs no queries."""
+    pending = _unbuilt(versions)
+    if not pending:
+        return
+    chain = {v.version_id: v async for v in _chain_queryset({v.base_version_id for v in pending})}
+    chain.update((v.version_id, v) for v in versions if v is not None)
+    for v in pending:
+        try:
+            version_content(v, chain)
+        except SynchronousOnlyOperation:
+            # History compaction relinked the chain; re-read it the sync way
+            await sync_to_async(version_content)(v, chain)
@@ -1,9 +1,122 @@
-from rest_framework import generics, filters, status, permissions, serializers
+from rest_framework import generics, filters, mixins, status, permissions, serializers
 from .models import User, Notebook, Page, Version, Draft, Post, Vote
-from .serializers import UserSerializer, NotebookSerializer, PageSerializer, VersionSerializer, DraftSerializer, PostSerializer
+from .serializers import UserSerializer, NotebookSerializer, PageSerializer, VersionSerializer, DraftSerializer, PostSerializer, SearchResultSerializer
+from .versioning import aprefetch_content, create_version
+from .voting import toggle_vote
+from .merges import enqueue_merge
+from .patches import PatchError, apply_patch, content_hash
+from .pagination import VersionPagination, PostPagination, DraftPagination, NotebookPagination, SearchPagination
+from .search import reindex_title, search_entries
+from .membership import IsNotebookAdminOrReadOnly, IsNotebookMember, anotebook_roles, notebook_roles
+from .metrics import CanReadMetrics, render_metrics
+from .routing import primary_reads
+from .transfer import export_lines
+from .authentication import aresolve_token, authenticate_request
+from .batch import BatchError, parse_operations, run_operation
+from .counters import adjust_notebook, adjust_page, deleted_count, recount_members
+from .workspace import cached_snapshot, snapshot_key
+from .diff import GRANULARITIES, cached_version_diff, diff_stats, iter_hunks
+from rest_framework.exceptions import NotFound, ParseError
+from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
-from django.db import transaction, models
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.db import DEFAULT_DB_ALIAS, transaction, models
+from django.db.models import Exists, OuterRef
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from .events import get_broker, notebook_channel, page_channel, publish_event, read_ticket, stream_ticket
+from django.utils.http import parse_etags, quote_etag
+from asgiref.sync import sync_to_async
+import hashlib
+import itertools
+import json
+
+def streamed(request, iterator, chunk_size=100):
+    """`iterator` in the form the server streams a StreamingHttpResponse from.
+
+    WSGI sends sync iterators as they go, but ASGI buffers them whole, so
+    under ASGI the items are pulled `chunk_size` at a time in the thread a
+    sync view runs in and handed out by an async iterator.
+    """
+    if not isinstance(getattr(request, '_request', request), ASGIRequest):
+        return iterator
+    take = sync_to_async(lambda: list(itertools.islice(iterator, chunk_size)))
+
+    async def items():
+        while chunk := await take():
+            for item in chunk:
+                yield item
+    return items()
+
+class ExpandableQuerysetMixin:
+    """Joins the relations the serializer expands and defers content it leaves out,
+    so list endpoints run a constant number of queries and skip unused bodies."""
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        if self.request.method not in permissions.SAFE_METHODS:
+            return queryset
+        select, prefetch, defer = self.get_serializer().query_plan()
+        if select:
+            queryset = queryset.select_related(*select)
+        if prefetch:
+            queryset = queryset.prefetch_related(*prefetch)
+        if defer:
+            queryset = queryset.defer(*defer)
+        return queryset
+
+class ConditionalGetMixin:
+    """Strong ETags and If-None-Match -> 304 for GET.
+
+    The ETag hashes the query string with validator values read by a small
+    values() query, so a 304 never loads or serializes content bodies.
+    """
+    cache_control = 'private, no-cache'
+
+    def validator_queryset(self):
+        lookups = self.get_serializer().validator_lookups()
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        return self.get_queryset().filter(**{self.lookup_field: self.kwargs[lookup_url_kwarg]}).values_list(*lookups)
+
+    def get_validator(self):
+        """Values that identify the current representation, or None for no ETag."""
+        row = self.validator_queryset().first()
+        return list(row) if row is not None else None
+
+    async def aget_validator(self):
+        row = await self.validator_queryset().afirst()
+        return list(row) if row is not None else None
+
+    def get_cache_control(self):
+        return self.cache_control
+
+    def get_etag(self, request, validator):
+        params = sorted(request.query_params.lists())
+        return quote_etag(hashlib.sha1(json.dumps([params, validator], default=str).encode()).hexdigest())
+
+    def not_modified(self, request, etag):
+        return etag in parse_etags(request.headers.get('If-None-Match', ''))
+
+    def add_validators(self, response, etag):
+        if response.status_code in (status.HTTP_200_OK, status.HTTP_304_NOT_MODIFIED):
+            response['ETag'] = etag
+            response['Cache-Control'] = self.get_cache_control()
+        return response
+
+    def get(self, request, *args, **kwargs):
+        validator = self.get_validator()
+        if validator is None:
+            return super().get(request, *args, **kwargs)
+
+        etag = self.get_etag(request, validator)
+        if self.not_modified(request, etag):
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = super().get(request, *args, **kwargs)
+        return self.add_validators(response, etag)
 
 # Create your views here.
 class UserListCreateView(generics.ListCreateAPIView):
@@ -30,37 +143,34 @@ class CurrentUserView(generics.RetrieveAPIView):
         return self.request.user
 #----
 
-class NotebookListCreateView(generics.ListCreateAPIView):
+class NotebookListCreateView(ExpandableQuerysetMixin, generics.ListCreateAPIView):
     serializer_class = NotebookSerializer
+    pagination_class = NotebookPagination
     permission_classes = [permissions.IsAuthenticated]
     lookup_field = 'notebook_id'
 
     def get_queryset(self):
-        user = self.request.user
-        return (
-            Notebook.objects.filter(admin_id=user) |
-            Notebook.objects.filter(user_ids=user)
-        ).distinct().order_by('-updated_at')
+        roles = notebook_roles(self.request.user, self.request)
+        return Notebook.objects.filter(notebook_id__in=roles).order_by('-updated_at', '-notebook_id')
     
+    @transaction.atomic()
     def perform_create(self, serializer):
         # Set default merge threshold of 3 if not provided
         if 'merge_threshold' not in self.request.data or self.request.data.get('merge_threshold') is None:
             serializer.save(admin_id=self.request.user, merge_threshold=3)
         else:
             serializer.save(admin_id=self.request.user)
+        recount_members(serializer.instance)
 
-class NotebookDetailView(generics.RetrieveUpdateDestroyAPIView):
+class NotebookDetailView(ExpandableQuerysetMixin, generics.RetrieveUpdateDestroyAPIView):
     serializer_class = NotebookSerializer
-    permission_classes = [permissions.IsAuthenticated]
+    permission_classes = [permissions.IsAuthenticated, IsNotebookAdminOrReadOnly]
     lookup_field = 'notebook_id'
 
     def get_queryset(self):
-        user = self.request.user
-        return (
-            Notebook.objects.filter(admin_id=user) |
-            Notebook.objects.filter(user_ids=user)
-        ).distinct().order_by('-updated_at')
+        return Notebook.objects.all()
 
+    @transaction.atomic()
     def perform_update(self, serializer):
         serializer.save()
         notebook = serializer.instance
@@ -73,18 +183,30 @@ class NotebookDetailView(generics.RetrieveUpdateDestroyAPIView):
             notebook.user_ids.add(*User.objects.filter(id__in=add_users))
         if remove_users:
             notebook.user_ids.remove(*User.objects.filter(id__in=remove_users))
+        recount_members(notebook)
         
         return notebook
 
-class PageListCreateView(generics.ListCreateAPIView):
+class PageListCreateView(ExpandableQuerysetMixin, generics.ListCreateAPIView):
     queryset = Page.objects.all()
     serializer_class = PageSerializer
-    permission_classes = [permissions.IsAuthenticated]
+    permission_classes = [permissions.IsAuthenticated, IsNotebookMember]
     lookup_field = 'page_id'
 
+    # ?ordering= choices, read from the page counters
+    orderings = {
+        'posts': ('-post_count', '-created_at'),
+        'versions': ('-version_count', '-created_at'),
+    }
+
     def get_queryset(self):
         notebook_id = self.kwargs.get('notebook_id')
-        return Page.objects.filter(notebook_id=notebook_id).order_by('-created_at')
+        ordering = self.orderings.get(self.request.query_params.get('ordering'), ('-created_at',))
+        return (
+            Page.objects
+            .filter(notebook_id=notebook_id)
+            .order_by(*ordering)
+        )
     
     def create(self, request, *args, **kwargs):
         """Create a new Page and an initial empty Version, return the serialized Page.
@@ -109,49 +231,118 @@ class PageListCreateView(generics.ListCreateAPIView):
             page = serializer.save(notebook_id=notebook)
 
             # create an initial empty Version and attach it
-            version = Version.objects.create(
-                user_id=request.user,
-                page_id=page,
+            version = create_version(
+                page=page,
+                user=request.user,
                 previous_version=None,
                 content=""
             )
             page.latest_version = version
             page.save()
+            adjust_notebook(notebook.pk, pages=1)
+            page.refresh_from_db(fields=['version_count'])
 
         out_serializer = PageSerializer(page, context={'request': request})
         return Response(out_serializer.data, status=status.HTTP_201_CREATED)
 
-class PageDetailView(generics.RetrieveUpdateDestroyAPIView):
-    queryset = Page.objects.all()
+class PageDetailView(ConditionalGetMixin, ExpandableQuerysetMixin, generics.RetrieveUpdateDestroyAPIView):
     serializer_class = PageSerializer
-    permission_classes = [permissions.IsAuthenticated]
+    permission_classes = [permissions.IsAuthenticated, IsNotebookMember]
     lookup_field = 'page_id'
 
-class VersionListView(generics.ListAPIView):
+    def get_queryset(self):
+        return Page.objects.filter(notebook_id=self.kwargs.get('notebook_id'))
+
+    def perform_update(self, serializer):
+        with transaction.atomic():
+            page = serializer.save()
+            if 'title' in serializer.validated_data:
+                reindex_title(page)
+
+    @transaction.atomic()
+    def perform_destroy(self, instance):
+        adjust_notebook(instance.notebook_id_id, pages=-deleted_count(instance.delete(), Page))
+
+class NotebookSearchView(generics.ListAPIView):
+    """Ranked full-text search over a notebook's pages.
+
+    ?q= is the query; ?history=1 also searches earlier versions of each page.
+    """
+    serializer_class = SearchResultSerializer
+    pagination_class = SearchPagination
+    permission_classes = [permissions.IsAuthenticated, IsNotebookMember]
+
+    def get_queryset(self):
+        notebook_id = self.kwargs.get('notebook_id')
+        query = self.request.query_params.get('q', '').strip()
+        if not query:
+            raise serializers.ValidationError({"q": "This parameter is required."})
+        history = self.request.query_params.get('history') in ('1', 'true')
+        return search_entries(notebook_id, query, history=history).select_related('page_id', 'version_id')
+
+    def get_serializer_context(self):
+        return {**super().get_serializer_context(), 'query': self.request.query_params.get('q', '')}
+
+class VersionListView(ConditionalGetMixin, ExpandableQuerysetMixin, generics.ListAPIView):
     serializer_class = VersionSerializer
-    permission_classes = [permissions.IsAuthenticated]
+    pagination_class = VersionPagination
+    permission_classes = [permissions.IsAuthenticated, IsNotebookMember]
     lookup_field = 'version_id'
 
+    # Versions are append-only, so the count and newest timestamp cover the
+    # list. Expanded users can change under it, so those get no ETag.
+    validator_stats = {'count': models.Count('pk'), 'newest': models.Max('created_at')}
+
+    def get_validator(self):
+        if self.get_serializer().validator_lookups() != ['version_id', 'previous_version']:
+            return None
+        stats = self.get_queryset().aggregate(**self.validator_stats)
+        return [stats['count'], stats['newest']]
+
+    async def aget_validator(self):
+        if self.get_serializer().validator_lookups() != ['version_id', 'previous_version']:
+            return None
+        stats = await self.get_queryset().aaggregate(**self.validator_stats)
+        return [stats['count'], stats['newest']]
+
     def get_queryset(self):
         page_id = self.kwargs.get('page_id')
         if not page_id:
             return Version.objects.none()
 
-        versions = Version.objects.filter(page_id=page_id).order_by('created_at')
+        versions = (
+            Version.objects
+            .filter(page_id=page_id, page_id__notebook_id=self.kwargs.get('notebook_id'))
+            .order_by('created_at', 'version_id')
+        )
         return versions
 
-class VersionSingleView(generics.RetrieveAPIView):
-    queryset = Version.objects.all()
+class VersionSingleView(ConditionalGetMixin, ExpandableQuerysetMixin, generics.RetrieveAPIView):
     serializer_class = VersionSerializer
+    permission_classes = [permissions.IsAuthenticated, IsNotebookMember]
     lookup_field = 'version_id'
 
-class DraftListCreateView(generics.ListCreateAPIView):
+    def get_queryset(self):
+        return Version.objects.filter(page_id=self.kwargs.get('page_id'), page_id__notebook_id=self.kwargs.get('notebook_id'))
+
+    def get_cache_control(self):
+        # A version's content never changes, but history compaction can
+        # relink previous_version and expanded users might change
+        if self.get_serializer().validator_lookups() == ['version_id', 'previous_version']:
+            return 'private, max-age=86400'
+        return self.cache_control
+
+class DraftListCreateView(ExpandableQuerysetMixin, generics.ListCreateAPIView):
     serializer_class = DraftSerializer
-    permission_classes = [permissions.IsAuthenticated]
+    pagination_class = DraftPagination
+    permission_classes = [permissions.IsAuthenticated, IsNotebookMember]
     lookup_field = 'draft_id'
     
     def get_queryset(self):
-        return Draft.objects.filter(user_id=self.request.user)
+        return (
+            Draft.objects
+            .filter(user_id=self.request.user, page_id__notebook_id=self.kwargs.get('notebook_id'))
+        )
     
     def create(self, request, *args, **kwargs):
         """Create a new Draft linked to the current user and return the full serialized Draft."""
@@ -164,7 +355,7 @@ class DraftListCreateView(generics.ListCreateAPIView):
 
         # Optionally, verify page existence
         try:
-            page = Page.objects.get(page_id=page_id)
+            page = Page.objects.get(page_id=page_id, notebook_id=self.kwargs.get('notebook_id'))
         except Page.DoesNotExist:
             return Response({"detail": "Page not found."}, status=status.HTTP_404_NOT_FOUND)
 
@@ -177,54 +368,108 @@ class DraftListCreateView(generics.ListCreateAPIView):
         out_serializer = DraftSerializer(draft, context={'request': request})
         return Response(out_serializer.data, status=status.HTTP_201_CREATED)
 
-class DraftDetailView(generics.RetrieveUpdateDestroyAPIView):
+class DraftDetailView(ExpandableQuerysetMixin, generics.RetrieveUpdateDestroyAPIView):
     serializer_class = DraftSerializer
-    permission_classes = [permissions.IsAuthenticated]
+    permission_classes = [permissions.IsAuthenticated, IsNotebookMember]
     lookup_field = 'draft_id'
     
     def get_queryset(self):
-        return Draft.objects.filter(user_id=self.request.user)
+        return Draft.objects.filter(user_id=self.request.user, page_id__notebook_id=self.kwargs.get('notebook_id'))
+
+    @transaction.atomic()
+    def perform_destroy(self, instance):
+        # Posts made from the draft go with it
+        adjust_page(instance.page_id_id, posts=-deleted_count(instance.delete(), Post))
 
-class PostListCreateView(generics.ListCreateAPIView):
+    def partial_update(self, request, *args, **kwargs):
+        """Autosave: with `ops` and `base_hash`, splice the edits into the stored
+        content instead of receiving the whole body. A base that no longer
+        matches gets 412 and the client falls back to sending full content."""
+        if 'ops' not in request.data:
+            return super().partial_update(request, *args, **kwargs)
+
+        base_hash = request.data.get('base_hash')
+        if not isinstance(base_hash, str):
+            raise serializers.ValidationError({"base_hash": "This field is required."})
+
+        with transaction.atomic():
+            draft = get_object_or_404(
+                self.get_queryset().select_for_update().only('draft_id', 'blob', 'user_id'),
+                draft_id=kwargs.get('draft_id')
+            )
+            # Blobs are keyed by content_hash, so a stale base costs no body read
+            if draft.blob_id != base_hash:
+                return Response(
+                    {"detail": "Draft has changed since base_hash.", "content_hash": draft.blob_id},
+                    status=status.HTTP_412_PRECONDITION_FAILED
+                )
+            try:
+                content = apply_patch(draft.content, request.data['ops'])
+            except PatchError as exc:
+                raise serializers.ValidationError({"ops": str(exc)})
+            draft.content = content
+            draft.save(update_fields=['blob', 'updated_at'])
+
+        return Response({
+            "draft_id": draft.draft_id,
+            "content_hash": content_hash(content),
+            "updated_at": draft.updated_at,
+        }, status=status.HTTP_200_OK)
+
+class PostListCreateView(ExpandableQuerysetMixin, generics.ListCreateAPIView):
     serializer_class = PostSerializer
-    permission_classes = [permissions.IsAuthenticated]
+    pagination_class = PostPagination
+    permission_classes = [permissions.IsAuthenticated, IsNotebookMember]
 
     def get_queryset(self):
         page_id = self.kwargs.get('page_id')
+        user = self.request.user
         return (
             Post.objects
-            .filter(page_id=page_id)
-            .order_by('-votes')
+            .filter(page_id=page_id, page_id__notebook_id=self.kwargs.get('notebook_id'))
+            .annotate(voted=Exists(Vote.objects.filter(post_id=OuterRef('pk'), user_id=user)))
+            .order_by('-votes', '-created_at', '-post_id')
         )
     
     def perform_create(self, serializer):
-        draft = get_object_or_404(Draft, draft_id=self.request.data.get('draft_id'), user_id=self.request.user)
-        # Use the content from the request (which should be the draft content) or fall back to draft content
-        content = self.request.data.get('content', draft.content)
-        serializer.save(
-            user_id=self.request.user,
-            page_id=draft.page_id,
-            draft_id=draft,
-            content=content,
-            votes=0
+        draft = get_object_or_404(
+            Draft, draft_id=self.request.data.get('draft_id'), user_id=self.request.user,
+            page_id__notebook_id=self.kwargs.get('notebook_id')
+        )
+        # Use the content from the request (which should be the draft content) or
+        # fall back to the draft's blob, which shares the text without copying it
+        body = {'content': self.request.data['content']} if 'content' in self.request.data else {'blob_id': draft.blob_id}
+        with transaction.atomic():
+            post = serializer.save(
+                user_id=self.request.user,
+                page_id=draft.page_id,
+                draft_id=draft,
+                votes=0,
+                **body
+            )
+            adjust_page(post.page_id_id, posts=1)
+        publish_event(
+            draft.page_id.notebook_id_id, post.page_id_id, 'post_created',
+            post_id=str(post.post_id), user_id=str(self.request.user.id), votes=0
         )
 
-class PostDetailView(generics.RetrieveUpdateDestroyAPIView):
+class PostDetailView(ExpandableQuerysetMixin, generics.RetrieveUpdateDestroyAPIView):
     serializer_class = PostSerializer
-    permission_classes = [permissions.IsAuthenticated]
+    permission_classes = [permissions.IsAuthenticated, IsNotebookMember]
     lookup_field = 'post_id'
 
     def get_queryset(self):
-        return Post.objects.all()
+        return Post.objects.filter(page_id=self.kwargs.get('page_id'), page_id__notebook_id=self.kwargs.get('notebook_id'))
 
     def perform_destroy(self, instance):
         if instance.user_id != self.request.user:
             raise PermissionError("You can only delete your own posts.")
-        instance.delete()
+        with transaction.atomic():
+            adjust_page(instance.page_id_id, posts=-deleted_count(instance.delete(), Post))
 
 class PostVoteView(generics.UpdateAPIView):
     serializer_class = PostSerializer
-    permission_classes = [permissions.IsAuthenticated]
+    permission_classes = [permissions.IsAuthenticated, IsNotebookMember]
     lookup_field = 'post_id'
 
     def get_queryset(self):
@@ -232,85 +477,366 @@ class PostVoteView(generics.UpdateAPIView):
     
     @transaction.atomic()
     def update(self, request, *args, **kwargs):
-        user = request.user
-        post = self.get_object() 
+        post_id = kwargs.get('post_id')
+        result = toggle_vote(post_id, request.user)
+        if result is None:
+            return Response({"detail": "Post not found."}, status=status.HTTP_404_NOT_FOUND)
+        if result.notebook_id != kwargs.get('notebook_id'):
+            # Raising rolls the toggle back
+            raise NotFound("Post not found.")
+
+        publish_event(result.notebook_id, result.page_id, 'vote', post_id=str(post_id), votes=result.votes)
+
+        # Past the merge threshold the merge worker takes over (see merges.py)
+        merge_threshold = result.merge_threshold
+        if merge_threshold is not None and result.votes >= merge_threshold and enqueue_merge(post_id, result.page_id):
+            return Response({"votes": result.votes, "voted": result.voted, "merge_queued": True}, status=status.HTTP_200_OK)
+
+        return Response({"votes": result.votes, "voted": result.voted}, status=status.HTTP_200_OK)
 
-        existing_vote = Vote.objects.filter(post_id=post, user_id=user).first()
+class NotebookWorkspaceView(generics.GenericAPIView):
+    """Everything needed to open a notebook in one normalized response (see workspace.py).
 
-        if existing_vote:
-            post.votes = models.F('votes') - 1
-            existing_vote.delete()
+    Served from the per-user cache when nothing changed, with an ETag for 304s.
+    """
+    permission_classes = [permissions.IsAuthenticated, IsNotebookMember]
+
+    def get(self, request, *args, **kwargs):
+        notebook_id = kwargs.get('notebook_id')
+        key = snapshot_key(notebook_id, request.user.pk)
+        etag = quote_etag(hashlib.sha1(key.encode()).hexdigest())
+        if etag in parse_etags(request.headers.get('If-None-Match', '')):
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
         else:
-            post.votes = models.F('votes') + 1
-            Vote.objects.create(post_id=post, user_id=user)
-
-        post.save()
-        post.refresh_from_db()
-
-        page = post.page_id
-        notebook = page.notebook_id
-
-        # Check if merge threshold is set and if post has enough votes
-        merge_threshold = notebook.merge_threshold
-        if merge_threshold is not None and post.votes >= merge_threshold:
-            new_version = Version.objects.create(
-                user_id=post.user_id,
-                page_id=page,
-                previous_version=page.latest_version,
-                content=post.draft_id.content
-            )
-            page.latest_version = new_version
-            page.save()
+            snapshot = cached_snapshot(key, notebook_id, request.user)
+            if snapshot is None:
+                return Response({"detail": "Notebook not found."}, status=status.HTTP_404_NOT_FOUND)
+            response = Response(snapshot)
+        response['ETag'] = etag
+        response['Cache-Control'] = 'private, no-cache'
+        return response
+
+class NotebookExportView(generics.GenericAPIView):
+    """Stream the whole notebook as NDJSON (see transfer.py); load it with `manage.py import_notebook`."""
+    permission_classes = [permissions.IsAuthenticated, IsNotebookMember]
 
-            post.draft_id.delete()
-            post.delete()
-            return Response({"merged": True, "message": "Post merged into new version."}, status=status.HTTP_200_OK)
+    def get(self, request, *args, **kwargs):
+        notebook = get_object_or_404(Notebook.objects.select_related('admin_id'), notebook_id=kwargs.get('notebook_id'))
+        response = StreamingHttpResponse(streamed(request, export_lines(notebook)), content_type='application/x-ndjson')
+        response['Content-Disposition'] = f'attachment; filename="notebook-{notebook.notebook_id}.ndjson"'
+        return response
+
+class BatchView(generics.GenericAPIView):
+    """Run several operations in one request and one transaction (see batch.py).
+
+    Returns {"results": [{"status", "body"}, ...]}. If an operation fails, the
+    batch is rolled back and answered with that operation's status, the
+    results so far and "failed": its index.
+    """
+    permission_classes = [permissions.IsAuthenticated]
 
-        return Response({"votes": post.votes}, status=status.HTTP_200_OK)
+    def post(self, request, *args, **kwargs):
+        results = []
+        try:
+            operations = parse_operations(request.data)
+            with transaction.atomic(), primary_reads():
+                for index, operation in enumerate(operations):
+                    result = run_operation(request, index, operation, results)
+                    results.append(result)
+                    if result['status'] >= 400:
+                        transaction.set_rollback(True)
+                        return Response({"results": results, "failed": index}, status=result['status'])
+        except BatchError as exc:
+            return Response({"detail": exc.detail, "results": results, "failed": exc.index}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({"results": results}, status=status.HTTP_200_OK)
+
+class MetricsView(generics.GenericAPIView):
+    """Request histograms in the Prometheus text format (see metrics.py)."""
+    permission_classes = [CanReadMetrics]
+
+    def get(self, request, *args, **kwargs):
+        return HttpResponse(render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
 
 class VersionCompareView(generics.GenericAPIView):
     """Compare two versions of a page and return content for diff highlighting."""
-    permission_classes = [permissions.IsAuthenticated]
+    permission_classes = [permissions.IsAuthenticated, IsNotebookMember]
     
     def get(self, request, *args, **kwargs):
         """Get two versions for comparison.
         Query params:
         - version1: UUID of first version (older)
         - version2: UUID of second version (newer) - defaults to latest version if not provided
+        - diff: 'line' or 'word' to get a server-computed edit script instead of both full contents
+        - stream: with diff, stream the edit script as NDJSON hunks, sending
+          the header before the diff is computed
         """
-        page_id = kwargs.get('page_id')
-        version1_id = request.query_params.get('version1')
-        version2_id = request.query_params.get('version2')
-        
-        if not page_id:
-            return Response({"detail": "Page id is required."}, status=status.HTTP_400_BAD_REQUEST)
-        
-        if not version1_id:
-            return Response({"detail": "version1 parameter is required."}, status=status.HTTP_400_BAD_REQUEST)
-        
-        try:
-            page = Page.objects.get(page_id=page_id)
-        except Page.DoesNotExist:
-            return Response({"detail": "Page not found."}, status=status.HTTP_404_NOT_FOUND)
-        
-        try:
-            version1 = Version.objects.get(version_id=version1_id, page_id=page)
-        except Version.DoesNotExist:
-            return Response({"detail": "First version not found."}, status=status.HTTP_404_NOT_FOUND)
-        
+        version1_id, version2_id, granularity = self.get_params()
+        page = self.found(self.page_queryset().first(), "Page not found.")
+        version1 = self.found(self.version_queryset(page, version1_id).first(), "First version not found.")
         if version2_id:
-            try:
-                version2 = Version.objects.get(version_id=version2_id, page_id=page)
-            except Version.DoesNotExist:
-                return Response({"detail": "Second version not found."}, status=status.HTTP_404_NOT_FOUND)
+            version2 = self.found(self.version_queryset(page, version2_id).first(), "Second version not found.")
         else:
             # Default to latest version
-            version2 = page.latest_version
-            if not version2:
-                return Response({"detail": "Page has no latest version."}, status=status.HTTP_404_NOT_FOUND)
-        
+            version2 = self.found(page.latest_version, "Page has no latest version.")
+
+        if granularity and self.streaming():
+            def lines():
+                yield self.diff_header_line(page, version1, version2, granularity)
+                yield from self.diff_lines(cached_version_diff(version1, version2, granularity))
+            return StreamingHttpResponse(streamed(request, lines()), content_type='application/x-ndjson')
+
+        ops = cached_version_diff(version1, version2, granularity) if granularity else None
+        return self.compare_response(request, page, version1, version2, granularity, ops)
+
+    def streaming(self):
+        return self.request.query_params.get('stream') in ('1', 'true')
+
+    def get_params(self):
+        params = self.request.query_params
+        if not params.get('version1'):
+            raise ParseError("version1 parameter is required.")
+        granularity = params.get('diff')
+        if granularity and granularity not in GRANULARITIES:
+            raise ParseError("diff must be 'line' or 'word'.")
+        return params.get('version1'), params.get('version2'), granularity
+
+    def page_queryset(self):
+        return (
+            Page.objects.filter(page_id=self.kwargs.get('page_id'), notebook_id=self.kwargs.get('notebook_id'))
+            .select_related('latest_version__user_id', 'latest_version__blob')
+        )
+
+    def version_queryset(self, page, version_id):
+        # Both versions are shown with their user and content
+        return Version.objects.filter(version_id=version_id, page_id=page).select_related('user_id', 'blob')
+
+    def found(self, obj, detail):
+        if obj is None:
+            raise NotFound(detail)
+        return obj
+
+    def compare_response(self, request, page, version1, version2, granularity, ops):
+        if granularity:
+            return self.diff_response(request, page, version1, version2, granularity, ops)
+
         return Response({
-            "version1": VersionSerializer(version1).data,
-            "version2": VersionSerializer(version2).data,
+            "version1": VersionSerializer(version1, expand=['user_id', 'content']).data,
+            "version2": VersionSerializer(version2, expand=['user_id', 'content']).data,
             "page_title": page.title
-        }, status=status.HTTP_200_OK)
\ No newline at end of file
+        }, status=status.HTTP_200_OK)
+
+    def diff_header(self, page, version1, version2, granularity):
+        return {
+            "version1": VersionSerializer(version1, expand=['user_id']).data,
+            "version2": VersionSerializer(version2, expand=['user_id']).data,
+            "page_title": page.title,
+            "granularity": granularity,
+        }
+
+    def diff_response(self, request, page, version1, version2, granularity, ops):
+        header = self.diff_header(page, version1, version2, granularity)
+        return Response({**header, "ops": ops, "stats": diff_stats(ops)}, status=status.HTTP_200_OK)
+
+    def diff_header_line(self, page, version1, version2, granularity):
+        return json.dumps(self.diff_header(page, version1, version2, granularity), default=str) + "\n"
+
+    def diff_lines(self, ops):
+        """The NDJSON body after the header: the edit script in hunks, then stats."""
+        for hunk in iter_hunks(ops):
+            yield json.dumps({"ops": hunk}) + "\n"
+        yield json.dumps({"stats": diff_stats(ops)}) + "\n"
+
+class EventTicketView(generics.GenericAPIView):
+    """Issues a short-lived ticket for opening a notebook's or page's event stream.
+
+    EventSource can't set headers, so browsers pass the ticket as ?ticket=
+    rather than putting their long-lived API token in the URL (and so in
+    server and proxy logs).
+    """
+    permission_classes = [permissions.IsAuthenticated, IsNotebookMember]
+
+    def post(self, request, notebook_id, page_id=None):
+        if page_id and not Page.objects.filter(page_id=page_id, notebook_id=notebook_id).exists():
+            raise NotFound("Page not found.")
+        return Response({
+            "ticket": stream_ticket(request.user.pk, notebook_id),
+            "expires_in": getattr(settings, 'HIVEMIND_STREAM_TICKET_SECONDS', 60),
+        })
+
+class EventStreamView(View):
+    """Server-Sent Events stream of votes, new posts and merges for a notebook or page.
+
+    Needs an ASGI server, since the response is an open-ended async stream.
+    Clients authenticate with the Authorization header or, from EventSource,
+    with a ticket from EventTicketView passed as ?ticket=.
+    """
+    heartbeat_seconds = 15
+
+    async def get(self, request, notebook_id, page_id=None):
+        user = await self.authenticate(request, notebook_id)
+        if user is None:
+            return JsonResponse({"detail": "Authentication credentials were not provided."}, status=status.HTTP_401_UNAUTHORIZED)
+
+        roles = await sync_to_async(notebook_roles)(user)
+        if notebook_id not in roles:
+            return JsonResponse({"detail": "Notebook not found."}, status=status.HTTP_404_NOT_FOUND)
+        if page_id and not await Page.objects.filter(page_id=page_id, notebook_id=notebook_id).aexists():
+            return JsonResponse({"detail": "Page not found."}, status=status.HTTP_404_NOT_FOUND)
+
+        channel = page_channel(page_id) if page_id else notebook_channel(notebook_id)
+        response = StreamingHttpResponse(self.stream(channel), content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+    async def authenticate(self, request, notebook_id):
+        header = request.headers.get('Authorization', '')
+        if header.startswith('Token '):
+            user = await aresolve_token(header[len('Token '):])
+        elif request.GET.get('ticket'):
+            user_id = read_ticket(request.GET['ticket'], notebook_id)
+            if user_id is None:
+                return None
+            user = await User.objects.using(DEFAULT_DB_ALIAS).filter(pk=user_id).afirst()
+        else:
+            return None
+        if user is None or not user.is_active:
+            return None
+        return user
+
+    async def stream(self, channel):
+        subscription = get_broker().subscribe(channel)
+        try:
+            yield ": connected\n\n"
+            while True:
+                event = await subscription.get(timeout=self.heartbeat_seconds)
+                if event is None:
+                    yield ": keepalive\n\n"
+                    continue
+                yield f"event: {event['type']}\ndata: {json.dumps(event, default=str)}\n\n"
+        finally:
+            subscription.close()
+
+
+class AsyncReadView(View):
+    """Serves GET and HEAD of a DRF view from async code.
+
+    Queries go through the async ORM, so under ASGI a request waiting on the
+    database does not hold a worker thread. The sync DRF view (`view_class`)
+    still provides the queryset, serializer, pagination and permissions, and
+    handles every other method in a thread, as Django runs any sync view.
+    """
+    view_class = None
+    sync_view = None
+
+    @classmethod
+    def as_view(cls):
+        sync_view = cls.view_class.as_view()
+        view = super().as_view(sync_view=sync_view)
+        # Batches run the sync view (see batch.run_operation)
+        view.sync_view = sync_view
+        # As with DRF views, SessionAuthentication does the CSRF checks
+        return csrf_exempt(view)
+
+    async def get(self, request, *args, **kwargs):
+        view = self.view_class()
+        view.args, view.kwargs = args, kwargs
+        request = view.initialize_request(request, *args, **kwargs)
+        view.request = request
+        view.headers = view.default_response_headers
+        try:
+            await authenticate_request(request)
+            await anotebook_roles(request.user, request)
+            view.initial(request, *args, **kwargs)
+            response = await self.respond(view, request)
+        except Exception as exc:
+            response = view.handle_exception(exc)
+        response = view.finalize_response(request, response, *args, **kwargs)
+        if isinstance(getattr(response, 'accepted_renderer', None), JSONRenderer):
+            # JSON renders without queries; Django renders the browsable API in a thread
+            response.render()
+        return response
+
+    async def forward(self, request, *args, **kwargs):
+        return await sync_to_async(self.sync_view)(request, *args, **kwargs)
+
+    post = put = patch = delete = options = forward
+
+    async def respond(self, view, request):
+        if isinstance(view, ConditionalGetMixin):
+            validator = await view.aget_validator()
+            if validator is not None:
+                etag = view.get_etag(request, validator)
+                if view.not_modified(request, etag):
+                    return view.add_validators(Response(status=status.HTTP_304_NOT_MODIFIED), etag)
+                return view.add_validators(await self.content(view, request), etag)
+        return await self.content(view, request)
+
+    async def content(self, view, request):
+        if isinstance(view, mixins.ListModelMixin):
+            return await self.list(view, request)
+        return await self.retrieve(view, request)
+
+    async def list(self, view, request):
+        queryset = view.filter_queryset(view.get_queryset())
+        paginator = view.paginator
+        if paginator is not None:
+            rows = await paginator.apaginate_queryset(queryset, request, view=view)
+        else:
+            rows = [obj async for obj in queryset]
+        serializer = view.get_serializer(rows, many=True)
+        # Rebuilt here so that serializing runs no queries
+        await aprefetch_content([serializer.child.version_for(obj) for obj in rows])
+        if paginator is not None:
+            return view.get_paginated_response(serializer.data)
+        return Response(serializer.data)
+
+    async def retrieve(self, view, request):
+        queryset = view.filter_queryset(view.get_queryset())
+        lookup_url_kwarg = view.lookup_url_kwarg or view.lookup_field
+        try:
+            obj = await queryset.aget(**{view.lookup_field: view.kwargs[lookup_url_kwarg]})
+        except queryset.model.DoesNotExist:
+            raise Http404(f"No {queryset.model._meta.object_name} matches the given query.")
+        view.check_object_permissions(request, obj)
+        serializer = view.get_serializer(obj)
+        await aprefetch_content([serializer.version_for(obj)])
+        return Response(serializer.data)
+
+class AsyncPageListCreateView(AsyncReadView):
+    view_class = PageListCreateView
+
+class AsyncVersionListView(AsyncReadView):
+    view_class = VersionListView
+
+class AsyncVersionSingleView(AsyncReadView):
+    view_class = VersionSingleView
+
+class AsyncPostListCreateView(AsyncReadView):
+    view_class = PostListCreateView
+
+class AsyncVersionCompareView(AsyncReadView):
+    view_class = VersionCompareView
+
+    async def content(self, view, request):
+        version1_id, version2_id, granularity = view.get_params()
+        page = view.found(await view.page_queryset().afirst(), "Page not found.")
+        version1 = view.found(await view.version_queryset(page, version1_id).afirst(), "First version not found.")
+        if version2_id:
+            version2 = view.found(await view.version_queryset(page, version2_id).afirst(), "Second version not found.")
+        else:
+            version2 = view.found(page.latest_version, "Page has no latest version.")
+
+        await aprefetch_content([version1, version2])
+        # Diffing is CPU work; keep it off the event loop
+        diff = sync_to_async(cached_version_diff, thread_sensitive=False)
+        if granularity and view.streaming():
+            # An async iterator, so ASGI sends each line as it is produced
+            async def lines():
+                yield view.diff_header_line(page, version1, version2, granularity)
+                for line in view.diff_lines(await diff(version1, version2, granularity)):
+                    yield line
+            return StreamingHttpResponse(lines(), content_type='application/x-ndjson')
+
+        ops = await diff(version1, version2, granularity) if granularity else None
+        return view.compare_response(request, page, version1, version2, granularity, ops)
@@ -0,0 +1,129 @@
+import uuid
+from collections import namedtuple
+
+from django.db import connection, transaction
+
+from .models import Notebook, Page, Post, Vote
+from .workspace import invalidate_user
+
+VoteResult = namedtuple('VoteResult', ['voted', 'votes', 'page_id', 'notebook_id', 'merge_threshold'])
+
+
+def _names():
+    vote = Vote._meta
+    post = Post._meta
+    page = Page._meta
+    notebook = Notebook._meta
+    return {
+        'vote': connection.ops.quote_name(vote.db_table),
+        'vote_id': connection.ops.quote_name(vote.pk.column),
+        'vote_user': connection.ops.quote_name(vote.get_field('user_id').column),
+        'vote_post': connection.ops.quote_name(vote.get_field('post_id').column),
+        'post': connection.ops.quote_name(post.db_table),
+        'post_id': connection.ops.quote_name(post.pk.column),
+        'votes': connection.ops.quote_name(post.get_field('votes').column),
+        'post_page': connection.ops.quote_name(post.get_field('page_id').column),
+        'page': connection.ops.quote_name(page.db_table),
+        'page_id': connection.ops.quote_name(page.pk.column),
+        'page_notebook': connection.ops.quote_name(page.get_field('notebook_id').column),
+        'notebook': connection.ops.quote_name(notebook.db_table),
+        'notebook_id': connection.ops.quote_name(notebook.pk.column),
+        'threshold': connection.ops.quote_name(notebook.get_field('merge_threshold').column),
+    }
+
+
+# The updated post's page, notebook and merge threshold come back with the
+# new count so the caller needs no follow-up reads.
+RETURNING = """
+RETURNING {votes}, {post_page},
+    (SELECT {page_notebook} FROM {page} WHERE {page_id} = {post_page}),
+    (SELECT {threshold} FROM {notebook} WHERE {notebook_id} = (
+        SELECT {page_notebook} FROM {page} WHERE {page_id} = {post_page}))
+"""
+
+
+# One statement: remove the caller's vote if present, otherwise add it, and
+# apply the difference to the post's counter. The unique (user, post) index
+# makes a concurrent duplicate insert a no-op instead of a double count.
+POSTGRES_TOGGLE = """
+WITH deleted AS (
+    DELETE FROM {vote} WHERE {vote_post} = %(post)s AND {vote_user} = %(user)s
+    RETURNING 1
+), inserted AS (
+    INSERT INTO {vote} ({vote_id}, {vote_post}, {vote_user})
+    SELECT %(vote)s, %(post)s, %(user)s
+    WHERE NOT EXISTS (SELECT 1 FROM deleted)
+      AND EXISTS (SELECT 1 FROM {post} WHERE {post_id} = %(post)s)
+    ON CONFLICT DO NOTHING
+    RETURNING 1
+)
+UPDATE {post}
+SET {votes} = {votes} + (SELECT count(*) FROM inserted) - (SELECT count(*) FROM deleted)
+WHERE {post_id} = %(post)s
+""" + RETURNING + ", (SELECT count(*) FROM inserted)"
+
+
+def _result(voted, row):
+    votes, page_id, notebook_id, merge_threshold = row[:4]
+    return VoteResult(
+        voted, votes,
+        Page._meta.pk.to_python(page_id),
+        Notebook._meta.pk.to_python(notebook_id),
+        merge_threshold,
+    )
+
+
+def toggle_vote(post_id, user):
+    """Toggle `user`'s vote on a post.
+
+    Returns a VoteResult with the caller's new vote state and the post's new
+    count, or None if the post does not exist.
+    """
+    result = _toggle(post_id, user)
+    if result is not None:
+        # The caller's votes are part of their cached workspaces
+        invalidate_user(user.pk)
+    return result
+
+
+def _toggle(post_id, user):
+    params = {
+        'post': Post._meta.pk.get_db_prep_value(post_id, connection),
+        'user': user._meta.pk.get_db_prep_value(user.pk, connection),
+        'vote': Vote._meta.pk.get_db_prep_value(uuid.uuid4(), connection),
+    }
+    names = _names()
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute(POSTGRES_TOGGLE.format(**names), params)
+            row = cursor.fetchone()
+            if row is None:
+                return None
+            return _result(bool(row[4]), row)
+
+        # Backends without data-modifying CTEs: same steps, one statement each.
+        cursor.execute(
+            'DELETE FROM {vote} WHERE {vote_post} = %(post)s AND {vote_user} = %(user)s'.format(**names),
+            params,
+        )
+        if cursor.rowcount:
+            delta = -1
+        else:
+            cursor.execute(
+                'INSERT INTO {vote} ({vote_id}, {vote_post}, {vote_user}) '
+                'SELECT %(vote)s, %(post)s, %(user)s '
+                'WHERE EXISTS (SELECT 1 FROM {post} WHERE {post_id} = %(post)s) '
+                'ON CONFLICT DO NOTHING'.format(**names),
+                params,
+            )
+            delta = 1 if cursor.rowcount else 0
+        params['delta'] = delta
+        cursor.execute(
+            ('UPDATE {post} SET {votes} = {votes} + %(delta)s WHERE {post_id} = %(post)s' + RETURNING).format(**names),
+            params,
+        )
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        return _result(delta > 0, row)
@@ -0,0 +1,201 @@
+"""The notebook workspace snapshot served by GET /api/notebooks/<id>/workspace/.
+
+Everything the frontend needs to open a notebook, in five queries and a
+normalized shape: each entity appears once, keyed by id, and refers to
+others by id. Snapshots are cached per (notebook, user) under two tokens.
+Writes to shared data (the notebook, members, pages, posts) replace the
+notebook's token, and writes to the user's own data (drafts, votes)
+replace the user's token, so no stale snapshot is found again. Tokens are
+replaced through caching.invalidate_on_commit.
+"""
+import uuid
+
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from .caching import cache_timeout, invalidate_on_commit
+from .membership import load_roles
+from .models import User, Notebook, Page, Draft, Post, Vote
+
+
+def notebook_token_key(notebook_id):
+    return f'hivemind:workspace:notebook:{notebook_id}'
+
+
+def user_token_key(user_id):
+    return f'hivemind:workspace:user:{user_id}'
+
+
+def _replace_tokens(keys):
+    keys = [key for key in keys if key is not None]
+    if keys:
+        def replace():
+            cache.set_many({key: uuid.uuid4().hex for key in keys}, cache_timeout('HIVEMIND_WORKSPACE_CACHE_TIMEOUT'))
+        invalidate_on_commit(replace)
+
+
+def invalidate_notebooks(notebook_ids):
+    """Drop every user's cached workspace of these notebooks."""
+    _replace_tokens([notebook_token_key(notebook_id) for notebook_id in notebook_ids if notebook_id is not None])
+
+
+def invalidate_user(user_id):
+    """Drop the user's cached workspaces of every notebook."""
+    if user_id is not None:
+        _replace_tokens([user_token_key(user_id)])
+
+
+def snapshot_key(notebook_id, user_id):
+    """Cache key of the current snapshot; changes whenever it is invalidated."""
+    keys = [notebook_token_key(notebook_id), user_token_key(user_id)]
+    tokens = cache.get_many(keys)
+    if len(tokens) < len(keys):
+        for key in keys:
+            if key not in tokens:
+                cache.add(key, uuid.uuid4().hex, cache_timeout('HIVEMIND_WORKSPACE_CACHE_TIMEOUT'))
+        # Another request may have added a token first
+        tokens = cache.get_many(keys)
+    return f'hivemind:workspace:{notebook_id}:{user_id}:' + ':'.join(tokens.get(key, '') for key in keys)
+
+
+def _user(users, user_id, username):
+    if user_id is not None:
+        users[str(user_id)] = {'id': user_id, 'username': username}
+    return user_id
+
+
+def build_snapshot(notebook_id, user):
+    """The workspace of `notebook_id` as seen by `user`, or None if there is no such notebook.
+
+    Reads the primary even on replica-routed requests, since the snapshot
+    is cached for later requests that must see their own writes.
+    """
+    notebook = (
+        Notebook.objects.using(DEFAULT_DB_ALIAS).filter(notebook_id=notebook_id)
+        .values('notebook_id', 'title', 'admin_id', 'admin_id__username', 'merge_threshold', 'created_at', 'updated_at')
+        .first()
+    )
+    if notebook is None:
+        return None
+    users = {}
+    notebook['admin_id'] = _user(users, notebook['admin_id'], notebook.pop('admin_id__username'))
+    members = Notebook.user_ids.through.objects.using(DEFAULT_DB_ALIAS).filter(notebook_id=notebook_id).values_list('user_id', 'user__username')
+    notebook['user_ids'] = [_user(users, user_id, username) for user_id, username in members.order_by('user__username')]
+
+    pages, versions = {}, {}
+    rows = (
+        Page.objects.using(DEFAULT_DB_ALIAS).filter(notebook_id=notebook_id)
+        .values(
+            'page_id', 'title', 'post_count', 'version_count', 'created_at', 'updated_at', 'latest_version',
+            'latest_version__created_at', 'latest_version__user_id', 'latest_version__user_id__username',
+        )
+        .order_by('created_at', 'page_id')
+    )
+    for row in rows:
+        version_id = row['latest_version']
+        if version_id is not None:
+            versions[str(version_id)] = {
+                'version_id': version_id,
+                'page_id': row['page_id'],
+                'user_id': _user(users, row['latest_version__user_id'], row['latest_version__user_id__username']),
+                'created_at': row['latest_version__created_at'],
+            }
+        pages[str(row['page_id'])] = {
+            'page_id': row['page_id'],
+            'title': row['title'],
+            'latest_version': version_id,
+            'open_posts': row['post_count'],
+            'versions': row['version_count'],
+            'created_at': row['created_at'],
+            'updated_at': row['updated_at'],
+        }
+    notebook['page_ids'] = [page['page_id'] for page in pages.values()]
+
+    votes = Vote.objects.using(DEFAULT_DB_ALIAS).filter(user_id=user, post_id__page_id__notebook_id=notebook_id).values_list('post_id', 'post_id__page_id')
+    drafts = (
+        Draft.objects.using(DEFAULT_DB_ALIAS).filter(user_id=user, page_id__notebook_id=notebook_id)
+        .values('draft_id', 'page_id', 'blob', 'created_at', 'updated_at')
+        .order_by('-updated_at', '-draft_id')
+    )
+    return {
+        'notebook': notebook,
+        'users': users,
+        'pages': pages,
+        'versions': versions,
+        # The caller's votes: post id -> page id
+        'votes': {str(post_id): page_id for post_id, page_id in votes},
+        # The caller's drafts, with content_hash for patching (see DraftDetailView)
+        'drafts': {
+            str(draft['draft_id']): {
+                'draft_id': draft['draft_id'],
+                'page_id': draft['page_id'],
+                'content_hash': draft['blob'],
+                'created_at': draft['created_at'],
+                'updated_at': draft['updated_at'],
+            }
+            for draft in drafts
+        },
+    }
+
+
+def cached_snapshot(key, notebook_id, user):
+    """The snapshot cached under `key` (from snapshot_key), built on a miss."""
+    snapshot = cache.get(key)
+    if snapshot is None:
+        snapshot = build_snapshot(notebook_id, user)
+        if snapshot is not None:
+            cache.set(key, snapshot, cache_timeout('HIVEMIND_WORKSPACE_CACHE_TIMEOUT'))
+    return snapshot
+
+
+def _notebook_of(instance):
+    """Notebook id of a post or draft, without a query when its page is loaded."""
+    if instance.page_id_id is None:
+        return None
+    if type(instance).page_id.is_cached(instance):
+        return instance.page_id.notebook_id_id
+    return Page.objects.filter(pk=instance.page_id_id).values_list('notebook_id', flat=True).first()
+
+
+@receiver(post_save, sender=Notebook)
+@receiver(post_delete, sender=Notebook)
+def notebook_changed(sender, instance, **kwargs):
+    invalidate_notebooks([instance.pk])
+
+
+@receiver(m2m_changed, sender=Notebook.user_ids.through)
+def notebook_members_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            invalidate_notebooks([instance.pk])
+    elif action == 'pre_clear':
+        invalidate_notebooks(instance.user_notebooks.values_list('notebook_id', flat=True))
+    elif action in ('post_add', 'post_remove'):
+        invalidate_notebooks(pk_set)
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, created, update_fields=None, **kwargs):
+    # Usernames appear in the workspaces of every notebook the user is in
+    if not created and (update_fields is None or 'username' in update_fields):
+        invalidate_notebooks(load_roles(instance.pk))
+
+
+@receiver(post_save, sender=Page)
+@receiver(post_delete, sender=Page)
+def page_changed(sender, instance, **kwargs):
+    invalidate_notebooks([instance.notebook_id_id])
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def post_changed(sender, instance, **kwargs):
+    invalidate_notebooks([_notebook_of(instance)])
+
+
+@receiver(post_save, sender=Draft)
+@receiver(post_delete, sender=Draft)
+def draft_changed(sender, instance, **kwargs):
+    invalidate_user(instance.user_id_id)
@@ -1,6 +1,6 @@
 import { useState, forwardRef, useImperativeHandle, useEffect } from 'react'
 import './NotebookList.css'
-import api from '../lib/api'
+import api, { type BatchOperation } from '../lib/api'
 import NotebookItem from './NotebookItem'
 import PageGrid from './PageGrid'
 
@@ -41,7 +41,7 @@ const NotebookList = forwardRef<{ showNewNotebookInput: () => void, closePageVie
       let nb = notebooks.find(n => n.notebook_id === id)
       if (!nb) {
         try {
-          const res = await api.get(`/api/notebooks/${id}/`, true)
+          const res = await api.get(`/api/notebooks/${id}/?expand=admin_id,user_ids`, true)
           if (res.ok && res.body) {
             nb = {
               notebook_id: res.body.notebook_id,
@@ -106,7 +106,7 @@ const NotebookList = forwardRef<{ showNewNotebookInput: () => void, closePageVie
       setIsLoading(true)
       setError(null)
       try {
-        const res = await api.get('/api/notebooks/', true)
+        const res = await api.getAll('/api/notebooks/?expand=admin_id,user_ids', true)
         if (!mounted) return
         
         if (res.ok && Array.isArray(res.body)) {
@@ -237,24 +237,17 @@ const NotebookList = forwardRef<{ showNewNotebookInput: () => void, closePageVie
         payload.user_ids = selectedContributors
       }
       
-      // create the notebook first
-      const res = await api.post('/api/notebooks/', payload, true)
-      
-      if (res.ok && res.body) {
-        const created = res.body
-
-        // if there are contributors, send a patch to add them
-        if (selectedContributors.length > 0) {
-          const patchRes = await api.patch(`/api/notebooks/${created.notebook_id}/`, { add_user_ids: selectedContributors }, true)
-          if (!patchRes.ok) {
-            setError(patchRes.body?.detail || 'Failed to add contributors')
-            console.error('Failed to add contributors', patchRes)
-          }
-        }
+      // create the notebook, add contributors and read it back in one batch
+      const operations: BatchOperation[] = [{ method: 'POST', path: '/api/notebooks/', body: payload }]
+      if (selectedContributors.length > 0) {
+        operations.push({ method: 'PATCH', path: '/api/notebooks/{$0.notebook_id}/', body: { add_user_ids: selectedContributors } })
+      }
+      operations.push({ method: 'GET', path: '/api/notebooks/{$0.notebook_id}/?expand=admin_id,user_ids' })
+      const res = await api.batch(operations)
+      const results = res.body?.results || []
 
-        // fetch the notebook detail to get the updated user list (or reuse created if backend returns it)
-        const detailRes = await api.get(`/api/notebooks/${created.notebook_id}/`, true)
-        const nbData = detailRes.ok ? detailRes.body : created
+      if (res.ok && results.length) {
+        const nbData = results[results.length - 1].body
 
         // Map the response to UI format
         const newNotebook = {
@@ -286,7 +279,8 @@ const NotebookList = forwardRef<{ showNewNotebookInput: () => void, closePageVie
         setSelectedContributors([])
         setSearchQuery('')
       } else {
-        setError(res.body?.detail || 'Failed to create notebook')
+        const failed = results[res.body?.failed]?.body
+        setError(failed?.detail || res.body?.detail || 'Failed to create notebook')
         console.error('Failed to create notebook', res)
       }
     } catch (err) {
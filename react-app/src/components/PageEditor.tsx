@@ -1,5 +1,6 @@
-import { useState } from 'react'
+import { useEffect, useRef, useState } from 'react'
 import api from '../lib/api'
+import { contentHash, spliceOps } from '../lib/textPatch'
 import './PageEditor.css'
 
 export default function PageEditor({ notebookId, pageId, draftId, initialContent, onClose, onSaved }: { notebookId: string, pageId: string, draftId: string, initialContent?: string, onClose: () => void, onSaved?: () => void }) {
@@ -7,13 +8,35 @@ export default function PageEditor({ notebookId, pageId, draftId, initialContent
   const [isSaving, setIsSaving] = useState(false)
   const [error, setError] = useState<string | null>(null)
   const [isPosting, setIsPosting] = useState(false)
+  // Content the server is known to hold, so saves only send what changed since
+  const saved = useRef(initialContent || '')
+
+  const saveDraft = async (text: string) => {
+    const path = `/api/notebooks/${notebookId}/drafts/${draftId}`
+    if (text === saved.current) return { ok: true }
+    const baseHash = await contentHash(saved.current)
+    let res = baseHash
+      ? await api.patch(path, { base_hash: baseHash, ops: spliceOps(saved.current, text) }, true)
+      : null
+    // No hashing available, or the server copy moved on: send the whole body
+    if (!res || !res.ok) res = await api.patch(path, { content: text }, true)
+    if (res.ok) saved.current = text
+    return res
+  }
+
+  // Autosave a couple of seconds after typing stops
+  useEffect(() => {
+    if (content === saved.current) return
+    const timer = setTimeout(() => { saveDraft(content) }, 2000)
+    return () => clearTimeout(timer)
+  }, [content])
 
   const handleSave = async () => {
     setIsSaving(true)
     setError(null)
     try {
       // update the draft content via PATCH
-      const updateRes = await api.patch(`/api/notebooks/${notebookId}/drafts/${draftId}`, { content }, true)
+      const updateRes = await saveDraft(content)
       if (!updateRes.ok) {
         setError('Failed to save draft content')
         setIsSaving(false)
@@ -32,17 +32,17 @@ export default function PageGrid({ notebook, refreshKey }: { notebook: any, refr
       setLoading(true)
       setError(null)
       try {
-        const res = await api.get(`/api/notebooks/${notebook.notebook_id}/pages/`, true)
+        const res = await api.get(`/api/notebooks/${notebook.notebook_id}/pages/?expand=latest_version.content`, true)
         if (!mounted) return
         if (res.ok && Array.isArray(res.body)) {
           setPages(res.body)
           // also fetch drafts (to show draft metadata like last-updated)
           try {
-            const dres = await api.get(`/api/notebooks/${notebook.notebook_id}/drafts/`, true)
+            const dres = await api.getAll(`/api/notebooks/${notebook.notebook_id}/drafts/`, true)
             if (dres.ok && Array.isArray(dres.body)) {
               const map: Record<string, any> = {}
               dres.body.forEach((d: any) => {
-                if (d.page_id && d.page_id.page_id) map[d.page_id.page_id] = d
+                if (d.page_id) map[d.page_id] = d
               })
               setDraftsByPage(map)
             } else {
@@ -101,9 +101,9 @@ export default function PageGrid({ notebook, refreshKey }: { notebook: any, refr
                 <button className="btn primary" onClick={async () => {
                   try {
                     // check for existing drafts for this notebook
-                    const draftsRes = await api.get(`/api/notebooks/${notebook.notebook_id}/drafts/`, true)
+                    const draftsRes = await api.getAll(`/api/notebooks/${notebook.notebook_id}/drafts/?expand=content`, true)
                     if (draftsRes.ok && Array.isArray(draftsRes.body)) {
-                      const existing = draftsRes.body.find((d: any) => d.page_id?.page_id === p.page_id)
+                      const existing = draftsRes.body.find((d: any) => d.page_id === p.page_id)
                       if (existing) {
                         // open editor with existing draft
                         setEditingPage({ ...p, draft_id: existing.draft_id, draft_content: existing.content || '' })
@@ -111,14 +111,14 @@ export default function PageGrid({ notebook, refreshKey }: { notebook: any, refr
                       }
                     }
 
-                    // no existing draft: create one
-                    const createRes = await api.post(`/api/notebooks/${notebook.notebook_id}/drafts/`, { page_id: p.page_id }, true)
+                    // no existing draft: create one and fill in its content in one batch
+                    const starting = p.latest_version?.content || ''
+                    const createRes = await api.batch([
+                      { method: 'POST', path: `/api/notebooks/${notebook.notebook_id}/drafts/`, body: { page_id: p.page_id } },
+                      { method: 'PATCH', path: `/api/notebooks/${notebook.notebook_id}/drafts/{$0.draft_id}`, body: { content: starting } },
+                    ])
                     if (createRes.ok && createRes.body) {
-                      const draft = createRes.body
-                      const draftId = draft.draft_id
-                      const starting = p.latest_version?.content || ''
-                      // initialize draft content
-                      await api.patch(`/api/notebooks/${notebook.notebook_id}/drafts/${draftId}`, { content: starting }, true)
+                      const draftId = createRes.body.results[0].body.draft_id
                       setEditingPage({ ...p, draft_id: draftId, draft_content: starting })
                     } else {
                       console.error('Failed to create draft', createRes)
@@ -142,7 +142,7 @@ export default function PageGrid({ notebook, refreshKey }: { notebook: any, refr
             onSaved={async () => {
               // refresh pages list after saving
               try {
-                const res = await api.get(`/api/notebooks/${notebook.notebook_id}/pages/`, true)
+                const res = await api.get(`/api/notebooks/${notebook.notebook_id}/pages/?expand=latest_version.content`, true)
                 if (res.ok && Array.isArray(res.body)) setPages(res.body)
               } catch (e) {
                 // ignore
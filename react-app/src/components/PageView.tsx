@@ -29,7 +29,7 @@ export default function PageView() {
       try {
         // Load notebook and current user in parallel
         const [notebookRes, userRes] = await Promise.all([
-          api.get(`/api/notebooks/${notebookId}/`, true),
+          api.get(`/api/notebooks/${notebookId}/?expand=admin_id,user_ids`, true),
           api.get('/auth/user/', true)
         ])
         
@@ -109,7 +109,7 @@ export default function PageView() {
     setPageRefreshKey(k => k + 1)
     // Re-fetch notebook data
     if (notebookId) {
-      api.get(`/api/notebooks/${notebookId}/`, true).then(res => {
+      api.get(`/api/notebooks/${notebookId}/?expand=admin_id,user_ids`, true).then(res => {
         if (res.ok && res.body) {
           setNotebook((prev: any) => ({
             ...prev,
@@ -25,17 +25,17 @@ export default function PostsGrid() {
       const post = posts.find(p => p.post_id === postId)
       if (!post) return
       
-      const res = await api.patch(`/api/notebooks/${notebookId}/pages/${post.page_id?.page_id}/posts/${postId}/vote/`, {}, true)
+      const res = await api.patch(`/api/notebooks/${notebookId}/pages/${post.page_id}/posts/${postId}/vote/`, {}, true)
       if (res.ok) {
         if (res.body.merged) {
           // Post was merged and deleted - reload the posts list
           await loadPosts()
         } else {
-          // Update the vote count for this post
+          // Update the vote count for this post; a queued merge arrives as a 'merged' event
           setPosts(prevPosts => 
             prevPosts.map(p => 
               p.post_id === postId 
-                ? { ...p, votes: res.body.votes, voted: !p.voted }
+                ? { ...p, votes: res.body.votes, voted: res.body.voted }
                 : p
             )
           )
@@ -104,7 +104,7 @@ export default function PostsGrid() {
       // fetch posts per page
       await Promise.all(pageList.map(async (p: any) => {
         try {
-          const pres = await api.get(`/api/notebooks/${notebookId}/pages/${p.page_id}/posts/`, true)
+          const pres = await api.getAll(`/api/notebooks/${notebookId}/pages/${p.page_id}/posts/?expand=user_id`, true)
           if (pres.ok && Array.isArray(pres.body)) {
             pres.body.forEach((post: any) => {
               allPosts.push({
@@ -131,6 +131,18 @@ export default function PostsGrid() {
     }
   }
 
+  // Live updates from other users: patch vote counts in place, reload on new posts or merges
+  useEffect(() => {
+    if (!notebookId) return
+    return api.subscribe(`/api/notebooks/${notebookId}/events/`, (event) => {
+      if (event.type === 'vote') {
+        setPosts(prev => prev.map(p => p.post_id === event.post_id ? { ...p, votes: event.votes } : p))
+      } else {
+        loadPosts()
+      }
+    })
+  }, [notebookId])
+
   useEffect(() => {
     loadPosts()
     
@@ -138,7 +150,7 @@ export default function PostsGrid() {
     const loadNotebook = async () => {
       if (!notebookId) return
       try {
-        const res = await api.get(`/api/notebooks/${notebookId}/`, true)
+        const res = await api.get(`/api/notebooks/${notebookId}/?expand=admin_id,user_ids`, true)
         if (res.ok) {
           setNotebook({
             ...res.body,
@@ -221,7 +233,7 @@ export default function PostsGrid() {
                 </div>
                 <button 
                   className="btn primary" 
-                  onClick={() => navigate(`/view/${notebookId}/${post.page_id?.page_id}?post=${post.post_id}`)}
+                  onClick={() => navigate(`/view/${notebookId}/${post.page_id}?post=${post.post_id}`)}
                 >
                   View Changes
                 </button>
@@ -122,15 +122,15 @@ export default function ReadOnlyView() {
     try {
       const res = await api.patch(`/api/notebooks/${notebookId}/pages/${pageId}/posts/${currentPost.post_id}/vote/`, {}, true)
       if (res.ok) {
-        if (res.body.merged) {
-          // Post was merged and deleted - redirect back to posts page since we came from there
+        if (res.body.merged || res.body.merge_queued) {
+          // Post is being merged and will be deleted - redirect back to posts page since we came from there
           navigate(`/posts/${encodeURIComponent(notebookId || '')}`)
         } else {
           // Update the post data
           setCurrentPost((prev: any) => ({
             ...prev,
             votes: res.body.votes,
-            voted: !prev.voted
+            voted: res.body.voted
           }))
         }
       } else {
@@ -155,7 +155,7 @@ export default function ReadOnlyView() {
         }
         
         // Load the current page content
-        const res = await api.get(`/api/notebooks/${notebookId}/pages/${pageId}/`, true)
+        const res = await api.get(`/api/notebooks/${notebookId}/pages/${pageId}/?expand=latest_version.content`, true)
         if (!mounted) return
         if (res.ok && res.body) {
           setTitle(res.body.title || 'Untitled')
@@ -170,7 +170,7 @@ export default function ReadOnlyView() {
         // If we have a post ID, load the post content for comparison
         if (postId) {
           try {
-            const postsRes = await api.get(`/api/notebooks/${notebookId}/pages/${pageId}/posts/`, true)
+            const postsRes = await api.getAll(`/api/notebooks/${notebookId}/pages/${pageId}/posts/?expand=content`, true)
             if (postsRes.ok && Array.isArray(postsRes.body)) {
               const post = postsRes.body.find((p: any) => p.post_id === postId)
               if (post) {
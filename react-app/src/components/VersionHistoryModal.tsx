@@ -12,10 +12,14 @@ interface Version {
   created_at: string
 }
 
+type DiffOp = ['=' | '+' | '-', string]
+
 interface VersionCompareData {
   version1: Version
   version2: Version
   page_title: string
+  // Present when the server computed the diff (?diff=word)
+  ops?: DiffOp[]
 }
 
 interface VersionHistoryModalProps {
@@ -152,11 +156,56 @@ export default function VersionHistoryModal({
     return <pre className="version-content-pre">{result}</pre>
   }
 
+  // Render a server-computed edit script with the same highlighting as renderDiff
+  const renderOps = (ops: DiffOp[]) => (
+    <pre className="version-content-pre">
+      {ops.map(([tag, text], index) => {
+        if (tag === '+') {
+          return (
+            <span
+              key={`op-${index}`}
+              style={{
+                backgroundColor: '#d1ecf1',
+                border: '1px solid #bee5eb',
+                padding: '1px 3px',
+                borderRadius: '2px',
+                fontWeight: 'bold'
+              }}
+              title="This text was added in this version"
+            >
+              {text}
+            </span>
+          )
+        }
+        if (tag === '-') {
+          return (
+            <span
+              key={`op-${index}`}
+              style={{
+                backgroundColor: '#f8d7da',
+                border: '1px solid #f5c6cb',
+                padding: '1px 3px',
+                borderRadius: '2px',
+                fontWeight: 'bold',
+                color: '#721c24',
+                textDecoration: 'line-through'
+              }}
+              title="This text was removed in this version"
+            >
+              {text}
+            </span>
+          )
+        }
+        return <span key={`op-${index}`}>{text}</span>
+      })}
+    </pre>
+  )
+
   const loadVersions = async () => {
     setLoading(true)
     setError(null)
     try {
-      const res = await api.get(`/api/notebooks/${notebookId}/pages/${pageId}/versions/`, true)
+      const res = await api.getAll(`/api/notebooks/${notebookId}/pages/${pageId}/versions/?expand=user_id`, true)
       if (res.ok && Array.isArray(res.body)) {
         setVersions(res.body)
       } else {
@@ -171,8 +220,14 @@ export default function VersionHistoryModal({
   }
 
   const compareWithCurrent = async (version: Version) => {
+    // The history list is loaded without content bodies, fetch this one in full
+    const res = await api.get(`/api/notebooks/${notebookId}/pages/${pageId}/versions/${version.version_id}/?expand=user_id,content`, true)
+    if (!res.ok) {
+      setError('Failed to load version')
+      return
+    }
     setCompareData({
-      version1: version,
+      version1: res.body,
       version2: {
         version_id: 'current',
         user_id: { id: '', username: 'Current' },
@@ -187,7 +242,7 @@ export default function VersionHistoryModal({
   const compareVersions = async (version1: Version, version2: Version) => {
     try {
       const res = await api.get(
-        `/api/notebooks/${notebookId}/pages/${pageId}/versions/compare/?version1=${version1.version_id}&version2=${version2.version_id}`,
+        `/api/notebooks/${notebookId}/pages/${pageId}/versions/compare/?version1=${version1.version_id}&version2=${version2.version_id}&diff=word`,
         true
       )
       if (res.ok) {
@@ -245,7 +300,9 @@ export default function VersionHistoryModal({
                 </button>
               </div>
               <div className="comparison-content">
-                {renderDiff(compareData.version2.content, compareData.version1.content)}
+                {compareData.ops
+                  ? renderOps(compareData.ops)
+                  : renderDiff(compareData.version2.content, compareData.version1.content)}
               </div>
             </div>
           ) : (
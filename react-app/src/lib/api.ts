@@ -28,6 +28,19 @@ export async function get(path: string, withAuth = false) {
   return request(path, { method: 'GET', headers })
 }
 
+// Follow `next` links of a cursor-paginated list and return all results as one array
+export async function getAll(path: string, withAuth = false) {
+  let results: any[] = []
+  let next: string | null = path
+  while (next) {
+    const res = await get(next, withAuth)
+    if (!res.ok || Array.isArray(res.body)) return res
+    results = results.concat(res.body?.results || [])
+    next = res.body?.next ? new URL(res.body.next).pathname + new URL(res.body.next).search : null
+  }
+  return { ok: true, status: 200, body: results }
+}
+
 export async function post(path: string, data?: any, withAuth = false) {
   const headers: Record<string,string> = { 'Content-Type': 'application/json', 'Accept': 'application/json' }
   if (withAuth) {
@@ -64,6 +77,48 @@ export async function put(path: string, data?: any, withAuth = false) {
   return request(path, { method: 'PUT', headers, body: data ? JSON.stringify(data) : undefined })
 }
 
+// Run several requests in one round trip and one transaction. Later operations can
+// use earlier results with `{$N.field}` in their path, or as a whole body value.
+// Returns the usual shape; body.results holds one { status, body } per operation.
+export type BatchOperation = { method: 'GET' | 'POST' | 'PUT' | 'PATCH' | 'DELETE', path: string, body?: any }
+
+export async function batch(operations: BatchOperation[]) {
+  return post('/api/batch/', { operations }, true)
+}
+
+// Listen to a server-sent event stream (vote, post_created, merged); returns an unsubscribe function.
+// EventSource can't send headers, so each connection uses a short-lived ticket from `${path}ticket/`
+// instead of putting the API token in the URL.
+export function subscribe(path: string, onEvent: (event: any) => void) {
+  let source: EventSource | null = null
+  let retry: ReturnType<typeof setTimeout> | undefined
+  let closed = false
+  const handler = (e: MessageEvent) => {
+    try { onEvent(JSON.parse(e.data)) } catch { /* ignore malformed events */ }
+  }
+  const connect = async () => {
+    const res = await post(`${path}ticket/`, undefined, true)
+    if (closed) return
+    if (!res.ok) {
+      retry = setTimeout(connect, 5000)
+      return
+    }
+    source = new EventSource(`${API_BASE}${path}?ticket=${encodeURIComponent(res.body.ticket)}`)
+    ;['vote', 'post_created', 'merged'].forEach(type => source!.addEventListener(type, handler as EventListener))
+    // Tickets expire, so reconnect with a fresh one rather than letting EventSource retry the old URL
+    source.onerror = () => {
+      source?.close()
+      if (!closed) retry = setTimeout(connect, 1000)
+    }
+  }
+  connect()
+  return () => {
+    closed = true
+    clearTimeout(retry)
+    source?.close()
+  }
+}
+
 export { getToken }
 
-export default { get, post, patch, put, del, getToken }
+export default { get, getAll, post, patch, put, del, batch, subscribe, getToken }
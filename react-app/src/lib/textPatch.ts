@@ -0,0 +1,38 @@
+// Helpers for incremental draft saves: the server applies [start, end, text] splices
+// to the content whose SHA-256 matches base_hash (see notebooks/patches.py)
+
+export async function contentHash(text: string): Promise<string | null> {
+  if (!globalThis.crypto?.subtle) return null
+  const digest = await crypto.subtle.digest('SHA-256', new TextEncoder().encode(text))
+  return Array.from(new Uint8Array(digest)).map(b => b.toString(16).padStart(2, '0')).join('')
+}
+
+// Offsets are sent in code points to match Python string indexing
+function codePointLength(text: string) {
+  let n = 0
+  for (const _ of text) n++
+  return n
+}
+
+const isHighSurrogate = (code: number) => code >= 0xd800 && code <= 0xdbff
+const isLowSurrogate = (code: number) => code >= 0xdc00 && code <= 0xdfff
+
+// Single splice covering the changed region between the common prefix and suffix
+export function spliceOps(base: string, text: string): [number, number, string][] {
+  if (base === text) return []
+  const limit = Math.min(base.length, text.length)
+  let prefix = 0
+  while (prefix < limit && base.charCodeAt(prefix) === text.charCodeAt(prefix)) prefix++
+  if (prefix > 0 && isHighSurrogate(base.charCodeAt(prefix - 1))) prefix--
+
+  let suffix = 0
+  while (
+    suffix < limit - prefix &&
+    base.charCodeAt(base.length - 1 - suffix) === text.charCodeAt(text.length - 1 - suffix)
+  ) suffix++
+  if (suffix > 0 && isLowSurrogate(base.charCodeAt(base.length - suffix))) suffix--
+
+  const start = codePointLength(base.slice(0, prefix))
+  const end = start + codePointLength(base.slice(prefix, base.length - suffix))
+  return [[start, end, text.slice(prefix, text.length - suffix)]]
+}